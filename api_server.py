@@ -8,11 +8,15 @@ import socket
 from flask import Flask, request
 from flask_socketio import SocketIO, emit
 
+from config import STREAM_SOCKET_FLUSH_MS, STREAM_SOCKET_FLUSH_CHARS, SEARCH_MAX_RESULTS
+from token_stream import TokenFanout
+
 class ChatServer(threading.Thread):
-    def __init__(self, chat_engine, ui_callback_handler=None):
+    def __init__(self, chat_engine, ui_callback_handler=None, ui_stop_handler=None):
         super().__init__()
         self.chat_engine = chat_engine
-        self.ui_callback_handler = ui_callback_handler
+        self.ui_callback_handler = ui_callback_handler  # (mensaje, sid): turno en el flujo principal
+        self.ui_stop_handler = ui_stop_handler  # (sid) -> bool: detiene el turno de la UI si lo inició sid
         self.daemon = True
         
         self.app = Flask(__name__)
@@ -22,6 +26,12 @@ class ChatServer(threading.Thread):
         self.host = '0.0.0.0'
         self.port = 5000
         
+        # Conversaciones independientes por cliente (sid -> historial, no se persisten)
+        self.sessions = {}
+        # Token de la respuesta en curso de cada cliente (sid -> token): cada uno solo detiene la suya
+        self.generation_tokens = {}
+        self.sessions_lock = threading.Lock()
+        
         # Iniciar servicio de descubrimiento UDP
         self.discovery_thread = threading.Thread(target=self.start_discovery_service)
         self.discovery_thread.daemon = True
@@ -84,6 +94,11 @@ class ChatServer(threading.Thread):
         @self.socketio.on('disconnect')
         def handle_disconnect():
             print(f"[SERVER] Cliente desconectado: {request.sid}")
+            with self.sessions_lock:
+                self.sessions.pop(request.sid, None)
+                cancel_token = self.generation_tokens.pop(request.sid, None)
+            if cancel_token:
+                cancel_token.cancel("cliente desconectado")
 
         @self.socketio.on('client_message')
         def handle_client_message(data):
@@ -92,8 +107,94 @@ class ChatServer(threading.Thread):
             print(f"[SERVER] Mensaje recibido del móvil: {message}")
             
             if message and self.ui_callback_handler:
-                # Inyectar el mensaje en el flujo principal de la UI
-                self.ui_callback_handler(message)
+                # Inyectar el mensaje en el flujo principal de la UI (recordando quién lo envió)
+                self.ui_callback_handler(message, request.sid)
+
+        @self.socketio.on('session_message')
+        def handle_session_message(data):
+            """Mensaje de una conversación propia del cliente (se atiende en paralelo a las demás)"""
+            message = data.get('message', '')
+            if not message:
+                return
+            thread = threading.Thread(target=self.process_session_message, args=(request.sid, message))
+            thread.daemon = True
+            thread.start()
+
+        @self.socketio.on('typing')
+        def handle_typing(data=None):
+            """El móvil avisa de lo que lleva escrito: se precarga en la caché KV"""
+            text = (data or {}).get('text', '').strip()
+            if text:
+                self.chat_engine.prefill_next_turn(partial_message=text, debounce=True)
+
+        @self.socketio.on('search_conversations')
+        def handle_search_conversations(data=None):
+            """Búsqueda de texto completo en las conversaciones guardadas"""
+            data = data or {}
+            query = str(data.get('query') or '').strip()
+            # El límite viene del cliente: entero entre 1 y SEARCH_MAX_RESULTS (si no, el de por defecto)
+            try:
+                limit = min(max(int(data.get('limit')), 1), SEARCH_MAX_RESULTS)
+            except (TypeError, ValueError, OverflowError):
+                limit = None
+            results = self.chat_engine.search_conversations(query, limit) if query else []
+            emit('search_results', {'query': query, 'results': results})
+
+        @self.socketio.on('stop_generation')
+        def handle_stop_generation(data=None):
+            """Detiene la respuesta en curso de la sesión de este cliente (no las de los demás)"""
+            print(f"[SERVER] Petición de parada de {request.sid}")
+            with self.sessions_lock:
+                cancel_token = self.generation_tokens.get(request.sid)
+            if cancel_token is not None:
+                stopped = self.chat_engine.stop_generation(cancel_token)
+            else:
+                # La respuesta a un mensaje del canal principal la genera la UI
+                stopped = bool(self.ui_stop_handler and self.ui_stop_handler(request.sid))
+            emit('generation_stopped', {'stopped': stopped})
+
+    def process_session_message(self, sid, message):
+        """
+        Responde en la sesión privada del cliente.
+        Con inference_mode = "batched" varias sesiones generan a la vez sobre el mismo modelo.
+        """
+        if not self.chat_engine.is_ready():
+            self.socketio.emit('error_message', {'message': "El modelo no está listo"}, to=sid)
+            return
+        
+        with self.sessions_lock:
+            history = self.sessions.setdefault(sid, [])
+            history.append({"role": "user", "content": message})
+            messages = list(history)
+        
+        threshold = self.chat_engine.settings.get("similarity_threshold")
+        rag_context, _ = self.chat_engine.rag.get_context(message, threshold)
+        
+        cancel_token = self.chat_engine.llm.new_cancel_token()
+        with self.sessions_lock:
+            self.generation_tokens[sid] = cancel_token
+        token_stream = TokenFanout().add_sink(
+            lambda text: self.socketio.emit('session_token', {'token': text}, to=sid),
+            interval_ms=STREAM_SOCKET_FLUSH_MS,
+            max_chars=STREAM_SOCKET_FLUSH_CHARS
+        )
+        try:
+            response = self.chat_engine.llm.chat_stream(
+                messages,
+                user_context=rag_context if rag_context else "",
+                callback=token_stream.push,
+                cancel_token=cancel_token
+            )
+        finally:
+            token_stream.close()
+            with self.sessions_lock:
+                if self.generation_tokens.get(sid) is cancel_token:
+                    del self.generation_tokens[sid]
+        
+        with self.sessions_lock:
+            if sid in self.sessions:
+                self.sessions[sid].append({"role": "assistant", "content": response})
+        self.socketio.emit('session_message_done', {'role': 'assistant', 'content': response}, to=sid)
 
     def run(self):
         """Inicia el servidor"""
@@ -112,7 +213,7 @@ class ChatServer(threading.Thread):
             })
 
     def broadcast_token(self, token):
-        """Emite un token de streaming"""
+        """Emite un fragmento de streaming (tokens agrupados por TokenFanout)"""
         if self.socketio:
             self.socketio.emit('token_stream', {
                 'token': token
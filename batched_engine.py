@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de Inferencia por Lotes (continuous batching)
+Atiende varias peticiones a la vez sobre un único modelo: cada una ocupa
+su propia secuencia de la caché KV y sus tokens se decodifican juntos
+en cada llamada a llama_decode
+"""
+
+import queue
+import threading
+
+from config import BATCH_PARALLEL, BATCH_SIZE, BATCH_TOP_K, CONTEXT_LENGTH
+
+
+def _resolve(api, *names):
+    """Devuelve la primera función disponible (los nombres cambian entre versiones de llama.cpp)"""
+    for name in names:
+        fn = getattr(api, name, None)
+        if fn is not None:
+            return fn
+    raise AttributeError(f"llama_cpp no expone ninguna de: {', '.join(names)}")
+
+
+def _apply_kv_options(api, params, plan):
+    """Tipos de la caché KV y flash attention del plan de contexto (si la versión los admite)"""
+    from gguf_metadata import KV_CACHE_TYPES
+    for field in ("type_k", "type_v"):
+        if hasattr(params, field):
+            setattr(params, field, KV_CACHE_TYPES[plan[field]][0])
+    if plan["flash_attn"]:
+        if hasattr(params, "flash_attn_type"):
+            params.flash_attn_type = getattr(api, "LLAMA_FLASH_ATTN_TYPE_ENABLED", 1)
+        elif hasattr(params, "flash_attn"):
+            params.flash_attn = True
+
+
+class BatchRequest:
+    """Petición de generación encolada en el motor por lotes"""
+
+    def __init__(self, prompt_tokens, temperature, max_tokens, stop, callback, cancel_token):
+        self.prompt_tokens = prompt_tokens
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stop = stop or []
+        self.callback = callback
+        self.cancel_token = cancel_token
+
+        self.slot = None
+        self.n_past = 0
+        self.prefilled = 0
+        self.last_token = None
+        self.generated = 0
+        self.pending_bytes = b""
+        self.text = ""
+        self.emitted = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchedInferenceEngine:
+    """
+    Planificador de lotes sobre un Llama ya cargado.
+    Crea un contexto propio con n_parallel secuencias (comparte los pesos del modelo)
+    y mezcla en cada paso el prefill de las peticiones nuevas con el token
+    siguiente de las que ya están generando.
+    """
+
+    def __init__(self, llm, n_parallel=BATCH_PARALLEL, n_ctx_per_seq=CONTEXT_LENGTH,
+                 n_batch=BATCH_SIZE, n_threads=4, kv_options=None):
+        import numpy as np
+        import llama_cpp
+
+        self._np = np
+        self._api = llama_cpp
+        self.llm = llm
+        self.n_parallel = n_parallel
+        self.n_ctx_per_seq = n_ctx_per_seq
+        self.n_batch = n_batch
+        self.n_vocab = llm.n_vocab()
+        self._rng = np.random.default_rng()
+
+        # Contexto propio con una secuencia KV por petición simultánea
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = n_ctx_per_seq * n_parallel
+        params.n_batch = n_batch
+        if hasattr(params, "n_ubatch"):
+            params.n_ubatch = n_batch
+        params.n_seq_max = n_parallel
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+        if kv_options:
+            _apply_kv_options(llama_cpp, params, kv_options)
+
+        model_ptr = llm._model.model if hasattr(llm, "_model") else llm.model
+        new_context = _resolve(llama_cpp, "llama_init_from_model", "llama_new_context_with_model")
+        self.ctx = new_context(model_ptr, params)
+        if not self.ctx:
+            raise RuntimeError("No se pudo crear el contexto de llama.cpp para el motor por lotes")
+
+        if hasattr(llama_cpp, "llama_memory_seq_rm"):
+            memory = llama_cpp.llama_get_memory(self.ctx)
+            self._seq_rm = lambda seq_id: llama_cpp.llama_memory_seq_rm(memory, seq_id, -1, -1)
+        else:
+            seq_rm = _resolve(llama_cpp, "llama_kv_self_seq_rm", "llama_kv_cache_seq_rm")
+            self._seq_rm = lambda seq_id: seq_rm(self.ctx, seq_id, -1, -1)
+
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, n_parallel)
+
+        # Tokens que cierran el turno además de las cadenas de parada
+        self.stop_token_ids = {llm.token_eos()}
+        end_of_turn = llm.tokenize(b"<end_of_turn>", add_bos=False, special=True)
+        if len(end_of_turn) == 1:
+            self.stop_token_ids.add(end_of_turn[0])
+
+        self._queue = queue.Queue()
+        self._free_slots = list(range(n_parallel))
+        self._active = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # --- API pública ---
+
+    def submit(self, prompt, temperature, max_tokens=None, stop=None, callback=None, cancel_token=None):
+        """Encola una generación y devuelve la petición (usar request.done.wait()). prompt: texto o tokens"""
+        if isinstance(prompt, str):
+            prompt_tokens = self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        else:
+            prompt_tokens = list(prompt)
+        room = self.n_ctx_per_seq - len(prompt_tokens)
+        max_tokens = room if max_tokens is None else min(max_tokens, room)
+
+        request = BatchRequest(prompt_tokens, temperature, max_tokens, stop, callback, cancel_token)
+        if room <= 0:
+            request.error = f"Prompt demasiado largo ({len(prompt_tokens)} tokens)"
+            request.done.set()
+            return request
+
+        self._queue.put(request)
+        return request
+
+    def generate(self, prompt, temperature, max_tokens=None, stop=None, callback=None, cancel_token=None):
+        """Genera de forma bloqueante (varios hilos pueden llamarlo a la vez)"""
+        request = self.submit(prompt, temperature, max_tokens, stop, callback, cancel_token)
+        request.done.wait()
+        if request.error:
+            raise RuntimeError(request.error)
+        return request.text
+
+    def close(self):
+        """Detiene el planificador y libera el contexto"""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+        # Las peticiones sin terminar no deben quedarse esperando para siempre
+        pending = list(self._active)
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                pending.append(request)
+        for request in pending:
+            request.error = "Motor por lotes cerrado"
+            request.done.set()
+
+        # Si el planificador sigue dentro de un paso (decode o callback) no se puede liberar
+        # el contexto que está usando: se deja sin liberar antes que arriesgar un uso tras liberar
+        if self._thread.is_alive():
+            print("[WARNING] El planificador por lotes no terminó a tiempo, no se libera su contexto")
+            return
+        self._api.llama_batch_free(self.batch)
+        self._api.llama_free(self.ctx)
+
+    def get_stats(self):
+        return {
+            'active': len(self._active),
+            'queued': self._queue.qsize(),
+            'parallel': self.n_parallel
+        }
+
+    # --- Planificador ---
+
+    def _admit(self, block):
+        """Mete en el lote las peticiones en espera mientras haya secuencias libres"""
+        while self._free_slots:
+            try:
+                request = self._queue.get(block=block and not self._active)
+            except queue.Empty:
+                return
+            if request is None:
+                return
+            if request.cancel_token and request.cancel_token.should_stop():
+                request.done.set()
+                continue
+            request.slot = self._free_slots.pop(0)
+            self._active.append(request)
+            block = False
+
+    def _batch_add(self, token, pos, seq_id, logits):
+        i = self.batch.n_tokens
+        self.batch.token[i] = token
+        self.batch.pos[i] = pos
+        self.batch.n_seq_id[i] = 1
+        self.batch.seq_id[i][0] = seq_id
+        self.batch.logits[i] = logits
+        self.batch.n_tokens += 1
+        return i
+
+    def _build_batch(self):
+        """Un token por secuencia que genera + trozos de prompt de las nuevas hasta llenar n_batch"""
+        self.batch.n_tokens = 0
+        logits_index = {}
+
+        for request in self._active:
+            if request.prefilled == len(request.prompt_tokens):
+                logits_index[id(request)] = self._batch_add(request.last_token, request.n_past, request.slot, True)
+
+        for request in self._active:
+            remaining = len(request.prompt_tokens) - request.prefilled
+            space = self.n_batch - self.batch.n_tokens
+            if remaining <= 0 or space <= 0:
+                continue
+            take = min(remaining, space)
+            for offset in range(take):
+                token = request.prompt_tokens[request.prefilled + offset]
+                is_last = request.prefilled + offset == len(request.prompt_tokens) - 1
+                index = self._batch_add(token, request.n_past + offset, request.slot, is_last)
+                if is_last:
+                    logits_index[id(request)] = index
+            request.prefilled += take
+            request.n_past += take
+
+        return logits_index
+
+    def _sample(self, index, temperature):
+        np = self._np
+        logits_ptr = self._api.llama_get_logits_ith(self.ctx, index)
+        logits = np.ctypeslib.as_array(logits_ptr, shape=(self.n_vocab,))
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        top = np.argpartition(logits, -BATCH_TOP_K)[-BATCH_TOP_K:]
+        scaled = logits[top] / temperature
+        probs = np.exp(scaled - scaled.max())
+        probs /= probs.sum()
+        return int(top[self._rng.choice(len(top), p=probs)])
+
+    @staticmethod
+    def _stop_holdback(text, stops):
+        """Longitud del final del texto que podría ser el comienzo de una cadena de parada"""
+        holdback = 0
+        for stop in stops:
+            for length in range(min(len(stop) - 1, len(text)), 0, -1):
+                if text.endswith(stop[:length]):
+                    holdback = max(holdback, length)
+                    break
+        return holdback
+
+    def _accept_token(self, request, token):
+        """Procesa un token muestreado. Devuelve True si la petición ha terminado"""
+        request.generated += 1
+        if request.cancel_token:
+            request.cancel_token.tokens_generated += 1
+
+        finished = token in self.stop_token_ids
+        if not finished:
+            request.last_token = token
+            request.pending_bytes += self.llm.detokenize([token])
+            try:
+                request.text += request.pending_bytes.decode("utf-8")
+                request.pending_bytes = b""
+            except UnicodeDecodeError:
+                # Carácter multibyte partido entre tokens: esperar al siguiente
+                if len(request.pending_bytes) > 4:
+                    request.text += request.pending_bytes.decode("utf-8", errors="replace")
+                    request.pending_bytes = b""
+
+            cuts = [request.text.find(s) for s in request.stop if s in request.text]
+            if cuts:
+                request.text = request.text[:min(cuts)]
+                finished = True
+
+        if request.generated >= request.max_tokens:
+            finished = True
+        if request.cancel_token and request.cancel_token.should_stop():
+            finished = True
+
+        safe = len(request.text) if finished else len(request.text) - self._stop_holdback(request.text, request.stop)
+        if safe > request.emitted:
+            if request.callback:
+                try:
+                    request.callback(request.text[request.emitted:safe])
+                except Exception as e:
+                    print(f"[ERROR] Callback de streaming: {e}")
+            request.emitted = safe
+        return finished
+
+    def _finish(self, request, error=None):
+        request.error = error
+        self._seq_rm(request.slot)
+        self._active.remove(request)
+        self._free_slots.append(request.slot)
+        request.done.set()
+
+    def _run(self):
+        while not self._closed:
+            self._admit(block=True)
+            if not self._active:
+                continue
+
+            # Cancelaciones durante el prefill
+            for request in list(self._active):
+                if request.cancel_token and request.cancel_token.should_stop():
+                    self._finish(request)
+
+            logits_index = self._build_batch()
+            if self.batch.n_tokens == 0:
+                continue
+
+            result = self._api.llama_decode(self.ctx, self.batch)
+            if result != 0:
+                for request in list(self._active):
+                    self._finish(request, f"llama_decode falló (código {result})")
+                continue
+
+            for request in list(self._active):
+                index = logits_index.get(id(request))
+                if index is None:
+                    continue
+                if request.prefilled == len(request.prompt_tokens) and request.last_token is not None:
+                    request.n_past += 1
+                token = self._sample(index, request.temperature)
+                if self._accept_token(request, token):
+                    self._finish(request)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga de la inferencia concurrente.
+Lanza varios clientes simulados (hilos) que conversan a la vez con el modelo
+y compara el rendimiento agregado en modo secuencial, por lotes y con pool de procesos.
+Requiere el modelo descargado y llama-cpp-python.
+
+Uso:
+    python bench_batching.py --clients 1,2,4 --turns 3 --max-tokens 128
+    python bench_batching.py --modes single,pool --workers 4
+"""
+import sys
+import time
+import argparse
+import threading
+
+import ollama_client
+from ollama_client import LocalLLMClient
+
+QUESTIONS = [
+    "¿Qué es la fotosíntesis?",
+    "Explícame cómo funciona un motor de combustión.",
+    "Dame tres ideas para una cena rápida.",
+    "¿Por qué el cielo es azul?",
+    "Resume la historia de la imprenta.",
+    "¿Cómo se calcula el área de un círculo?",
+    "Escribe un poema corto sobre el mar.",
+    "¿Qué diferencia hay entre un virus y una bacteria?",
+]
+
+
+def simulated_client(client, client_id, turns, results):
+    """Conversación de varios turnos; guarda (tokens, primer token, duración) por turno"""
+    history = []
+    for turn in range(turns):
+        question = QUESTIONS[(client_id + turn) % len(QUESTIONS)]
+        history.append({"role": "user", "content": question})
+
+        count = [0]
+        first_token = [None]
+        start = time.perf_counter()
+
+        def on_token(token):
+            if first_token[0] is None:
+                first_token[0] = time.perf_counter() - start
+            count[0] += 1
+
+        response = client.chat_stream(history, callback=on_token)
+        elapsed = time.perf_counter() - start
+        history.append({"role": "assistant", "content": response})
+        results.append((count[0], first_token[0] or elapsed, elapsed))
+
+
+def run_load(client, n_clients, turns):
+    """Ejecuta n_clients a la vez y devuelve (tokens, segundos, TTFT medio, latencia media)"""
+    results = []
+    threads = [
+        threading.Thread(target=simulated_client, args=(client, i, turns, results))
+        for i in range(n_clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    tokens = sum(r[0] for r in results)
+    ttft = sum(r[1] for r in results) / len(results)
+    latency = sum(r[2] for r in results) / len(results)
+    return tokens, wall, ttft, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la inferencia por lotes")
+    parser.add_argument("--model-type", default=None, help="instruct o base (por defecto, el de settings.json)")
+    parser.add_argument("--clients", default="1,2,4", help="Niveles de concurrencia separados por comas")
+    parser.add_argument("--turns", type=int, default=3, help="Turnos por cliente")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Límite de tokens por respuesta")
+    parser.add_argument("--parallel", type=int, default=None, help="Secuencias del motor por lotes")
+    parser.add_argument("--modes", default="single,batched", help="Modos a comparar: single, batched, pool")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos del pool (por defecto, según núcleos)")
+    args = parser.parse_args()
+
+    ollama_client.MAX_TOKENS = args.max_tokens
+    levels = [int(n) for n in args.clients.split(",")]
+
+    rows = []
+    for mode in args.modes.split(","):
+        client = LocalLLMClient()
+        client.inference_mode = mode
+        client.batch_parallel = args.parallel or max(levels)
+        client.pool_workers = args.workers
+        if not client.initialize(args.model_type):
+            print("❌ No se pudo cargar el modelo")
+            return
+        if mode != "single" and client.parallel_engine is None:
+            print(f"❌ No se pudo iniciar el modo {mode}")
+            return
+
+        for n_clients in levels:
+            sys.stdout.write(f"\r   [{mode}] {n_clients} clientes...")
+            sys.stdout.flush()
+            rows.append((mode, n_clients) + run_load(client, n_clients, args.turns))
+        client.set_inference_mode("single")
+    print()
+
+    print("\n=== Resultados ===")
+    print(f"{'modo':>8} {'clientes':>8} {'tok/s':>8} {'TTFT (s)':>9} {'latencia (s)':>13}")
+    for mode, n_clients, tokens, wall, ttft, latency in rows:
+        rate = tokens / wall if wall > 0 else 0
+        print(f"{mode:>8} {n_clients:>8} {rate:>8.1f} {ttft:>9.2f} {latency:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
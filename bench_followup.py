@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Mide lo que ahorra la continuación espontánea ("Aurora sigue hablando") al
+reutilizar la caché KV de la respuesta recién generada.
+Compara el primer token de:
+- antes: chat_stream con el historial sin la respuesta y la respuesta pegada en la instrucción
+- ahora: continue_stream (prompt anterior + respuesta + instrucción oculta)
+
+Uso:
+    python bench_followup.py --trials 5
+    python bench_followup.py --fake   # sin modelo, con el backend simulado
+"""
+import time
+import argparse
+
+from ollama_client import LocalLLMClient
+
+HISTORY = [
+    {"role": "user", "content": "Hola, ¿qué tal? Estoy preparando un viaje a Galicia."},
+    {"role": "assistant", "content": "¡Qué bien! Galicia tiene costa, buena comida y mucha lluvia. ¿Cuándo vas?"},
+    {"role": "user", "content": "En septiembre, una semana. ¿Qué me recomiendas ver?"},
+    {"role": "assistant", "content": "Santiago, las Rías Baixas y la Costa da Morte son imprescindibles."},
+    {"role": "user", "content": "¿Y qué platos típicos debería probar?"},
+]
+INSTRUCTION = ("(Sientes que te has quedado con ganas de decir algo más tras tu respuesta anterior. "
+               "Continúa tu pensamiento de forma espontánea y natural, añadiendo algún detalle o reflexión extra sin repetirte.)")
+
+
+def timed(call):
+    """Ejecuta call(callback) y devuelve los segundos hasta el primer token"""
+    start = time.perf_counter()
+    first = []
+
+    def on_token(token):
+        if not first:
+            first.append(time.perf_counter())
+
+    call(on_token)
+    return (first[0] if first else time.perf_counter()) - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuación con y sin reutilizar la caché KV")
+    parser.add_argument("--trials", type=int, default=3, help="Repeticiones de cada variante")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Límite de tokens por respuesta")
+    parser.add_argument("--fake", action="store_true", help="Usar el backend simulado")
+    args = parser.parse_args()
+
+    client = LocalLLMClient()
+    if args.fake:
+        client.set_backend("fake", {"response_tokens": args.max_tokens})
+    if not client.initialize():
+        print("❌ No se pudo cargar el modelo")
+        return
+    client.response_cache_enabled = False
+
+    before, after = [], []
+    for trial in range(args.trials):
+        token = client.new_cancel_token(max_tokens=args.max_tokens)
+        response = client.chat_stream(HISTORY, cancel_token=token)
+
+        # Antes: se vuelve a evaluar todo con la respuesta dentro de la instrucción
+        old_instruction = INSTRUCTION.replace("anterior.", f"anterior: '{response}'.")
+        before.append(timed(lambda cb: client.chat_stream(
+            HISTORY, user_context=old_instruction, callback=cb,
+            cancel_token=client.new_cancel_token(max_tokens=args.max_tokens)
+        )))
+
+        # Ahora: misma respuesta (misma caché KV) y continuación encima
+        client.chat_stream(HISTORY, cancel_token=client.new_cancel_token(max_tokens=args.max_tokens))
+        after.append(timed(lambda cb: client.continue_stream(
+            INSTRUCTION, callback=cb,
+            cancel_token=client.new_cancel_token(max_tokens=args.max_tokens)
+        )))
+        print(f"   intento {trial + 1}: antes {before[-1] * 1000:.0f} ms, ahora {after[-1] * 1000:.0f} ms")
+
+    mean_before = sum(before) / len(before) * 1000
+    mean_after = sum(after) / len(after) * 1000
+    print("\n=== Primer token de la continuación ===")
+    print(f"Antes: {mean_before:.0f} ms   Ahora: {mean_after:.0f} ms   Ahorro: {mean_before - mean_after:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de decodificación especulativa (prompt lookup).
+Reproduce las conversaciones guardadas en 'conversaciones/' y compara tokens/s
+con y sin borrador n-grama. Requiere el modelo descargado y llama-cpp-python.
+
+Uso:
+    python bench_speculative.py --model-type instruct --draft-tokens 10 --max-turns 20
+"""
+import sys
+import time
+import argparse
+
+import ollama_client
+from ollama_client import LocalLLMClient
+from conversation_manager import ConversationManager
+
+
+def load_replay_turns(max_turns):
+    """Obtiene (historial hasta el mensaje del usuario) para cada respuesta guardada de Aurora"""
+    turns = []
+    manager = ConversationManager()
+    for conversation in sorted(manager.list_conversations(), key=lambda c: c["id"]):
+        # Instantánea con el diario aplicado
+        data = manager.load_conversation(conversation["id"])
+        messages = (data or {}).get("messages", [])
+
+        for i, msg in enumerate(messages):
+            if msg.get("role") == "assistant" and i > 0 and messages[i - 1].get("role") == "user":
+                turns.append(messages[:i])
+                if len(turns) >= max_turns:
+                    return turns
+    return turns
+
+
+def run_pass(client, turns, label):
+    """Genera una respuesta por turno y devuelve (tokens, segundos)"""
+    total_tokens = 0
+    total_seconds = 0.0
+
+    for i, history in enumerate(turns):
+        count = [0]
+
+        def on_token(token):
+            count[0] += 1
+
+        start = time.perf_counter()
+        client.chat_stream(history, callback=on_token)
+        elapsed = time.perf_counter() - start
+
+        total_tokens += count[0]
+        total_seconds += elapsed
+        rate = count[0] / elapsed if elapsed > 0 else 0
+        sys.stdout.write(f"\r   [{label}] turno {i + 1}/{len(turns)}: {rate:.1f} tok/s")
+        sys.stdout.flush()
+
+    print()
+    return total_tokens, total_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de decodificación especulativa")
+    parser.add_argument("--model-type", default=None, help="instruct o base (por defecto, el de settings.json)")
+    parser.add_argument("--draft-tokens", type=int, default=10)
+    parser.add_argument("--max-turns", type=int, default=20)
+    parser.add_argument("--max-tokens", type=int, default=256, help="Límite de tokens por respuesta")
+    args = parser.parse_args()
+
+    # Limitar la longitud para que ambas pasadas sean comparables
+    ollama_client.MAX_TOKENS = args.max_tokens
+
+    turns = load_replay_turns(args.max_turns)
+    if not turns:
+        print("❌ No hay turnos de Aurora que reproducir en 'conversaciones/'")
+        return
+    print(f"Turnos a reproducir: {len(turns)}")
+
+    results = {}
+    for label, enabled in (("normal", False), ("especulativo", True)):
+        client = LocalLLMClient()
+        # Greedy para que ambas pasadas generen el mismo texto
+        client.set_temperature(0.0)
+        client.speculative_decoding = enabled
+        client.draft_tokens = args.draft_tokens
+        if not client.initialize(args.model_type):
+            print("❌ No se pudo cargar el modelo")
+            return
+        results[label] = run_pass(client, turns, label)
+
+    print("\n=== Resultados ===")
+    base_rate = None
+    for label, (tokens, seconds) in results.items():
+        rate = tokens / seconds if seconds > 0 else 0
+        line = f"{label:>13}: {tokens} tokens en {seconds:.1f}s -> {rate:.1f} tok/s"
+        if base_rate:
+            line += f" (x{rate / base_rate:.2f})"
+        else:
+            base_rate = rate
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
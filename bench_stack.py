@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de rendimiento de la aplicación completa (RAG, prompts, persistencia)
+con el backend falso: no necesita el modelo ni llama-cpp-python.
+Al terminar se restauran conversaciones/ (el árbol completo, tal como estaba),
+settings.json, statistics.json y summary_jobs.json.
+
+Uso:
+    python bench_stack.py --turns 20
+    python bench_stack.py --turns 50 --tokens-per-second 1000 --first-token-ms 0
+"""
+import os
+import time
+import shutil
+import argparse
+
+from config import BASE_DIR, CONVERSATIONS_DIR
+from chat_engine import ChatEngine
+from persistence import get_persistence
+
+CONVERSATIONS_BACKUP = CONVERSATIONS_DIR + ".bench"
+PRESERVED_FILES = [
+    os.path.join(BASE_DIR, "settings.json"),
+    os.path.join(BASE_DIR, "statistics.json"),
+    os.path.join(BASE_DIR, "summary_jobs.json"),
+]
+
+QUESTIONS = [
+    "¿Qué recuerdas de mí?",
+    "Explícame cómo funciona un motor de combustión.",
+    "Dame tres ideas para una cena rápida.",
+    "¿Por qué el cielo es azul?",
+    "Resume lo que hemos hablado hasta ahora.",
+    "¿Cómo se calcula el área de un círculo?",
+]
+
+
+def backup():
+    """Copia los archivos que toca la prueba (conversaciones/ entero: el motor puede moverlas o archivarlas)"""
+    for path in PRESERVED_FILES:
+        if os.path.exists(path):
+            shutil.copy(path, path + ".bench")
+    if os.path.exists(CONVERSATIONS_BACKUP):
+        raise RuntimeError(f"Ya existe {CONVERSATIONS_BACKUP} (¿prueba anterior interrumpida?): restáuralo antes")
+    shutil.copytree(CONVERSATIONS_DIR, CONVERSATIONS_BACKUP)
+
+
+def restore():
+    # Lo que quede en la cola de escritura se vuelca antes de restaurar
+    get_persistence().flush()
+    for path in PRESERVED_FILES:
+        if os.path.exists(path + ".bench"):
+            shutil.move(path + ".bench", path)
+        elif os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(CONVERSATIONS_DIR)
+    shutil.move(CONVERSATIONS_BACKUP, CONVERSATIONS_DIR)
+
+
+def run(args):
+    engine = ChatEngine()
+    engine.llm.set_backend("fake", {
+        "first_token_ms": args.first_token_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "prompt_tokens_per_second": args.prompt_tokens_per_second,
+        "response_tokens": args.response_tokens
+    })
+    if not engine.initialize():
+        print("❌ No se pudo inicializar el motor")
+        return
+    engine.new_conversation()
+
+    try:
+        start = time.perf_counter()
+        for turn in range(args.turns):
+            engine.process_message(QUESTIONS[turn % len(QUESTIONS)], stream_callback=lambda token: None)
+        wall = time.perf_counter() - start
+
+        print("\n=== Resultados ===")
+        print(f"Turnos: {args.turns} en {wall:.2f}s ({wall / args.turns * 1000:.0f} ms/turno)")
+        for name, values in engine.stats_manager.get_latency_percentiles().items():
+            p50, p95 = values.get("p50"), values.get("p95")
+            if p50 is not None:
+                print(f"{name:>18}: p50 {p50:10.1f}   p95 {p95:10.1f}")
+        backend = engine.llm.get_backend_stats()
+        print(f"Tokens de prompt: {backend['prompt_tokens']} recibidos, "
+              f"{backend['prompt_tokens_evaluated']} evaluados "
+              f"({backend['completion_tokens']} generados en {backend['calls']} llamadas)")
+        persistence = get_persistence().get_stats()
+        print(f"Persistencia: {persistence['mutations']} cambios, {persistence['writes']} escrituras, "
+              f"cola p50 {persistence['queue_p50_ms']} ms / p95 {persistence['queue_p95_ms']} ms")
+    finally:
+        engine.summary_worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendimiento de la aplicación con el backend falso")
+    parser.add_argument("--turns", type=int, default=20, help="Mensajes a procesar")
+    parser.add_argument("--first-token-ms", type=float, default=120, help="Latencia fija del primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=25, help="Velocidad de generación simulada")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=600, help="Evaluación del prompt simulada")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Tokens por respuesta")
+    args = parser.parse_args()
+
+    backup()
+    try:
+        run(args)
+    finally:
+        restore()
+
+
+if __name__ == "__main__":
+    main()
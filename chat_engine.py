@@ -4,13 +4,24 @@ Motor de Chat
 Coordinador principal del chatbot
 """
 
+import time
+import threading
+
 from ollama_client import LocalLLMClient
 from rag_engine import RAGEngine
 from memory_manager import MemoryManager
-from conversation_manager import ConversationManager
-from config import SUMMARY_INTERVAL, SIMILARITY_THRESHOLD
+from conversation_manager import create_conversation_manager
+from config import (
+    SUMMARY_INTERVAL, SIMILARITY_THRESHOLD, ROLLING_SUMMARY, ROLLING_SUMMARY_MIN_TOKENS,
+    SPECULATIVE_PREFILL, PREFILL_DEBOUNCE_MS, CONVERSATION_BACKEND, PERSIST_FSYNC,
+    ARCHIVE_AFTER_DAYS, ARCHIVE_COMPRESSION, PRUNE_EMPTY_CONVERSATIONS, HISTORY_WINDOW_MESSAGES,
+    HISTORY_PAGE_SIZE, CONVERSATION_SHARD_CHARS
+)
 from settings_manager import SettingsManager
 from statistics_manager import StatisticsManager
+from summary_worker import SummaryWorker
+from persistence import get_persistence
+from history_window import HistoryWindow, estimate_tokens
 
 
 class ChatEngine:
@@ -18,21 +29,38 @@ class ChatEngine:
     
     def __init__(self, on_status_change=None):
         self.settings = SettingsManager()
+        get_persistence().fsync = bool(self.settings.get("persist_fsync", PERSIST_FSYNC))
         self.stats_manager = StatisticsManager()
         self.llm = LocalLLMClient()
         self.rag = RAGEngine()
         self.memory = MemoryManager()
-        self.conversation_manager = ConversationManager()
-        
+        self.conversation_manager = create_conversation_manager(
+            self.settings.get("conversation_backend", CONVERSATION_BACKEND),
+            shard_chars=self.settings.get("conversation_shard_chars", CONVERSATION_SHARD_CHARS)
+        )
+        # Mensajes de la conversación abierta que se guardan en memoria (los anteriores se leen bajo demanda)
+        self.history_window = self.settings.get("history_window_messages", HISTORY_WINDOW_MESSAGES)
+        self.conversation_manager.window = self.history_window
         # Aplicar ajustes guardados
         self.llm.set_temperature(self.settings.get("temperature"))
         self.llm.model_type = self.settings.get("model_type")
         
         # Inicializar variables de estado
-        self.conversation_history = []
+        self.conversation_history = HistoryWindow(window=self.history_window)
         self.message_count = 0
         self.on_status_change = on_status_change
         self._initialized = False
+        self.status = None
+        
+        # Avisos de liberación/recarga del modelo por inactividad
+        self.llm.on_model_state = self._on_model_state
+        
+        # Resúmenes en segundo plano (se arranca al inicializar el modelo)
+        self.summary_worker = SummaryWorker(self)
+        # Turnos que ya no caben en el prompt: se pliegan en un resumen en vez de descartarse
+        self.rolling_summary_enabled = self.settings.get("rolling_summary", ROLLING_SUMMARY)
+        # Precargar el prompt del siguiente turno mientras el usuario lee o escribe
+        self.speculative_prefill = self.settings.get("speculative_prefill", SPECULATIVE_PREFILL)
         
         # Cargar última conversación si existe, sino crear una nueva
         last_id = self.settings.get("last_conversation_id")
@@ -42,24 +70,60 @@ class ChatEngine:
                 print("[DEBUG] No se pudo cargar la última conversación, creando una nueva.")
                 self.conversation_manager.create_conversation()
                 self.settings.update("last_conversation_id", self.conversation_manager.current_conversation_id)
+                self.conversation_history = self._history_window()
         else:
             self.conversation_manager.create_conversation()
             self.settings.update("last_conversation_id", self.conversation_manager.current_conversation_id)
+            self.conversation_history = self._history_window()
         
         # Limpiar memorias inválidas al inicio
         self.memory.cleanup_memories()
+        
+        # Mantenimiento de conversaciones en segundo plano (con la actual ya cargada)
+        maintenance_thread = threading.Thread(target=self._maintain_conversations)
+        maintenance_thread.daemon = True
+        maintenance_thread.start()
+    
+    def _maintain_conversations(self):
+        """Elimina las vacías, archiva las antiguas e indexa para la búsqueda las que faltan"""
+        try:
+            self.conversation_manager.maintain_storage(
+                archive_after_days=self.settings.get("archive_after_days", ARCHIVE_AFTER_DAYS),
+                prune_empty=self.settings.get("prune_empty_conversations", PRUNE_EMPTY_CONVERSATIONS),
+                compression=self.settings.get("archive_compression", ARCHIVE_COMPRESSION)
+            )
+        except Exception as e:
+            print(f"[WARNING] Error en el mantenimiento de conversaciones: {e}")
+        # La primera vez se indexan para la búsqueda las conversaciones que ya existían
+        self.conversation_manager.build_search_index()
     
-    def update_status(self, status):
+    def update_status(self, status, remember=True):
         """Actualiza el estado si hay callback"""
+        if remember:
+            self.status = status
         if self.on_status_change:
             self.on_status_change(status)
     
+    def _on_model_state(self, state):
+        """Refleja en el estado la liberación y recarga del modelo por inactividad"""
+        if state == "unloaded":
+            self.update_status("En reposo")
+        elif state == "reloading":
+            self.update_status("Despertando el modelo...", remember=False)
+        elif state == "reloaded":
+            # Volver a lo que se mostraba antes de recargar ("Pensando...", etc.)
+            status = self.status if self.status not in (None, "En reposo") else "Listo"
+            self.update_status(status)
+    
     def initialize(self, progress_callback=None):
         """Inicializa el motor (descarga modelo si es necesario)"""
         self.update_status("Preparándome...")
         success = self.llm.initialize(progress_callback=progress_callback)
         self._initialized = success
         if success:
+            if not self.summary_worker.is_alive():
+                self.summary_worker.start()
+            self._maybe_preload_alternate()
             self.update_status("Listo")
         else:
             self.update_status("Error al inicializar modelo")
@@ -73,15 +137,17 @@ class ChatEngine:
         """Verifica si el sistema está listo"""
         return self._initialized and self.llm.is_available()
     
-    def process_message(self, user_input, stream_callback=None):
+    def process_message(self, user_input, stream_callback=None, cancel_token=None):
         """
         Procesa un mensaje del usuario.
+        cancel_token: token con el que quien lo envía puede detener la respuesta (ver stop_generation)
         """
         if not self.is_ready():
             return "Error: El modelo no está listo. Inicializa primero.", False
         
         # Limpiar memorias inválidas antes de procesar
         self.memory.cleanup_memories()
+        turn_start = time.perf_counter()
 
         # 0. Guardar mensaje del usuario INMEDIATAMENTE para asegurar persistencia
         print(f"[DEBUG] Guardando mensaje usuario: {user_input[:30]}...")
@@ -89,6 +155,7 @@ class ChatEngine:
             "role": "user",
             "content": user_input
         })
+        persist_start = time.perf_counter()
         try:
             self.conversation_manager.save_message("user", user_input)
             print("[DEBUG] Mensaje usuario guardado en JSON")
@@ -97,6 +164,7 @@ class ChatEngine:
             
         # Incrementar contador de estadísticas
         self.stats_manager.increment_user_messages()
+        persist_seconds = time.perf_counter() - persist_start
         
         # Actualizar estado
         self.update_status("Recordando...")
@@ -104,7 +172,9 @@ class ChatEngine:
         # 1. Buscar contexto RAG
         threshold = self.settings.get("similarity_threshold", SIMILARITY_THRESHOLD)
         print(f"[DEBUG] Usando threshold RAG: {threshold}")
+        rag_start = time.perf_counter()
         rag_context, similarity = self.rag.get_context(user_input, threshold)
+        rag_seconds = time.perf_counter() - rag_start
         
         # 2. RAG obtenido
         
@@ -113,19 +183,31 @@ class ChatEngine:
         # 4. Generar respuesta
         self.update_status("Pensando...")
         
+        first_token_at = []
         if stream_callback:
+            def timed_callback(token):
+                if not first_token_at:
+                    first_token_at.append(time.perf_counter())
+                stream_callback(token)
+            
             # Ya no pasamos system_context separado (memoria), todo va por RAG filtrado
+            messages, summary = self.chat_context()
             response = self.llm.chat_stream(
-                self.conversation_history,
+                messages,
                 system_context="", 
                 user_context=rag_context if rag_context else "",
-                callback=stream_callback
+                callback=timed_callback,
+                cancel_token=cancel_token,
+                summary=summary
             )
         else:
+            messages, summary = self.chat_context()
             response = self.llm.chat(
-                self.conversation_history,
+                messages,
                 system_context="",
-                user_context=rag_context if rag_context else ""
+                user_context=rag_context if rag_context else "",
+                cancel_token=cancel_token,
+                summary=summary
             )
         
         # 5. Guardar respuesta del asistente
@@ -133,22 +215,52 @@ class ChatEngine:
             "role": "assistant",
             "content": response
         })
+        persist_start = time.perf_counter()
         self.conversation_manager.save_message("assistant", response)
+        persist_seconds += time.perf_counter() - persist_start
+        
+        ttft_seconds = first_token_at[0] - turn_start if first_token_at else None
+        self.record_turn_latency(rag_seconds, ttft_seconds, persist_seconds)
         
         # 6. Incrementar contador y verificar si toca resumen
         self.message_count += 1
         print(f"\n[DEBUG] Contador mensajes: {self.message_count} (Intervalo: {SUMMARY_INTERVAL})")
         
         if self.should_generate_summary():
-            print("[DEBUG] ¡Hora de generar resumen!")
-            self.update_status("Guardando lo nuestro...")
-            success = self.generate_and_save_summary()
-            print(f"[DEBUG] Resultado generación resumen: {success}")
+            print("[DEBUG] ¡Hora de generar resumen! (en segundo plano)")
+            self.schedule_summary()
+        self.schedule_compression()
+        self.prefill_next_turn()
         
         self.update_status("Listo")
         
         return response, rag_context is not None, similarity
     
+    def record_turn_latency(self, rag_seconds, ttft_seconds, persist_seconds):
+        """Guarda el desglose de latencia de un turno (junto con los tiempos del LLM de este hilo)"""
+        sample = self.llm.get_last_timings()
+        sample["rag_ms"] = rag_seconds * 1000
+        sample["ttft_ms"] = ttft_seconds * 1000 if ttft_seconds is not None else None
+        sample["persist_ms"] = persist_seconds * 1000
+        try:
+            self.stats_manager.record_latency(sample)
+        except Exception as e:
+            print(f"[WARNING] No se pudo registrar la latencia del turno: {e}")
+
+    def record_followup_latency(self, ttft_seconds):
+        """Primer token de la continuación espontánea (reutiliza la caché KV de la respuesta)"""
+        try:
+            self.stats_manager.record_latency({"followup_ttft_ms": ttft_seconds * 1000})
+        except Exception as e:
+            print(f"[WARNING] No se pudo registrar la latencia de la continuación: {e}")
+
+    def stop_generation(self, cancel_token):
+        """Detiene la respuesta asociada a cancel_token (la del que pulsa detener, UI o cliente remoto)"""
+        stopped = self.llm.cancel_generation(cancel_token)
+        if stopped:
+            self.update_status("Detenida")
+        return stopped
+    
     def should_generate_summary(self):
         """Verifica si es momento de generar un resumen"""
         should = self.message_count > 0 and self.message_count % SUMMARY_INTERVAL == 0
@@ -156,20 +268,146 @@ class ChatEngine:
             print(f"[DEBUG] should_generate_summary = True ({self.message_count} % {SUMMARY_INTERVAL} == 0)")
         return should
     
-    def generate_and_save_summary(self):
-        """Genera y guarda un resumen de la conversación reciente"""
+    def schedule_summary(self):
+        """Encola el resumen de los mensajes recientes para el trabajador en segundo plano"""
         if len(self.conversation_history) < 2:
             print("[DEBUG] No hay suficiente historial para resumir")
-            return
+            return False
         
-        # Tomar los últimos mensajes para el resumen
         recent_messages = self.conversation_history[-SUMMARY_INTERVAL * 2:]
+        self.summary_worker.enqueue(self.conversation_manager.current_conversation_id, recent_messages)
+        return True
+    
+    def chat_context(self):
+        """
+        Mensajes que van al prompt y resumen acumulado de los anteriores (ya plegados).
+        Solo la cola que cabe en el contexto (por los tokens acumulados): el recorte
+        del cliente ya no recorre la conversación entera.
+        """
+        max_tokens = self.llm.context_length
+        if not self.rolling_summary_enabled:
+            return self.conversation_history.tail(max_tokens), ""
+        state = self.conversation_manager.get_rolling_summary()
+        # El último mensaje nunca se pliega: es el que se está respondiendo
+        covered = min(state["covered"], max(0, len(self.conversation_history) - 1))
+        return self.conversation_history.tail(max_tokens, start=covered), state["text"]
+
+    def prefill_next_turn(self, partial_message="", debounce=False):
+        """
+        Precarga en la caché KV lo que ya se sabe del próximo prompt: cabecera e historial
+        nada más terminar una respuesta, y lo tecleado hasta ahora (con debounce) al escribir.
+        Al enviar solo queda por evaluar el resto.
+        """
+        if not self.speculative_prefill or not self.is_ready():
+            return False
+        
+        def build():
+            messages, summary = self.chat_context()
+            return self.llm.build_prefill_prompt(messages, summary, partial_message)
+        
+        self.llm.prefill_async(build, PREFILL_DEBOUNCE_MS / 1000 if debounce else 0)
+        return True
+
+    def schedule_compression(self):
+        """
+        Encola el plegado de los turnos que el recorte ya deja fuera del prompt,
+        solo cuando suman ROLLING_SUMMARY_MIN_TOKENS (un resumen por turno no compensa)
+        """
+        if not self.rolling_summary_enabled:
+            return False
+        state = self.conversation_manager.get_rolling_summary()
+        history = self.conversation_history
+        covered = state["covered"]
+        if covered >= history.offset:
+            # Lo que queda por plegar está en memoria
+            evicted = self.llm.evicted_messages(history[covered:], summary=state["text"])
+            remaining = len(evicted)
+        else:
+            # Lo anterior a la ventana se lee del almacén, una página por trabajo
+            # (leerlo entero en cada turno anularía la ventana de HistoryWindow)
+            tail, _ = self.chat_context()
+            first_in_prompt = len(history) - len(tail) + len(self.llm.evicted_messages(tail, summary=state["text"]))
+            remaining = first_in_prompt - covered
+            evicted = history[covered:min(first_in_prompt, covered + HISTORY_PAGE_SIZE)]
+        # Misma estimación que el recorte: 1 token ≈ 4 caracteres + etiquetas
+        evicted_tokens = sum(estimate_tokens(m) for m in evicted)
+        if not evicted or (len(evicted) >= remaining and evicted_tokens < ROLLING_SUMMARY_MIN_TOKENS):
+            return False
+        
+        # Un trabajo por trozo que cabe en el contexto: covered avanza trozo a trozo
+        chunk = self.fold_chunk(evicted, state["text"])
+        self.summary_worker.enqueue_rolling(
+            self.conversation_manager.current_conversation_id,
+            chunk,
+            state["covered"],
+            state["covered"] + len(chunk)
+        )
+        return True
+
+    def fold_chunk(self, messages, summary=""):
+        """
+        Primeros mensajes de messages que caben en un plegado (ver LocalLLMClient.rolling_fold_budget).
+        Siempre al menos uno: si él solo no cabe, se recorta su contenido.
+        """
+        budget = self.llm.rolling_fold_budget(summary)
+        chunk, used = [], 0
+        for message in messages:
+            tokens = estimate_tokens(message)
+            if chunk and used + tokens > budget:
+                break
+            if tokens > budget:
+                message = dict(message, content=message["content"][:int(max(0, budget - 10) * 4)])
+            chunk.append(message)
+            used += tokens
+        return chunk
+
+    def fold_rolling_summary(self, job, cancel_token=None):
+        """Pliega los mensajes de un trabajo "rolling" en el resumen acumulado de su conversación"""
+        conversation_id = job["conversation_id"]
+        state = self.conversation_manager.get_rolling_summary(conversation_id)
+        # Parte del trabajo pudo quedar ya plegada por otro anterior
+        skip = max(0, state["covered"] - job["covered_from"])
+        # Los trabajos ya encolados pueden ser más grandes que el contexto: se pliega solo lo que cabe
+        messages = self.fold_chunk(job["messages"][skip:], state["text"])
+        if not messages:
+            return True
+        covered = job["covered_from"] + skip + len(messages)
+        
+        summary = self.llm.generate_rolling_summary(state["text"], messages, cancel_token=cancel_token)
+        if cancel_token and cancel_token.reason:
+            print(f"[DEBUG] Plegado interrumpido ({cancel_token.reason}), no se guarda")
+            return False
+        if not summary or summary.startswith("Error"):
+            print(f"[DEBUG] Error plegando el historial: {summary}")
+            return False
+        
+        self.conversation_manager.set_rolling_summary(conversation_id, summary, covered)
+        # Si queda más historial fuera del prompt, el siguiente turno encola el trozo siguiente
+        print(f"[DEBUG] Historial plegado: {covered} mensajes en el resumen acumulado")
+        return True
+
+    def generate_and_save_summary(self, messages=None, cancel_token=None):
+        """Genera y guarda un resumen de los mensajes dados (por defecto, la conversación reciente)"""
+        if messages is None:
+            # Tomar los últimos mensajes para el resumen
+            messages = self.conversation_history[-SUMMARY_INTERVAL * 2:]
+        
+        if len(messages) < 2:
+            print("[DEBUG] No hay suficiente historial para resumir")
+            return False
+        
+        recent_messages = messages
         print(f"[DEBUG] Resumiendo {len(recent_messages)} mensajes...")
         
         # Generar resumen
-        summary = self.llm.generate_summary(recent_messages)
+        summary = self.llm.generate_summary(recent_messages, cancel_token=cancel_token)
         print(f"[DEBUG] Resumen generado (preview): {summary[:50]}...")
         
+        # Un resumen cortado a medias no se guarda
+        if cancel_token and cancel_token.reason:
+            print(f"[DEBUG] Resumen interrumpido ({cancel_token.reason}), no se guarda")
+            return False
+        
         if summary and not summary.startswith("Error"):
             # Guardar en memoria
             filepath = self.memory.save_summary(summary)
@@ -186,9 +424,9 @@ class ChatEngine:
     
     def clear_conversation(self):
         """Inicia una nueva conversación (limpia el historial actual en memoria)"""
-        self.conversation_history = []
         self.message_count = 0
         self.conversation_manager.create_conversation()
+        self.conversation_history = self._history_window()
         # Guardar como última conversación
         self.settings.update("last_conversation_id", self.conversation_manager.current_conversation_id)
     
@@ -200,15 +438,10 @@ class ChatEngine:
         """Carga una conversación anterior"""
         data = self.conversation_manager.load_conversation(conversation_id)
         if data:
-            self.conversation_history = []
-            for msg in data.get("messages", []):
-                # Validar formato de mensajes para asegurar compatibilidad con LLM
-                if "role" in msg and "content" in msg:
-                    self.conversation_history.append({
-                        "role": msg["role"],
-                        "content": msg["content"],
-                        "timestamp": msg.get("timestamp")
-                    })
+            # Solo los últimos mensajes: los anteriores se piden al almacén si hacen falta
+            self.conversation_history = self._history_window(
+                data.get("messages", []), self.conversation_manager.message_offset
+            )
             
             self.message_count = len([m for m in self.conversation_history if m["role"] == "user"])
             
@@ -217,6 +450,32 @@ class ChatEngine:
             return True
         return False
         
+    def _history_window(self, messages=(), offset=0):
+        """Ventana del historial de la conversación actual, leyendo lo anterior de su almacén"""
+        conversation_id = self.conversation_manager.current_conversation_id
+        
+        def fetch(start, limit):
+            messages = self.conversation_manager.get_messages(conversation_id, start, limit)
+            return [_history_message(msg) for msg in messages]
+        
+        return HistoryWindow(fetch, [_history_message(msg) for msg in messages], offset, self.history_window)
+    
+    def load_earlier_messages(self, before, count=None):
+        """
+        Mensajes anteriores a la posición before (desplazamiento hacia atrás en la UI).
+        Devuelve (posición del primero, mensajes)
+        """
+        return self.conversation_history.page(before, count or HISTORY_PAGE_SIZE)
+    
+    def search_conversations(self, query, limit=None):
+        """
+        Busca en el contenido de todas las conversaciones.
+        Devuelve [{id, title, updated_at, snippet («coincidencia» resaltada), matches...}]
+        """
+        if limit is None:
+            return self.conversation_manager.search(query)
+        return self.conversation_manager.search(query, limit)
+
     def list_conversations(self):
         """Lista todas las conversaciones"""
         return self.conversation_manager.list_conversations()
@@ -234,11 +493,23 @@ class ChatEngine:
         current_id = self.conversation_manager.current_conversation_id
         return {
             'messages': len(self.conversation_history),
+            'history_window': self.conversation_history.get_stats(),
             'message_count': self.message_count,
             'rag': self.rag.get_stats(),
             'memory': self.memory.get_stats(),
             'model_ready': self.is_ready(),
             'current_conversation': current_id,
+            'models': self.llm.get_registry_stats(),
+            'parallel': self.llm.get_parallel_stats(),
+            'idle_unload': self.llm.get_idle_stats(),
+            'response_cache': self.llm.get_response_cache_stats(),
+            'backend': self.llm.get_backend_stats(),
+            'context': self.llm.get_context_stats(),
+            'persistence': get_persistence().get_stats(),
+            'search': self.conversation_manager.search_index.get_stats() if self.conversation_manager.search_index else None,
+            'storage': self.conversation_manager.storage_report,
+            'prefill': self.llm.get_prefill_stats(),
+            'summarized_messages': self.conversation_manager.get_rolling_summary()["covered"],
             'temperature': self.llm.temperature
         }
 
@@ -247,9 +518,60 @@ class ChatEngine:
         self.llm.set_temperature(value)
         self.settings.update("temperature", float(value))
 
+    def set_speculative_decoding(self, enabled, draft_tokens=None):
+        """Activa/desactiva la decodificación especulativa y guarda"""
+        success = self.llm.set_speculative_decoding(enabled, draft_tokens)
+        if success:
+            self.settings.update("speculative_decoding", bool(enabled))
+            if draft_tokens is not None:
+                self.settings.update("draft_tokens", int(draft_tokens))
+        return success
+
+    def set_inference_mode(self, mode):
+        """Cambia entre inferencia secuencial ("single"), por lotes ("batched") o en procesos ("pool") y guarda"""
+        success = self.llm.set_inference_mode(mode)
+        if success:
+            self.settings.update("inference_mode", mode)
+        return success
+
+    def set_response_cache(self, enabled):
+        """Activa/desactiva la caché de respuestas y guarda"""
+        self.llm.set_response_cache(enabled)
+        self.settings.update("response_cache", bool(enabled))
+
+    def set_rolling_summary(self, enabled):
+        """Activa/desactiva el plegado de turnos antiguos en un resumen y guarda"""
+        self.rolling_summary_enabled = bool(enabled)
+        self.settings.update("rolling_summary", bool(enabled))
+
+    def set_speculative_prefill(self, enabled):
+        """Activa/desactiva la precarga del prompt del siguiente turno y guarda"""
+        self.speculative_prefill = bool(enabled)
+        self.settings.update("speculative_prefill", bool(enabled))
+
+    def set_idle_unload(self, seconds):
+        """Cambia el tiempo de inactividad antes de liberar el modelo y guarda"""
+        self.llm.set_idle_unload(seconds)
+        self.settings.update("model_idle_unload_seconds", seconds)
+
     def switch_model(self, model_type, progress_callback=None):
         """Cambia el tipo de modelo (Instruct/Base) y guarda"""
         success = self.llm.initialize(model_type, progress_callback)
         if success:
             self.settings.update("model_type", model_type)
+            self._maybe_preload_alternate()
         return success
+
+    def _maybe_preload_alternate(self):
+        """Precarga el otro modelo en segundo plano si está activado en ajustes"""
+        if self.settings.get("preload_alternate_model"):
+            self.llm.preload_alternate_model()
+
+
+def _history_message(msg):
+    """Mensaje guardado -> mensaje del historial (solo los campos que usa el LLM)"""
+    return {
+        "role": msg.get("role", "user"),
+        "content": msg.get("content", ""),
+        "timestamp": msg.get("timestamp")
+    }
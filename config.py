@@ -13,14 +13,19 @@ CONVERSATIONS_DIR = os.path.join(BASE_DIR, "conversaciones")
 MODELS_DIR = os.path.join(BASE_DIR, "models")
 
 # Configuración de modelos disponibles
+# "sha256": hash esperado del GGUF (sha256sum del archivo). Si es None se usa el que publica
+# HuggingFace en la cabecera X-Linked-Etag de la descarga (archivos LFS), siempre por una
+# conexión TLS verificada; fijarlo aquí evita depender de esa cabecera
 MODELS_CONFIG = {
     "instruct": {
         "filename": "gemma-2-2b-it-Q4_K_M.gguf",
-        "url": "https://huggingface.co/bartowski/gemma-2-2b-it-GGUF/resolve/main/gemma-2-2b-it-Q4_K_M.gguf"
+        "url": "https://huggingface.co/bartowski/gemma-2-2b-it-GGUF/resolve/main/gemma-2-2b-it-Q4_K_M.gguf",
+        "sha256": None
     },
     "base": {
         "filename": "gemma-2-2b-Q4_K_M.gguf",
-        "url": "https://huggingface.co/tensorblock/gemma-2-2b-GGUF/resolve/main/gemma-2-2b-Q4_K_M.gguf"
+        "url": "https://huggingface.co/tensorblock/gemma-2-2b-GGUF/resolve/main/gemma-2-2b-Q4_K_M.gguf",
+        "sha256": None
     }
 }
 
@@ -31,10 +36,78 @@ MODEL_FILENAME = MODELS_CONFIG[DEFAULT_MODEL_TYPE]["filename"]
 MODEL_PATH = os.path.join(MODELS_DIR, MODEL_FILENAME)
 MODEL_URL = MODELS_CONFIG[DEFAULT_MODEL_TYPE]["url"]
 
+# Descarga de modelos
+DOWNLOAD_CONNECTIONS = 4  # Rangos descargados en paralelo
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB por lectura
+DOWNLOAD_RETRIES = 3  # Reintentos por rango ante cortes de conexión
+
 # Configuración del modelo
 MAX_TOKENS = None  # Infinito (hasta llenar contexto)
-CONTEXT_LENGTH = 4096
+CONTEXT_LENGTH = 4096  # Contexto si no se pueden leer los metadatos del GGUF
 TEMPERATURE = 0.1
+PROMPT_TURN_CACHE_SIZE = 1024  # Turnos renderizados (y tokenizados) que se guardan en memoria
+GENERATION_DEADLINE_SECONDS = None  # Plazo máximo por generación (None = sin límite)
+GENERATION_TOKEN_BUDGET = None  # Tokens máximos por generación (None = hasta llenar contexto)
+
+# Memoria para modelos residentes (el presupuesto se ajusta en settings.json: model_ram_budget_mb)
+MODEL_RAM_FRACTION = 0.6  # Presupuesto automático: fracción de la RAM física
+MODEL_RAM_FALLBACK_MB = 4096  # Presupuesto si no se puede detectar la RAM
+MODEL_RAM_OVERHEAD_MB = 512  # Caché KV y búferes estimados por modelo cargado (sin metadatos GGUF)
+MODEL_COMPUTE_BUFFER_MB = 256  # Búferes de cálculo (la caché KV se calcula aparte con los metadatos)
+PRELOAD_ALTERNATE_MODEL = False  # Precargar el otro modelo si cabe (cambio instantáneo)
+MODEL_IDLE_UNLOAD_SECONDS = 1800  # Liberar el modelo tras 30 min sin uso (None = nunca)
+MODEL_IDLE_CHECK_SECONDS = 30  # Cada cuánto se comprueba la inactividad
+PROMPT_DISK_CACHE = False  # Guardar en disco el estado KV de los prompts (opt-in: ocupa hasta PROMPT_CACHE_MB por modelo)
+PROMPT_CACHE_DIR = os.path.join(BASE_DIR, "cache", "prompts")
+PROMPT_CACHE_MB = 1024  # Tamaño máximo de la caché de prompts por modelo
+SPECULATIVE_PREFILL = False  # Evaluar por adelantado el prompt del siguiente turno (opt-in, modo secuencial)
+PREFILL_DEBOUNCE_MS = 400  # Pausa al escribir antes de precargar lo tecleado
+PREFILL_CHUNK_TOKENS = 32  # Tokens por paso de la precarga (entre pasos cede el modelo)
+PREFILL_RAG_RESERVE_CHARS = 2000  # Contexto RAG que puede llevar el mensaje nuevo (un fragmento + cabecera)
+
+# Contexto y caché KV: n_ctx se elige con los metadatos del GGUF para que la caché KV
+# quepa en el presupuesto (context_length en settings.json lo fija a mano)
+KV_CACHE_BUDGET_MB = 512
+KV_CACHE_TYPE_K = "f16"  # f16, q8_0, q4_0... (cuantizar reduce memoria y permite más contexto)
+KV_CACHE_TYPE_V = "f16"  # Cuantizar V requiere flash attention (se activa automáticamente)
+FLASH_ATTENTION = False
+MIN_CONTEXT_LENGTH = 2048
+
+# Backend del modelo: "llama_cpp" (GGUF real) o "fake" (determinista, sin modelo ni llama-cpp,
+# para pruebas de rendimiento del resto de la aplicación)
+LLM_BACKEND = "llama_cpp"
+FAKE_FIRST_TOKEN_MS = 120  # Latencia fija hasta el primer token
+FAKE_PROMPT_TOKENS_PER_SECOND = 600  # Velocidad de evaluación del prompt (solo la parte no reutilizada)
+FAKE_TOKENS_PER_SECOND = 25  # Velocidad de generación
+FAKE_RESPONSE_TOKENS = 60  # Longitud de las respuestas (si max_tokens no la corta antes)
+FAKE_JITTER = 0.0  # Variación aleatoria (fracción) de cada espera; 0 = tiempos exactos
+
+# Caché de respuestas (opt-in, se activa desde settings.json)
+RESPONSE_CACHE = False
+RESPONSE_CACHE_FILE = os.path.join(BASE_DIR, "cache", "responses.sqlite3")
+RESPONSE_CACHE_MAX_ENTRIES = 2000  # Se expulsan las menos usadas recientemente
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.2  # Por encima, solo se cachean las llamadas marcadas como repetibles
+
+# Decodificación especulativa (prompt lookup: borradores n-grama sacados del propio prompt)
+SPECULATIVE_DECODING = False  # Opt-in, se activa desde settings.json
+SPECULATIVE_DRAFT_TOKENS = 10  # Tokens de borrador propuestos por paso
+
+# Inferencia por lotes (varias sesiones simultáneas sobre un mismo modelo)
+INFERENCE_MODE = "single"  # "single" = una generación cada vez, "batched" = continuous batching, "pool" = procesos
+BATCH_PARALLEL = 4  # Secuencias simultáneas (cada una reserva el n_ctx del modelo de caché KV)
+BATCH_SIZE = 512  # Tokens máximos por llamada a llama_decode
+BATCH_TOP_K = 40  # Candidatos considerados al muestrear en modo por lotes
+
+# Pool de procesos (inference_mode = "pool"): un Llama por proceso sobre el mismo GGUF mapeado
+POOL_WORKERS = None  # None = núcleos disponibles / POOL_THREADS_PER_WORKER
+POOL_THREADS_PER_WORKER = 4
+
+# Streaming de tokens (agrupación antes de enviar a la UI / WebSocket)
+STREAM_FLUSH_MS = 50  # Ventana por defecto entre envíos
+STREAM_FLUSH_CHARS = 64  # Se envía antes si el búfer acumula estos caracteres
+STREAM_UI_FLUSH_MS = 50  # ~20 refrescos/s en la burbuja de Tk
+STREAM_SOCKET_FLUSH_MS = 100  # ~10 mensajes/s por WebSocket
+STREAM_SOCKET_FLUSH_CHARS = 256
 
 # Configuración RAG
 SIMILARITY_THRESHOLD = 0.40  # 40% de coincidencia mínima para usar contexto RAG
@@ -45,6 +118,40 @@ MIN_RAG_QUERY_LENGTH = 8  # Longitud mínima para buscar contexto
 # Configuración de memoria
 SUMMARY_INTERVAL = 4  # Generar resumen cada 4 mensajes
 MAX_MEMORY_FILE_SIZE = 1024 * 1024  # 1MB en bytes
+SUMMARY_IDLE_SECONDS = 5  # Segundos de inactividad del modelo antes de resumir en segundo plano
+SUMMARY_MAX_ATTEMPTS = 3  # Reintentos de un resumen fallido antes de descartarlo
+ROLLING_SUMMARY = False  # Plegar en un resumen los turnos que ya no caben en el prompt (opt-in; si no, se descartan)
+ROLLING_SUMMARY_MIN_TOKENS = 400  # Tokens estimados fuera del prompt antes de plegarlos
+ROLLING_SUMMARY_MAX_WORDS = 200  # Extensión máxima del resumen acumulado
+
+# Conversaciones: cada mensaje se añade a un diario JSONL y cada cierto número de
+# entradas se reescribe la instantánea JSON completa
+CONVERSATION_JOURNAL_COMPACT = 200  # Entradas del diario antes de compactar
+CONVERSATION_INDEX_FILENAME = "_index.json"  # Metadatos para el listado (backend json)
+# Subdirectorio por prefijo del id (2 = 256 con UUID); 0 = todas en conversaciones/. Opt-in desde
+# settings.json (conversation_shard_chars): al arrancar mueve a su subdirectorio las que estén sueltas
+# (volver a 0 no las saca de los subdirectorios)
+CONVERSATION_SHARD_CHARS = 0
+# Mantenimiento al arrancar (opt-in, se activa desde settings.json: modifica y borra archivos)
+ARCHIVE_AFTER_DAYS = None  # Comprimir las conversaciones sin cambios desde hace N días (None = nunca)
+ARCHIVE_COMPRESSION = "gzip"  # "gzip" o "zstd" (requiere el paquete zstandard)
+PRUNE_EMPTY_CONVERSATIONS = False  # Borrar al arrancar las conversaciones sin mensajes
+HISTORY_WINDOW_MESSAGES = 200  # Mensajes de la conversación abierta que se guardan en memoria (y se muestran)
+HISTORY_PAGE_SIZE = 50  # Mensajes anteriores que se piden al almacén de cada vez ("Cargar anteriores")
+CONVERSATION_BACKEND = "json"  # "json" (archivos por conversación) o "sqlite" (listado indexado y paginación)
+CONVERSATIONS_DB = os.path.join(CONVERSATIONS_DIR, "conversaciones.sqlite3")
+EXPORT_WORKERS = 4  # Hilos que leen conversaciones a la vez al exportar (conversation_tools.py)
+
+# Búsqueda de texto completo en las conversaciones (SQLite FTS5, se actualiza al guardar)
+SEARCH_INDEX_FILE = os.path.join(BASE_DIR, "cache", "search.sqlite3")
+SEARCH_MAX_RESULTS = 20  # Conversaciones devueltas por búsqueda
+
+# Persistencia diferida de estadísticas, ajustes y conversaciones (hilo escritor)
+PERSIST_DEBOUNCE_MS = 250  # Ventana en la que se agrupan los cambios de un mismo archivo
+PERSIST_FSYNC = False  # fsync tras cada escritura: más lento, pero sobrevive a un corte de luz
+
+# Estadísticas
+LATENCY_WINDOW = 200  # Turnos recientes sobre los que se calculan p50/p95
 
 # Crear directorios si no existen
 os.makedirs(KNOWLEDGE_DIR, exist_ok=True)
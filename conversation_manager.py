@@ -1,17 +1,60 @@
 # -*- coding: utf-8 -*-
 import os
+import re
+import gzip
 import json
 import uuid
+import time
+import threading
 from datetime import datetime
-from config import CONVERSATIONS_DIR
+from config import (
+    CONVERSATIONS_DIR, CONVERSATION_JOURNAL_COMPACT, CONVERSATION_BACKEND, SEARCH_MAX_RESULTS,
+    CONVERSATION_INDEX_FILENAME, ARCHIVE_COMPRESSION, CONVERSATION_SHARD_CHARS
+)
+from persistence import get_persistence
+
+# zstandard es opcional: sin él se archiva con gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONVERSATION_INDEX_VERSION = 1
+# Conversaciones archivadas: instantánea JSON compacta y comprimida
+ARCHIVE_SUFFIXES = (".json.zst", ".json.gz")
+# Ids aceptados al importar (se usan como nombres de archivo)
+_VALID_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]*$")
 
 class ConversationManager:
-    """Gestor de historial de conversaciones (Threads)"""
+    """
+    Gestor de historial de conversaciones (Threads)
+    Cada conversación es una instantánea {id}.json más un diario {id}.jsonl al que
+    se añade una línea por cambio. Al cargar se aplica el diario sobre la instantánea;
+    cada CONVERSATION_JOURNAL_COMPACT entradas se reescribe la instantánea y se vacía.
+    Con shard_chars > 0 los archivos van en subdirectorios por prefijo del id
+    (conversaciones/3f/3f2a...json) y al crear el gestor se mueven allí los sueltos.
+    """
     
-    def __init__(self):
+    def __init__(self, search_index=None, shard_chars=CONVERSATION_SHARD_CHARS):
         self.conversations_dir = CONVERSATIONS_DIR
+        self.shard_chars = shard_chars or 0
         self.current_conversation_id = None
         self.current_conversation_data = None
+        self.search_index = search_index  # ConversationSearchIndex (opcional)
+        self._journal_entries = 0  # Entradas del diario de la conversación actual
+        self._unsaved = False  # Conversación nueva aún sin mensajes (no se escribe hasta el primero)
+        # Mensajes de la conversación actual que se guardan en memoria (None = todos);
+        # los anteriores se quedan en disco y se leen con get_messages
+        self.window = None
+        self.message_offset = 0  # Mensajes de la conversación actual anteriores a los que hay en memoria
+        self.storage_report = None  # Resultado del último mantenimiento (archivado y limpieza)
+        # Índice de metadatos para el listado (_index.json), se carga al listar
+        self.index_path = os.path.join(self.conversations_dir, CONVERSATION_INDEX_FILENAME)
+        self._index = None
+        self._index_dirty = False
+        # El resumen acumulado se escribe desde el trabajador en segundo plano
+        self._lock = threading.RLock()
+        self._shard_flat_files()
     
     def create_conversation(self):
         """Crea una nueva conversación vacía"""
@@ -24,10 +67,12 @@ class ConversationManager:
             "title": f"Conversación {datetime.now().strftime('%d/%m/%Y %H:%M')}",
             "created_at": timestamp,
             "updated_at": timestamp,
-            "messages": []
+            "messages": [],
+            "journal_seq": 0  # Última entrada del diario incluida en la instantánea
         }
-        
-        self._save_to_disk()
+        # No se escribe hasta el primer mensaje: así no se acumulan conversaciones vacías
+        self._unsaved = True
+        self.message_offset = 0
         return self.current_conversation_data
 
     def save_message(self, role, content):
@@ -45,89 +90,653 @@ class ConversationManager:
             "timestamp": timestamp
         }
         
-        self.current_conversation_data["messages"].append(message)
-        self.current_conversation_data["updated_at"] = timestamp
-        
+        fields = {"updated_at": timestamp}
         # Actualizar título si es el primer mensaje del usuario
-        if len(self.current_conversation_data["messages"]) <= 2 and role == "user":
+        if self.message_count() < 2 and role == "user":
             # Usar primeros 30 caracteres
-            safe_title = content[:30].strip() + "..."
-            self.current_conversation_data["title"] = safe_title
-            
-        self._save_to_disk()
-        print(f"[DEBUG-CM] Guardado en disco exitoso. Total mensajes: {len(self.current_conversation_data['messages'])}")
+            fields["title"] = content[:30].strip() + "..."
+        
+        with self._lock:
+            entry = {"messages": [message], "set": fields}
+            _apply_entry(self.current_conversation_data, entry)
+            self._append_current(entry)
+            if self.search_index:
+                data = self.current_conversation_data
+                self.search_index.add_messages(
+                    data["id"], data.get("title"), data.get("updated_at"), [message], self.message_count() - 1
+                )
+            self._evict()
+        print(f"[DEBUG-CM] Guardado en disco exitoso. Total mensajes: {self.message_count()}")
 
     def update_conversation_history(self, history):
         """Actualiza todo el historial de la conversación actual (sincronizar con chat_engine)"""
         if not self.current_conversation_id:
             self.create_conversation()
             
-        self.current_conversation_data["messages"] = history
-        self.current_conversation_data["updated_at"] = datetime.now().isoformat()
-        self._save_to_disk()
+        with self._lock:
+            self.current_conversation_data["messages"] = history
+            self.message_offset = 0
+            # El resumen acumulado describe mensajes que ya no existen
+            state = self.current_conversation_data.get("rolling_summary")
+            if state and state.get("covered", 0) > len(history):
+                self.current_conversation_data.pop("rolling_summary")
+            self.current_conversation_data["updated_at"] = datetime.now().isoformat()
+            # Se reescribe todo: la instantánea nueva sustituye al diario
+            self._save_to_disk()
+            if self.search_index:
+                self.search_index.reindex(self.current_conversation_data)
 
     def load_conversation(self, conversation_id):
-        """Carga una conversación específica por ID"""
-        filepath = os.path.join(self.conversations_dir, f"{conversation_id}.json")
-        
-        if not os.path.exists(filepath):
-            return None
-            
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.current_conversation_id = data["id"]
-                self.current_conversation_data = data
-                return data
-        except Exception as e:
-            print(f"Error cargando conversación {conversation_id}: {e}")
-            return None
+        """
+        Carga una conversación específica por ID (instantánea + diario).
+        Con window solo quedan en memoria los últimos mensajes (ver message_offset).
+        """
+        with self._lock:
+            data, entries, offset = self._replay_window(conversation_id, self.window)
+            if data is None:
+                return None
+            self.current_conversation_id = data["id"]
+            self.current_conversation_data = data
+            self.message_offset = offset
+            self._journal_entries = entries
+            self._unsaved = False
+            return data
+
+    def message_count(self):
+        """Mensajes de la conversación actual (incluidos los que no están en memoria)"""
+        if not self.current_conversation_data:
+            return 0
+        return self.message_offset + len(self.current_conversation_data["messages"])
+
+    def _evict(self):
+        """Saca de memoria los mensajes de la conversación actual que exceden la ventana"""
+        messages = self.current_conversation_data["messages"]
+        excess = len(messages) - self.window if self.window else 0
+        if excess > 0:
+            del messages[:excess]
+            self.message_offset += excess
 
     def list_conversations(self):
-        """Lista todas las conversaciones disponibles, ordenadas por fecha de actualización"""
-        conversations = []
-        
+        """
+        Lista todas las conversaciones disponibles, ordenadas por fecha de actualización.
+        Los datos salen de _index.json; solo se vuelven a leer las conversaciones cuyos
+        archivos cambiaron fuera de la aplicación (tamaño o mtime distintos).
+        """
         if not os.path.exists(self.conversations_dir):
             return []
+        # Las conversaciones recién creadas pueden estar aún en la cola de escritura
+        get_persistence().flush()
+        
+        with self._lock:
+            index = self._load_index()
+            seen = set()
+            reparsed = 0
+            for conversation_id in self.conversation_ids():
+                seen.add(conversation_id)
+                stat = self._file_stat(conversation_id)
+                entry = index.get(conversation_id)
+                if entry is not None and entry["stat"] is None:
+                    # Escrita por la aplicación: los metadatos ya están al día
+                    entry["stat"] = stat
+                    self._index_dirty = True
+                elif entry is None or entry["stat"] != stat:
+                    data = self._read(conversation_id)
+                    if data is None:
+                        index.pop(conversation_id, None)
+                        continue
+                    index[conversation_id] = self._index_entry(data, self._file_stat(conversation_id))
+                    self._index_dirty = True
+                    reparsed += 1
+            for conversation_id in set(index) - seen:
+                del index[conversation_id]
+                self._index_dirty = True
+            if reparsed:
+                print(f"[DEBUG-CM] Índice de conversaciones: {reparsed} releídas")
+            self._save_index()
             
-        for filename in os.listdir(self.conversations_dir):
-            if filename.endswith('.json'):
-                filepath = os.path.join(self.conversations_dir, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        conversations.append({
-                            "id": data.get("id"),
-                            "title": data.get("title", "Sin título"),
-                            "updated_at": data.get("updated_at", ""),
-                            "message_count": len(data.get("messages", []))
-                        })
-                except Exception:
-                    continue
+            conversations = [
+                {
+                    "id": entry["id"],
+                    "title": entry["title"],
+                    "updated_at": entry["updated_at"],
+                    "message_count": entry["message_count"]
+                }
+                for entry in index.values()
+            ]
         
         # Ordenar por fecha de actualización (más reciente primero)
         conversations.sort(key=lambda x: x["updated_at"], reverse=True)
         return conversations
 
+    def conversation_ids(self):
+        """Ids de las conversaciones en disco (normales y archivadas)"""
+        ids = set()
+        for directory in self._shard_dirs():
+            for filename in os.listdir(directory):
+                conversation_id = _conversation_id(filename, ('.json',) + ARCHIVE_SUFFIXES)
+                if conversation_id:
+                    ids.add(conversation_id)
+        return ids
+
+    def _shard_dir(self, conversation_id):
+        if not self.shard_chars:
+            return self.conversations_dir
+        return os.path.join(self.conversations_dir, conversation_id[:self.shard_chars])
+
+    def _shard_dirs(self):
+        if not self.shard_chars:
+            return [self.conversations_dir]
+        return [
+            entry.path for entry in os.scandir(self.conversations_dir)
+            if entry.is_dir() and len(entry.name) <= self.shard_chars and not entry.name.startswith('_')
+        ]
+
+    def _shard_flat_files(self):
+        """Mueve a su subdirectorio las conversaciones que aún están sueltas en conversaciones/"""
+        if not self.shard_chars or not os.path.isdir(self.conversations_dir):
+            return
+        moved = 0
+        for entry in os.scandir(self.conversations_dir):
+            conversation_id = _conversation_id(entry.name, ('.json', '.jsonl') + ARCHIVE_SUFFIXES)
+            if not conversation_id or not entry.is_file():
+                continue
+            get_persistence().flush(entry.path)
+            os.makedirs(self._shard_dir(conversation_id), exist_ok=True)
+            # rename conserva tamaño y mtime: el índice del listado sigue siendo válido
+            os.replace(entry.path, os.path.join(self._shard_dir(conversation_id), entry.name))
+            moved += 1
+        if moved:
+            print(f"[INFO] {moved} archivos de conversaciones movidos a subdirectorios por prefijo")
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored.get("version") == CONVERSATION_INDEX_VERSION:
+                    self._index = stored.get("conversations", {})
+                    # Pendientes de anotar cuando se guardó: pudieron no llegar a escribirse
+                    for entry in self._index.values():
+                        if entry.get("stat") is None:
+                            entry["stat"] = []
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[WARNING] Índice de conversaciones ilegible, se reconstruye: {e}")
+        return self._index
+
+    def _save_index(self):
+        if self._index_dirty:
+            get_persistence().write_json(
+                self.index_path, {"version": CONVERSATION_INDEX_VERSION, "conversations": self._index}
+            )
+            self._index_dirty = False
+
+    def _file_stat(self, conversation_id):
+        """[tamaño, mtime] de la instantánea, el diario y el archivo comprimido (None si no existen)"""
+        stat = []
+        paths = [self._snapshot_path(conversation_id), self._journal_path(conversation_id)]
+        paths += [self._snapshot_path(conversation_id) + suffix[len('.json'):] for suffix in ARCHIVE_SUFFIXES]
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stat.append([st.st_size, st.st_mtime_ns])
+            except OSError:
+                stat.append(None)
+        return stat
+
+    @staticmethod
+    def _index_entry(data, stat=None, message_count=None):
+        return {
+            "id": data.get("id"),
+            "title": data.get("title", "Sin título"),
+            "updated_at": data.get("updated_at", ""),
+            "message_count": len(data.get("messages", [])) if message_count is None else message_count,
+            "stat": stat  # None = cambiada por la aplicación, se anota al listar
+        }
+
+    def _touch_index(self, conversation_id, data):
+        """Actualiza la entrada del índice tras un guardado (el archivo se escribe al listar)"""
+        with self._lock:
+            self._load_index()[conversation_id] = self._index_entry(
+                data, message_count=self._message_total(data)
+            )
+            self._index_dirty = True
+
+    def _message_total(self, data):
+        """Mensajes de data contando los que la ventana dejó fuera de memoria"""
+        if data is self.current_conversation_data:
+            return self.message_count()
+        return len(data.get("messages", []))
+
+    def get_messages(self, conversation_id, start=0, limit=None):
+        """Mensajes [start, start + limit) de una conversación"""
+        with self._lock:
+            if conversation_id == self.current_conversation_id and start >= self.message_offset:
+                messages = self.current_conversation_data["messages"]
+                start -= self.message_offset
+            else:
+                messages = (self._read(conversation_id) or {}).get("messages", [])
+            return messages[start:None if limit is None else start + limit]
+
+    def get_rolling_summary(self, conversation_id=None):
+        """Resumen acumulado de una conversación: {"text", "covered"} (mensajes ya plegados)"""
+        with self._lock:
+            if conversation_id in (None, self.current_conversation_id):
+                data = self.current_conversation_data
+            else:
+                data = self._read(conversation_id)
+            state = (data or {}).get("rolling_summary") or {}
+            return {"text": state.get("text", ""), "covered": state.get("covered", 0)}
+
+    def set_rolling_summary(self, conversation_id, text, covered):
+        """Guarda el resumen acumulado (la conversación puede no ser la actual)"""
+        entry = {"set": {"rolling_summary": {"text": text, "covered": covered}}}
+        with self._lock:
+            if conversation_id == self.current_conversation_id:
+                _apply_entry(self.current_conversation_data, entry)
+                self._append_current(entry)
+                return True
+            data, _ = self._replay(conversation_id)
+            if data is None:
+                return False
+            self._append(conversation_id, data, entry)
+            return True
+
+    def _snapshot_path(self, conversation_id):
+        return os.path.join(self._shard_dir(conversation_id), f"{conversation_id}.json")
+
+    def _journal_path(self, conversation_id):
+        return os.path.join(self._shard_dir(conversation_id), f"{conversation_id}.jsonl")
+
+    def _read(self, conversation_id):
+        return self._replay(conversation_id)[0]
+
+    def _replay_window(self, conversation_id, window):
+        """Como _replay, pero con solo los últimos window mensajes: (datos, entradas, desplazamiento)"""
+        data, entries = self._replay(conversation_id)
+        offset = 0
+        if data is not None and window and len(data["messages"]) > window:
+            # El JSON se lee entero igualmente; lo anterior se libera al recortar
+            offset = len(data["messages"]) - window
+            data["messages"] = data["messages"][offset:]
+        return data, entries, offset
+
+    def _replay(self, conversation_id):
+        """
+        Instantánea con el diario aplicado y número de entradas del diario.
+        Una última línea a medio escribir (corte durante un guardado) se descarta.
+        """
+        # Primero la instantánea: vaciar el diario antes de escribirla perdería entradas
+        get_persistence().flush(self._snapshot_path(conversation_id))
+        get_persistence().flush(self._journal_path(conversation_id))
+        try:
+            with open(self._snapshot_path(conversation_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            # Archivada: no tiene diario (se desarchiva antes de añadirle nada)
+            return self._read_archive(conversation_id), 0
+        except Exception:
+            return None, 0
+        
+        journal_path = self._journal_path(conversation_id)
+        if not os.path.exists(journal_path):
+            return data, 0
+        with open(journal_path, 'rb') as f:
+            raw = f.read()
+        
+        entries = 0
+        offset = 0
+        valid_end = 0
+        for line in raw.splitlines(keepends=True):
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                if offset == len(raw):
+                    print(f"[WARNING] Última entrada incompleta en el diario de {conversation_id}, se descarta")
+                    self._repair_journal(journal_path, valid_end)
+                else:
+                    print(f"[WARNING] Entrada ilegible en el diario de {conversation_id}, se omite")
+                continue
+            if not line.endswith(b"\n"):
+                # Entrada completa a la que le faltó el salto de línea
+                self._repair_journal(journal_path, offset, newline=True)
+            valid_end = offset
+            entries += 1
+            # Las entradas ya incluidas en la instantánea (compactación interrumpida) se saltan
+            if entry.get("seq", 0) > data.get("journal_seq", 0):
+                _apply_entry(data, entry)
+                data["journal_seq"] = entry["seq"]
+        return data, entries
+
+    def _repair_journal(self, journal_path, size, newline=False):
+        with self._lock:
+            try:
+                with open(journal_path, 'r+b') as f:
+                    f.truncate(size)
+                    if newline:
+                        f.seek(size)
+                        f.write(b"\n")
+            except OSError as e:
+                print(f"[WARNING] No se pudo reparar el diario {journal_path}: {e}")
+
+    def _append(self, conversation_id, data, entry):
+        """Añade una entrada (ya aplicada en data) al diario de la conversación"""
+        self._unarchive(conversation_id)
+        data["journal_seq"] = data.get("journal_seq", 0) + 1
+        entry = dict(entry, seq=data["journal_seq"])
+        self._touch_index(conversation_id, data)
+        get_persistence().append(self._journal_path(conversation_id), json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _append_current(self, entry):
+        if self._unsaved:
+            # Primer mensaje de una conversación nueva: instantánea completa
+            self._save_to_disk()
+            return
+        self._append(self.current_conversation_id, self.current_conversation_data, entry)
+        self._journal_entries += 1
+        if self._journal_entries >= CONVERSATION_JOURNAL_COMPACT:
+            self._save_to_disk()
+
+    def _write(self, conversation_id, data):
+        """Compacta: reescribe la instantánea (de forma atómica) y vacía el diario"""
+        persistence = get_persistence()
+        self._touch_index(conversation_id, data)
+        try:
+            os.makedirs(self._shard_dir(conversation_id), exist_ok=True)
+            persistence.write_json(self._snapshot_path(conversation_id), data, indent=2)
+        except Exception as e:
+            print(f"Error guardando conversación: {e}")
+            return
+        # Se escribe después de la instantánea; si se corta en medio,
+        # las entradas del diario ya tienen seq <= journal_seq
+        journal_path = self._journal_path(conversation_id)
+        if os.path.exists(journal_path) or persistence.has_pending(journal_path):
+            persistence.write(journal_path, "")
+        archive_path = self._archive_path(conversation_id)
+        if archive_path:
+            # La instantánea nueva tiene que estar en disco antes de borrar la comprimida
+            persistence.flush(self._snapshot_path(conversation_id))
+            os.remove(archive_path)
+
     def delete_conversation(self, conversation_id):
         """Elimina una conversación"""
-        filepath = os.path.join(self.conversations_dir, f"{conversation_id}.json")
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        filepath = self._snapshot_path(conversation_id)
+        journal_path = self._journal_path(conversation_id)
+        persistence = get_persistence()
+        archive_path = self._archive_path(conversation_id)
+        if os.path.exists(filepath) or persistence.has_pending(filepath) or archive_path:
+            for path in (filepath, journal_path, archive_path):
+                if not path:
+                    continue
+                persistence.discard(path)
+                if os.path.exists(path):
+                    os.remove(path)
+            if self.search_index:
+                self.search_index.remove(conversation_id)
+            with self._lock:
+                if self._load_index().pop(conversation_id, None) is not None:
+                    self._index_dirty = True
+                    self._save_index()
             if self.current_conversation_id == conversation_id:
                 self.current_conversation_id = None
                 self.current_conversation_data = None
             return True
         return False
 
+    # --- Exportación e importación (conversation_tools.py) ---
+
+    def export_conversation(self, conversation_id):
+        """Conversación completa (diario aplicado, aunque esté archivada); None si no existe"""
+        data = self._read(conversation_id)
+        if data is not None:
+            data.pop("journal_seq", None)
+        return data
+
+    def import_conversation(self, data, replace=False):
+        """
+        Guarda una conversación exportada. Si ya existe solo se sustituye con replace
+        (nunca la abierta). Devuelve True si se escribió
+        """
+        conversation_id = data.get("id") if isinstance(data, dict) else None
+        if not isinstance(conversation_id, str) or not _VALID_ID.match(conversation_id) \
+                or not isinstance(data.get("messages"), list):
+            raise ValueError(f"Conversación no válida: {str(conversation_id)[:40]}")
+        for position, message in enumerate(data["messages"]):
+            if not isinstance(message, dict) or not isinstance(message.get("role"), str) \
+                    or not isinstance(message.get("content"), str):
+                raise ValueError(f"Conversación {conversation_id}: mensaje {position} no válido")
+        with self._lock:
+            if conversation_id == self.current_conversation_id:
+                return False
+            if self._exists(conversation_id):
+                if not replace:
+                    return False
+                # Borrar antes: el diario antiguo no debe aplicarse sobre la importada
+                self.delete_conversation(conversation_id)
+            data = dict(data, journal_seq=0)
+            self._write(conversation_id, data)
+        if self.search_index:
+            self.search_index.reindex(data)
+        return True
+
+    def _exists(self, conversation_id):
+        snapshot_path = self._snapshot_path(conversation_id)
+        return (os.path.exists(snapshot_path) or get_persistence().has_pending(snapshot_path)
+                or self._archive_path(conversation_id) is not None)
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """Conversaciones cuyo contenido coincide con query (ver ConversationSearchIndex.search)"""
+        if not self.search_index:
+            return []
+        return self.search_index.search(query, limit)
+
+    def build_search_index(self):
+        """Indexa una única vez las conversaciones que ya existían antes del índice"""
+        index = self.search_index
+        if not index or index.is_built():
+            return
+        start = time.perf_counter()
+        conversations = self.list_conversations()
+        for conversation in conversations:
+            data = self._read(conversation["id"])
+            if data:
+                # reindex sustituye: no duplica lo que se haya guardado mientras tanto
+                index.reindex(data)
+        index.mark_built()
+        print(f"[INFO] Búsqueda: {len(conversations)} conversaciones indexadas en {time.perf_counter() - start:.1f}s")
+
     def _save_to_disk(self):
-        """Escribe la conversación actual al disco"""
+        """Escribe la conversación actual completa al disco (compactación)"""
         if not self.current_conversation_data:
             return
-            
-        filepath = os.path.join(self.conversations_dir, f"{self.current_conversation_id}.json")
+        
+        with self._lock:
+            data = self.current_conversation_data
+            if self.message_offset:
+                # Solo la cola está en memoria: se compacta lo que hay en disco (incluye el diario)
+                data = self._read(self.current_conversation_id)
+                if data is None:
+                    return
+            self._write(self.current_conversation_id, data)
+            self._journal_entries = 0
+            self._unsaved = False
+
+    # --- Archivado y limpieza ---
+
+    def _archive_path(self, conversation_id):
+        """Ruta de la versión comprimida si la conversación está archivada"""
+        for suffix in ARCHIVE_SUFFIXES:
+            path = self._snapshot_path(conversation_id) + suffix[len('.json'):]
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _read_archive(self, conversation_id):
+        path = self._archive_path(conversation_id)
+        if not path:
+            return None
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(self.current_conversation_data, f, ensure_ascii=False, indent=2)
+            with open(path, 'rb') as f:
+                return json.loads(_decompress(f.read(), path).decode('utf-8'))
         except Exception as e:
-            print(f"Error guardando conversación: {e}")
+            print(f"Error cargando conversación archivada {conversation_id}: {e}")
+            return None
+
+    def _unarchive(self, conversation_id):
+        """Vuelve a escribir en claro una conversación archivada antes de modificarla"""
+        with self._lock:
+            archive_path = self._archive_path(conversation_id)
+            if not archive_path:
+                return
+            data = self._read_archive(conversation_id)
+            if data is None:
+                return
+            persistence = get_persistence()
+            persistence.write_json(self._snapshot_path(conversation_id), data, indent=2)
+            persistence.flush(self._snapshot_path(conversation_id))
+            os.remove(archive_path)
+
+    def archive_conversations(self, older_than_days, compression=ARCHIVE_COMPRESSION):
+        """
+        Comprime las conversaciones sin cambios desde hace older_than_days días
+        (instantánea + diario -> un .json.gz / .json.zst). Se leen igual que las demás.
+        """
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        suffix = ".zst" if compression == "zstd" else ".gz"
+        cutoff = time.time() - older_than_days * 86400
+        get_persistence().flush()
+        
+        report = {"archived": 0, "bytes_before": 0, "bytes_after": 0, "load_ms_before": 0.0, "load_ms_after": 0.0}
+        for conversation_id in self.conversation_ids():
+            with self._lock:
+                if conversation_id == self.current_conversation_id:
+                    continue
+                paths = [p for p in (self._snapshot_path(conversation_id), self._journal_path(conversation_id))
+                         if os.path.exists(p)]
+                if not paths or paths[0] != self._snapshot_path(conversation_id):
+                    continue  # Ya archivada
+                if max(os.path.getmtime(p) for p in paths) > cutoff:
+                    continue
+                
+                start = time.perf_counter()
+                data = self._read(conversation_id)
+                load_before = time.perf_counter() - start
+                if not data or not data.get("messages"):
+                    continue  # Las vacías se eliminan en prune_empty_conversations
+                
+                archive_path = self._snapshot_path(conversation_id) + suffix
+                payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+                with open(archive_path + ".tmp", 'wb') as f:
+                    f.write(_compress(payload, compression))
+                os.replace(archive_path + ".tmp", archive_path)
+                
+                before = sum(os.path.getsize(p) for p in paths)
+                for path in paths:
+                    os.remove(path)
+                start = time.perf_counter()
+                if self._read(conversation_id) != data:
+                    # No debería pasar: se deja la conversación como estaba
+                    print(f"[WARNING] El archivo comprimido de {conversation_id} no coincide, se descarta")
+                    self._write(conversation_id, data)
+                    continue
+                load_after = time.perf_counter() - start
+                
+                self._touch_index(conversation_id, data)
+                report["archived"] += 1
+                report["bytes_before"] += before
+                report["bytes_after"] += os.path.getsize(archive_path)
+                report["load_ms_before"] += load_before * 1000
+                report["load_ms_after"] += load_after * 1000
+        
+        if report["archived"]:
+            # Tiempo medio de carga de una conversación antes y después de comprimirla
+            report["load_ms_before"] = round(report["load_ms_before"] / report["archived"], 2)
+            report["load_ms_after"] = round(report["load_ms_after"] / report["archived"], 2)
+        return report
+
+    def prune_empty_conversations(self):
+        """Elimina las conversaciones sin mensajes (salvo la actual)"""
+        pruned, reclaimed = 0, 0
+        get_persistence().flush()
+        for conversation_id in self.conversation_ids():
+            if conversation_id == self.current_conversation_id:
+                continue
+            data = self._read(conversation_id)
+            if data is None or data.get("messages"):
+                continue
+            size = sum(entry[0] for entry in self._file_stat(conversation_id) if entry)
+            if self.delete_conversation(conversation_id):
+                pruned += 1
+                reclaimed += size
+        return {"pruned": pruned, "bytes": reclaimed}
+
+    def maintain_storage(self, archive_after_days=None, prune_empty=True, compression=ARCHIVE_COMPRESSION):
+        """Limpieza y archivado en segundo plano; deja el informe en storage_report"""
+        report = {}
+        if prune_empty:
+            report["prune"] = self.prune_empty_conversations()
+        if archive_after_days:
+            report["archive"] = self.archive_conversations(archive_after_days, compression)
+        
+        prune, archive = report.get("prune"), report.get("archive")
+        if prune and prune["pruned"]:
+            print(f"[INFO] {prune['pruned']} conversaciones vacías eliminadas ({prune['bytes'] / 1024:.1f} KB)")
+        if archive and archive["archived"]:
+            print(f"[INFO] {archive['archived']} conversaciones archivadas: "
+                  f"{archive['bytes_before'] / 1024:.1f} KB -> {archive['bytes_after'] / 1024:.1f} KB, "
+                  f"carga {archive['load_ms_before']:.2f} ms -> {archive['load_ms_after']:.2f} ms")
+        self.storage_report = report
+        return report
+
+
+def create_conversation_manager(backend=CONVERSATION_BACKEND, search=True, shard_chars=CONVERSATION_SHARD_CHARS):
+    """Gestor de conversaciones para el backend indicado ("json" o "sqlite"), con índice de búsqueda"""
+    search_index = None
+    if search:
+        from conversation_search import ConversationSearchIndex
+        search_index = ConversationSearchIndex()
+    if backend == "sqlite":
+        from conversation_sqlite import SQLiteConversationManager
+        return SQLiteConversationManager(search_index=search_index, shard_chars=shard_chars)
+    if backend != "json":
+        print(f"[WARNING] Backend de conversaciones desconocido '{backend}', se usa json")
+    return ConversationManager(search_index, shard_chars)
+
+
+def _conversation_id(filename, suffixes):
+    """Id de la conversación de un archivo de conversaciones/ (None si no es de una)"""
+    # Los archivos que empiezan por "_" son de la aplicación (_index.json)
+    if filename.startswith('_'):
+        return None
+    for suffix in suffixes:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def _compress(payload, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    return gzip.compress(payload, compresslevel=9)
+
+
+def _decompress(payload, path):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("zstandard no está instalado (necesario para archivos .zst)")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return gzip.decompress(payload)
+
+
+def _apply_entry(data, entry):
+    """Aplica una entrada del diario: mensajes añadidos y campos cambiados (None = borrar)"""
+    data["messages"].extend(entry.get("messages", []))
+    for key, value in entry.get("set", {}).items():
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda en Conversaciones
+Índice de texto completo (SQLite FTS5) sobre el contenido de los mensajes.
+Se actualiza al guardar cada mensaje; solo se recorre conversaciones/ la primera
+vez, para indexar lo que ya existía.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+from config import SEARCH_INDEX_FILE, SEARCH_MAX_RESULTS
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text):
+    """Texto libre a consulta FTS5: todas las palabras, cada una como prefijo"""
+    words = _WORD.findall(text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class ConversationSearchIndex:
+    """Índice FTS5 de mensajes con los títulos de cada conversación"""
+
+    def __init__(self, path=SEARCH_INDEX_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.available = True
+        try:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS indexed_messages (
+                    id INTEGER PRIMARY KEY,
+                    conversation_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    UNIQUE (conversation_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS indexed_conversations (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+                    content, content='indexed_messages', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS indexed_messages_ai AFTER INSERT ON indexed_messages BEGIN
+                    INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS indexed_messages_ad AFTER DELETE ON indexed_messages BEGIN
+                    INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END;
+                CREATE TABLE IF NOT EXISTS meta (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            # Los índices de versiones anteriores pudieron quedarse con entradas huérfanas
+            # (INSERT OR REPLACE no borraba la fila sustituida del FTS): se reconstruye una vez
+            if self._conn.execute("SELECT 1 FROM meta WHERE name = 'fts_rebuilt'").fetchone() is None:
+                self._conn.execute("INSERT INTO message_fts(message_fts) VALUES('rebuild')")
+                self._conn.execute("INSERT INTO meta(name, value) VALUES('fts_rebuilt', '1')")
+            self._conn.commit()
+        except sqlite3.OperationalError as e:
+            # SQLite compilado sin FTS5
+            print(f"[WARNING] Búsqueda de conversaciones no disponible: {e}")
+            self.available = False
+
+    # --- Mantenimiento ---
+
+    def add_messages(self, conversation_id, title, updated_at, messages, start):
+        """Indexa mensajes nuevos (start = posición del primero) y actualiza el título"""
+        if not self.available:
+            return
+        with self._lock:
+            self._upsert_conversation(conversation_id, title, updated_at)
+            self._insert(conversation_id, messages, start)
+            self._conn.commit()
+
+    def reindex(self, data):
+        """Sustituye todo lo indexado de una conversación"""
+        if not self.available:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM indexed_messages WHERE conversation_id = ?", (data["id"],))
+            self._upsert_conversation(data["id"], data.get("title", ""), data.get("updated_at", ""))
+            self._insert(data["id"], data.get("messages", []), 0)
+            self._conn.commit()
+
+    def remove(self, conversation_id):
+        if not self.available:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM indexed_messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM indexed_conversations WHERE id = ?", (conversation_id,))
+            self._conn.commit()
+
+    def is_built(self):
+        """True si ya se indexaron las conversaciones existentes"""
+        if not self.available:
+            return True
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE name = 'built'").fetchone() is not None
+
+    def mark_built(self):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES('built', '1')")
+            self._conn.commit()
+
+    def _upsert_conversation(self, conversation_id, title, updated_at):
+        self._conn.execute(
+            "INSERT INTO indexed_conversations(id, title, updated_at) VALUES(?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at",
+            (conversation_id, title or "", updated_at or "")
+        )
+
+    def _insert(self, conversation_id, messages, start):
+        rows = [(conversation_id, position, m.get("role", ""), m.get("content", ""))
+                for position, m in enumerate(messages, start) if m.get("content")]
+        # Borrado explícito de lo que se sustituye: INSERT OR REPLACE no dispara el trigger
+        # de borrado (recursive_triggers está desactivado) y dejaría la entrada vieja en el FTS
+        self._conn.executemany(
+            "DELETE FROM indexed_messages WHERE conversation_id = ? AND position = ?",
+            [row[:2] for row in rows]
+        )
+        self._conn.executemany(
+            "INSERT INTO indexed_messages(conversation_id, position, role, content) VALUES(?, ?, ?, ?)",
+            rows
+        )
+
+    # --- Consulta ---
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS, mark=("«", "»")):
+        """
+        Conversaciones que contienen todas las palabras de query (por prefijo),
+        de más a menos relevante, con el fragmento del mejor mensaje resaltado con mark
+        """
+        match = fts_query(query)
+        if not self.available or not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT m.conversation_id, m.position, m.role, "
+                "snippet(message_fts, 0, ?, ?, '…', 16), c.title, c.updated_at "
+                "FROM message_fts JOIN indexed_messages m ON m.id = message_fts.rowid "
+                "LEFT JOIN indexed_conversations c ON c.id = m.conversation_id "
+                "WHERE message_fts MATCH ? ORDER BY bm25(message_fts) LIMIT ?",
+                (mark[0], mark[1], match, limit * 10)
+            ).fetchall()
+
+            results = {}
+            for conversation_id, position, role, snippet, title, updated_at in rows:
+                if conversation_id in results or len(results) == limit:
+                    continue
+                results[conversation_id] = {
+                    "id": conversation_id,
+                    "title": title or "Sin título",
+                    "updated_at": updated_at or "",
+                    "position": position,
+                    "role": role,
+                    "snippet": snippet,
+                    "matches": 0
+                }
+            # Las filas de arriba están limitadas: las coincidencias se cuentan aparte
+            if results:
+                placeholders = ", ".join("?" * len(results))
+                counts = self._conn.execute(
+                    "SELECT m.conversation_id, COUNT(*) "
+                    "FROM message_fts JOIN indexed_messages m ON m.id = message_fts.rowid "
+                    f"WHERE message_fts MATCH ? AND m.conversation_id IN ({placeholders}) "
+                    "GROUP BY m.conversation_id",
+                    [match, *results]
+                ).fetchall()
+                for conversation_id, count in counts:
+                    results[conversation_id]["matches"] = count
+        return list(results.values())
+
+    def get_stats(self):
+        if not self.available:
+            return {'available': False}
+        with self._lock:
+            messages = self._conn.execute("SELECT COUNT(*) FROM indexed_messages").fetchone()[0]
+            conversations = self._conn.execute("SELECT COUNT(*) FROM indexed_conversations").fetchone()[0]
+        return {'available': True, 'conversations': conversations, 'messages': messages}
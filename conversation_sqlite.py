@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Conversaciones en SQLite
+Misma API que ConversationManager pero con una tabla de conversaciones (indexada por
+updated_at) y otra de mensajes: el listado es una consulta y los mensajes se pueden
+pedir por páginas. La primera vez importa las conversaciones JSON existentes
+(los archivos se conservan, así que se puede volver al backend JSON).
+"""
+
+import os
+import json
+import sqlite3
+
+from config import CONVERSATIONS_DB, CONVERSATION_SHARD_CHARS
+from conversation_manager import ConversationManager
+
+# Columnas propias; el resto de campos (rolling_summary...) va en extra como JSON
+_CONVERSATION_COLUMNS = ("title", "created_at", "updated_at")
+_MESSAGE_COLUMNS = ("role", "content", "timestamp")
+
+
+class SQLiteConversationManager(ConversationManager):
+    """Gestor de conversaciones sobre SQLite"""
+
+    def __init__(self, path=CONVERSATIONS_DB, search_index=None, shard_chars=CONVERSATION_SHARD_CHARS):
+        super().__init__(search_index, shard_chars)
+        self.db_path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                extra TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at);
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT,
+                extra TEXT,
+                PRIMARY KEY (conversation_id, position)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+        self._migrate_json()
+
+    # --- Migración ---
+
+    def _migrate_json(self):
+        """Importa una sola vez las conversaciones JSON (instantánea + diario)"""
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE name = 'json_migrated'").fetchone()
+            if done:
+                return
+            json_manager = ConversationManager(shard_chars=self.shard_chars)
+            imported = 0
+            if os.path.exists(self.conversations_dir):
+                for conversation_id in json_manager.conversation_ids():
+                    data = json_manager._read(conversation_id)
+                    if not data or not data.get("id"):
+                        continue
+                    exists = self._conn.execute(
+                        "SELECT 1 FROM conversations WHERE id = ?", (data["id"],)
+                    ).fetchone()
+                    if not exists:
+                        self._insert(data)
+                        imported += 1
+            self._conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES('json_migrated', '1')")
+            self._conn.commit()
+            if imported:
+                print(f"[INFO] {imported} conversaciones JSON importadas a {os.path.basename(self.db_path)}")
+
+    # --- Almacenamiento (sustituye al diario JSONL) ---
+
+    def _replay(self, conversation_id):
+        return self._replay_window(conversation_id, None)[:2]
+
+    def _replay_window(self, conversation_id, window):
+        """Solo se leen de la tabla los últimos window mensajes"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, title, created_at, updated_at, extra, message_count FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None, 0, 0
+            data = json.loads(row[4] or "{}")
+            data.update({"id": row[0], "title": row[1], "created_at": row[2], "updated_at": row[3]})
+            offset = max(0, row[5] - window) if window else 0
+            data["messages"] = self.get_messages(conversation_id, offset)
+            return data, 0, offset
+
+    def _append(self, conversation_id, data, entry):
+        """Inserta los mensajes nuevos y actualiza los campos cambiados"""
+        with self._lock:
+            total = self._message_total(data)
+            start = total - len(entry.get("messages", []))
+            self._insert_messages(conversation_id, entry.get("messages", []), start)
+            self._conn.execute(
+                "UPDATE conversations SET title = ?, updated_at = ?, message_count = ?, extra = ? WHERE id = ?",
+                (data.get("title", ""), data.get("updated_at", ""), total,
+                 self._extra(data), conversation_id)
+            )
+            self._conn.commit()
+
+    def _append_current(self, entry):
+        if self._unsaved:
+            self._save_to_disk()
+            return
+        # Sin diario que compactar
+        self._append(self.current_conversation_id, self.current_conversation_data, entry)
+
+    def _write(self, conversation_id, data):
+        """Reescribe la conversación completa"""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._insert(data)
+            self._conn.commit()
+
+    def _insert(self, data):
+        self._conn.execute(
+            "INSERT INTO conversations(id, title, created_at, updated_at, message_count, extra) "
+            "VALUES(?, ?, ?, ?, ?, ?)",
+            (data["id"], data.get("title", "Sin título"), data.get("created_at", ""),
+             data.get("updated_at", ""), len(data.get("messages", [])), self._extra(data))
+        )
+        self._insert_messages(data["id"], data.get("messages", []), 0)
+
+    def _insert_messages(self, conversation_id, messages, start):
+        rows = []
+        for position, message in enumerate(messages, start):
+            extra = {k: v for k, v in message.items() if k not in _MESSAGE_COLUMNS}
+            rows.append((conversation_id, position, message.get("role", ""), message.get("content", ""),
+                         message.get("timestamp"), json.dumps(extra, ensure_ascii=False) if extra else None))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO messages(conversation_id, position, role, content, timestamp, extra) "
+            "VALUES(?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    @staticmethod
+    def _extra(data):
+        extra = {k: v for k, v in data.items()
+                 if k not in _CONVERSATION_COLUMNS + ("id", "messages", "journal_seq")}
+        return json.dumps(extra, ensure_ascii=False)
+
+    # --- API ---
+
+    def list_conversations(self):
+        """Lista todas las conversaciones (una consulta sobre el índice de updated_at)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, title, updated_at, message_count FROM conversations ORDER BY updated_at DESC"
+            ).fetchall()
+        return [
+            {"id": row[0], "title": row[1] or "Sin título", "updated_at": row[2], "message_count": row[3]}
+            for row in rows
+        ]
+
+    def conversation_ids(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT id FROM conversations")}
+
+    def _exists(self, conversation_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone() is not None
+
+    def get_messages(self, conversation_id, start=0, limit=None):
+        """Mensajes [start, start + limit) de una conversación sin cargar el resto"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, timestamp, extra FROM messages "
+                "WHERE conversation_id = ? AND position >= ? ORDER BY position LIMIT ?",
+                (conversation_id, start, -1 if limit is None else limit)
+            ).fetchall()
+        messages = []
+        for role, content, timestamp, extra in rows:
+            message = {"role": role, "content": content, "timestamp": timestamp}
+            if extra:
+                message.update(json.loads(extra))
+            messages.append(message)
+        return messages
+
+    def prune_empty_conversations(self):
+        """Elimina las conversaciones sin mensajes (salvo la actual)"""
+        with self._lock:
+            pruned = [row[0] for row in self._conn.execute(
+                "SELECT id FROM conversations WHERE message_count = 0 AND id != ?",
+                (self.current_conversation_id or "",)
+            )]
+            self._conn.executemany("DELETE FROM conversations WHERE id = ?", [(i,) for i in pruned])
+            self._conn.commit()
+        if self.search_index:
+            for conversation_id in pruned:
+                self.search_index.remove(conversation_id)
+        return {"pruned": len(pruned), "bytes": 0}
+
+    def archive_conversations(self, older_than_days, compression=None):
+        # Ya están todas en un solo archivo: no hay conversaciones sueltas que comprimir
+        return {"archived": 0, "bytes_before": 0, "bytes_after": 0, "load_ms_before": 0.0, "load_ms_after": 0.0}
+
+    def delete_conversation(self, conversation_id):
+        """Elimina una conversación"""
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM conversations WHERE id = ?", (conversation_id,)
+            ).rowcount
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.commit()
+        if not deleted:
+            return False
+        if self.search_index:
+            self.search_index.remove(conversation_id)
+        if self.current_conversation_id == conversation_id:
+            self.current_conversation_id = None
+            self.current_conversation_data = None
+        return True
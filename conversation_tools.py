@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación e Importación de Conversaciones
+Copia de seguridad, migración entre backends o siembra de una instalación nueva
+en JSONL: una conversación completa por línea (con .gz se comprime). Todo va en
+streaming, así que la memoria no crece con el número de conversaciones; al
+exportar, varios hilos leen (y descomprimen) conversaciones a la vez.
+
+Uso:
+    python conversation_tools.py export copia.jsonl.gz
+    python conversation_tools.py import copia.jsonl.gz --replace
+    python conversation_tools.py export - --backend sqlite > copia.jsonl
+"""
+import sys
+import gzip
+import json
+import time
+import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CONVERSATION_BACKEND, EXPORT_WORKERS, CONVERSATION_SHARD_CHARS
+from conversation_manager import create_conversation_manager
+from persistence import get_persistence
+
+IMPORT_FLUSH_EVERY = 200  # Conversaciones importadas entre volcados de la cola de escritura
+
+
+def open_jsonl(path, mode):
+    """Archivo JSONL de texto: "-" = entrada/salida estándar, .gz = comprimido"""
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout if mode == "w" else sys.stdin)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def export_conversations(manager, out, workers=EXPORT_WORKERS):
+    """
+    Escribe en out una línea JSON por conversación, en orden de id.
+    Solo hay workers * 4 conversaciones leídas a la espera de escribirse.
+    """
+    start = time.perf_counter()
+    report = {"conversations": 0, "messages": 0, "errors": 0}
+
+    def write(future):
+        try:
+            data = future.result()
+        except Exception as e:
+            print(f"[WARNING] Conversación ilegible, se omite: {e}")
+            report["errors"] += 1
+            return
+        if data is None:
+            return
+        out.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n")
+        report["conversations"] += 1
+        report["messages"] += len(data.get("messages", []))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for conversation_id in sorted(manager.conversation_ids()):
+            pending.append(pool.submit(manager.export_conversation, conversation_id))
+            if len(pending) >= workers * 4:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    return report
+
+
+def import_conversations(manager, lines, replace=False):
+    """Importa una conversación por línea JSON; las que ya existen solo se sustituyen con replace"""
+    start = time.perf_counter()
+    report = {"imported": 0, "skipped": 0, "errors": 0}
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            imported = manager.import_conversation(json.loads(line), replace=replace)
+        except ValueError as e:
+            print(f"[WARNING] Línea {number}: {e}")
+            report["errors"] += 1
+            continue
+        report["imported" if imported else "skipped"] += 1
+        if report["imported"] and report["imported"] % IMPORT_FLUSH_EVERY == 0:
+            # La cola de escritura guarda el contenido hasta volcarlo: se vacía cada poco
+            get_persistence().flush()
+
+    get_persistence().flush()
+    # Deja el índice del listado al día (si no, el primer listado releería todo lo importado)
+    manager.list_conversations()
+    get_persistence().flush()
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta/importa conversaciones en JSONL")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help='Archivo .jsonl o .jsonl.gz ("-" = salida/entrada estándar)')
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=CONVERSATION_BACKEND)
+    parser.add_argument("--shard-chars", type=int, default=CONVERSATION_SHARD_CHARS,
+                        help="Subdirectorios por prefijo del id (backend json; mueve allí las sueltas)")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="Hilos de lectura al exportar")
+    parser.add_argument("--replace", action="store_true", help="Sustituir las conversaciones que ya existen")
+    parser.add_argument("--no-search", action="store_true", help="No indexar para la búsqueda al importar")
+    args = parser.parse_args()
+
+    # Con "-" la salida estándar lleva los datos: los mensajes van a stderr
+    with open_jsonl(args.path, "w" if args.command == "export" else "r") as f, \
+            contextlib.redirect_stdout(sys.stderr):
+        if args.command == "export":
+            manager = create_conversation_manager(args.backend, search=False, shard_chars=args.shard_chars)
+            report = export_conversations(manager, f, args.workers)
+            print(f"✅ {report['conversations']} conversaciones ({report['messages']} mensajes) "
+                  f"exportadas en {report['seconds']}s")
+        else:
+            manager = create_conversation_manager(args.backend, search=not args.no_search, shard_chars=args.shard_chars)
+            report = import_conversations(manager, f, args.replace)
+            print(f"✅ {report['imported']} conversaciones importadas, {report['skipped']} ya existían "
+                  f"en {report['seconds']}s")
+        if report["errors"]:
+            print(f"⚠️ {report['errors']} con errores (ver avisos)")
+
+
+if __name__ == "__main__":
+    main()
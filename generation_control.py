@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Control de Generación
+Cancelación cooperativa, plazos y presupuestos de tokens para las generaciones del LLM
+"""
+
+import time
+import threading
+
+# Motivo con el que se cancela una tarea en segundo plano al llegar una petición del usuario
+PREEMPTED_REASON = "cedida a una petición del usuario"
+
+
+class CancellationToken:
+    """
+    Señal de parada que el bucle de generación consulta entre tokens.
+    Se detiene si alguien llama a cancel(), si vence el plazo (deadline_seconds)
+    o si se agota el presupuesto de tokens (max_tokens).
+    """
+
+    def __init__(self, deadline_seconds=None, max_tokens=None, background=False):
+        self._event = threading.Event()
+        # Las generaciones en segundo plano se cancelan cuando llega una petición del usuario
+        self.background = background
+        self.created_at = time.monotonic()
+        self.deadline = self.created_at + deadline_seconds if deadline_seconds else None
+        self.max_tokens = max_tokens
+        self.tokens_generated = 0
+        self.reason = None
+
+    def cancel(self, reason="cancelada"):
+        """Pide detener la generación"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def should_stop(self):
+        """Comprueba cancelación, plazo y presupuesto (se llama entre tokens)"""
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("plazo agotado")
+            return True
+        if self.max_tokens is not None and self.tokens_generated >= self.max_tokens:
+            self.cancel("presupuesto de tokens agotado")
+            return True
+        return False
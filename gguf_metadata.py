@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Metadatos GGUF
+Lee la cabecera de un modelo GGUF (sin cargar los pesos) para conocer su contexto
+de entrenamiento y la forma de la atención, y con ello dimensionar la caché KV:
+bytes por token y n_ctx que cabe en un presupuesto de RAM.
+"""
+
+import os
+import struct
+
+GGUF_MAGIC = b"GGUF"
+
+# Tipos de valor de la cabecera GGUF -> formato struct (None = tratamiento especial)
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+_SCALAR_FORMATS = {
+    _UINT8: "<B", _INT8: "<b", _UINT16: "<H", _INT16: "<h", _UINT32: "<I", _INT32: "<i",
+    _FLOAT32: "<f", _BOOL: "<?", _UINT64: "<Q", _INT64: "<q", _FLOAT64: "<d",
+}
+
+# Tipos de la caché KV admitidos por llama.cpp: id de ggml y bytes por elemento
+KV_CACHE_TYPES = {
+    "f32": (0, 4.0),
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),  # Bloques de 32 valores: 32 bytes + escala f16
+    "q5_1": (7, 24 / 32),
+    "q5_0": (6, 22 / 32),
+    "q4_1": (3, 20 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+_cache = {}
+
+
+def _read(f, fmt):
+    size = struct.calcsize(fmt)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Cabecera GGUF truncada")
+    return struct.unpack(fmt, data)[0]
+
+
+def _read_string(f, length_fmt):
+    length = _read(f, length_fmt)
+    return f.read(length).decode("utf-8", errors="replace")
+
+
+def _read_value(f, value_type, length_fmt):
+    if value_type in _SCALAR_FORMATS:
+        return _read(f, _SCALAR_FORMATS[value_type])
+    if value_type == _STRING:
+        return _read_string(f, length_fmt)
+    if value_type == _ARRAY:
+        item_type = _read(f, "<I")
+        count = _read(f, length_fmt)
+        # Los arrays (vocabulario, fusiones...) no interesan aquí: se saltan
+        if item_type in _SCALAR_FORMATS:
+            f.seek(count * struct.calcsize(_SCALAR_FORMATS[item_type]), os.SEEK_CUR)
+        else:
+            for _ in range(count):
+                _read_value(f, item_type, length_fmt)
+        return None
+    raise ValueError(f"Tipo de valor GGUF desconocido: {value_type}")
+
+
+def read_gguf_metadata(path):
+    """
+    Pares clave-valor escalares de la cabecera (los arrays se omiten).
+    Se cachea por ruta, tamaño y fecha de modificación.
+    """
+    stat = os.stat(path)
+    cache_key = (path, stat.st_size, stat.st_mtime_ns)
+    if cache_key in _cache:
+        return _cache[cache_key]
+
+    metadata = {}
+    with open(path, "rb") as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise ValueError(f"{os.path.basename(path)} no es un archivo GGUF")
+        version = _read(f, "<I")
+        # La versión 1 usaba enteros de 32 bits para contadores y longitudes
+        length_fmt = "<I" if version == 1 else "<Q"
+        _read(f, length_fmt)  # Número de tensores
+        kv_count = _read(f, length_fmt)
+        for _ in range(kv_count):
+            key = _read_string(f, length_fmt)
+            value = _read_value(f, _read(f, "<I"), length_fmt)
+            if value is not None:
+                metadata[key] = value
+
+    _cache[cache_key] = metadata
+    return metadata
+
+
+def model_shape(metadata):
+    """Dimensiones que determinan la caché KV (None si faltan en los metadatos)"""
+    arch = metadata.get("general.architecture")
+    if not arch:
+        return None
+
+    def field(name):
+        return metadata.get(f"{arch}.{name}")
+
+    n_layer = field("block_count")
+    n_head = field("attention.head_count")
+    n_embd = field("embedding_length")
+    if not (n_layer and n_head and n_embd):
+        return None
+    head_dim = n_embd // n_head
+    return {
+        "architecture": arch,
+        "context_length": field("context_length"),
+        "n_layer": n_layer,
+        "n_head": n_head,
+        "n_head_kv": field("attention.head_count_kv") or n_head,
+        "key_length": field("attention.key_length") or head_dim,
+        "value_length": field("attention.value_length") or head_dim,
+    }
+
+
+def kv_bytes_per_token(shape, type_k="f16", type_v="f16"):
+    """Bytes de caché KV por token de contexto (todas las capas, claves + valores)"""
+    k_bytes = KV_CACHE_TYPES[type_k][1]
+    v_bytes = KV_CACHE_TYPES[type_v][1]
+    per_layer = shape["n_head_kv"] * (shape["key_length"] * k_bytes + shape["value_length"] * v_bytes)
+    return int(shape["n_layer"] * per_layer)
+
+
+def choose_context_length(shape, budget_mb, type_k="f16", type_v="f16", minimum=512, step=256):
+    """
+    Mayor n_ctx (múltiplo de step) cuya caché KV cabe en budget_mb,
+    sin pasar del contexto con el que se entrenó el modelo
+    """
+    per_token = kv_bytes_per_token(shape, type_k, type_v)
+    fits = int(budget_mb * 1024 * 1024 // per_token) // step * step
+    trained = shape.get("context_length") or fits
+    return max(minimum, min(fits, trained))
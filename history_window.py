@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Ventana del Historial
+La conversación abierta solo guarda en memoria sus últimos mensajes, junto con la
+suma acumulada de sus tokens estimados. Los anteriores se piden al almacén
+(ConversationManager.get_messages) cuando hacen falta: al desplazarse hacia atrás
+en la UI, al plegarlos en el resumen... Los índices son posiciones en la
+conversación completa, como en una lista.
+"""
+
+from bisect import bisect_left
+
+from config import HISTORY_WINDOW_MESSAGES
+
+
+def estimate_tokens(message):
+    """Misma estimación que el recorte del prompt: 1 token ≈ 4 caracteres + etiquetas"""
+    return len(message.get("content") or "") / 4 + 10
+
+
+class HistoryWindow:
+    """Últimos mensajes de una conversación; los anteriores se leen bajo demanda"""
+
+    def __init__(self, fetch=None, messages=(), offset=0, window=HISTORY_WINDOW_MESSAGES):
+        self.fetch = fetch  # fetch(start, limit) -> mensajes del almacén
+        self.window = window  # None = sin límite
+        self.offset = offset  # Posición en la conversación del primer mensaje en memoria
+        self.messages = []
+        self._cumulative = []  # Tokens acumulados hasta cada mensaje en memoria (incluido)
+        self._base = 0.0  # Acumulado antes del primer mensaje en memoria
+        self.fetched = 0  # Mensajes leídos del almacén
+        for message in messages:
+            self._push(message)
+        self._evict()
+
+    def __len__(self):
+        """Mensajes de la conversación completa (no solo los que están en memoria)"""
+        return self.offset + len(self.messages)
+
+    def __iter__(self):
+        # Solo los mensajes en memoria: es lo que se muestra al abrir la conversación
+        return iter(self.messages)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError("HistoryWindow solo admite cortes consecutivos")
+            start, stop, _ = key.indices(len(self))
+            return self._range(start, max(start, stop))
+        index = key + len(self) if key < 0 else key
+        if not 0 <= index < len(self):
+            raise IndexError("Mensaje fuera de la conversación")
+        return self._range(index, index + 1)[0]
+
+    def append(self, message):
+        self._push(message)
+        self._evict()
+
+    def tokens(self):
+        """Tokens estimados de los mensajes en memoria"""
+        return self._cumulative[-1] - self._base if self._cumulative else 0
+
+    def tail(self, max_tokens, start=0):
+        """
+        Mensajes finales (a partir de start) cuyos tokens estimados suman como mucho
+        max_tokens: todo lo que puede entrar en el prompt. Si cabe la ventana entera,
+        se completa con una página anterior del almacén.
+        """
+        first = self.offset + self._fit(max_tokens)
+        if first > self.offset or self.offset <= start:
+            return self.messages[max(start, first) - self.offset:]
+        older = self._range(max(start, self.offset - (self.window or self.offset)), self.offset)
+        budget = max_tokens - self.tokens()
+        keep = 0
+        for message in reversed(older):
+            budget -= estimate_tokens(message)
+            if budget < 0:
+                break
+            keep += 1
+        return older[len(older) - keep:] + self.messages
+
+    def page(self, before, count):
+        """(inicio, mensajes) de los count mensajes anteriores a la posición before"""
+        start = max(0, before - count)
+        return start, self[start:before]
+
+    def get_stats(self):
+        return {
+            'total': len(self),
+            'in_memory': len(self.messages),
+            'offset': self.offset,
+            'window': self.window,
+            'tokens_in_memory': round(self.tokens()),
+            'fetched': self.fetched
+        }
+
+    # --- Interno ---
+
+    def _push(self, message):
+        previous = self._cumulative[-1] if self._cumulative else self._base
+        self.messages.append(message)
+        self._cumulative.append(previous + estimate_tokens(message))
+
+    def _evict(self):
+        excess = len(self.messages) - self.window if self.window else 0
+        if excess > 0:
+            self._base = self._cumulative[excess - 1]
+            del self.messages[:excess]
+            del self._cumulative[:excess]
+            self.offset += excess
+
+    def _fit(self, max_tokens):
+        """Índice (en memoria) del primer mensaje de la cola más larga que cabe en max_tokens"""
+        if not self._cumulative:
+            return 0
+        threshold = self._cumulative[-1] - max_tokens
+        if self._base >= threshold:
+            return 0
+        return bisect_left(self._cumulative, threshold) + 1
+
+    def _range(self, start, stop):
+        if start >= self.offset:
+            return self.messages[start - self.offset:stop - self.offset]
+        older = []
+        if self.fetch:
+            older = list(self.fetch(start, min(stop, self.offset) - start))
+            self.fetched += len(older)
+        return older + self.messages[:max(0, stop - self.offset)]
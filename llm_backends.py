@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Backends del Modelo
+Lo que LocalLLMClient necesita de un backend: preparar el modelo (descarga),
+cargarlo, liberarlo y dar una huella para la caché de respuestas.
+- LlamaCppBackend: GGUF real con llama-cpp-python (registro de modelos con presupuesto de RAM)
+- FakeBackend: modelo falso determinista que imita el streaming de Llama.__call__,
+  para medir RAG, persistencia o el servidor en máquinas sin modelo ni llama-cpp
+"""
+
+import os
+import re
+import time
+import zlib
+import random
+import hashlib
+import threading
+
+from config import (
+    MODELS_DIR, MODELS_CONFIG, CONTEXT_LENGTH, LLM_BACKEND,
+    FAKE_FIRST_TOKEN_MS, FAKE_PROMPT_TOKENS_PER_SECOND, FAKE_TOKENS_PER_SECOND,
+    FAKE_RESPONSE_TOKENS, FAKE_JITTER
+)
+
+FAKE_VOCAB_SIZE = 32000
+FAKE_BOS, FAKE_EOS = 2, 1
+_TOKEN_PATTERN = re.compile(r"\s*\w+|\s*[^\w\s]|\s+", re.UNICODE)
+_FAKE_WORDS = (
+    "el", "la", "de", "que", "en", "un", "una", "es", "por", "para", "con", "como",
+    "modelo", "respuesta", "idea", "tiempo", "forma", "parte", "caso", "ejemplo",
+    "claro", "bueno", "sencillo", "importante", "normalmente", "también", "además",
+    "puedes", "hacer", "tener", "pensar", "explicar", "usar", "ver", "decir",
+)
+
+
+def model_path_for(model_type):
+    return os.path.join(MODELS_DIR, MODELS_CONFIG[model_type]["filename"])
+
+
+class FakeLlama:
+    """
+    Sustituto de llama_cpp.Llama: mismas llamadas que usa la aplicación
+    (__call__ con stream, tokenize, token_bos...), texto determinista según el prompt
+    y tiempos simulados. Como Llama, reutiliza el prefijo común con la secuencia
+    anterior (prompt + respuesta) y solo "evalúa" el resto.
+    """
+
+    def __init__(self, first_token_ms=FAKE_FIRST_TOKEN_MS, prompt_tokens_per_second=FAKE_PROMPT_TOKENS_PER_SECOND,
+                 tokens_per_second=FAKE_TOKENS_PER_SECOND, response_tokens=FAKE_RESPONSE_TOKENS,
+                 jitter=FAKE_JITTER, n_ctx=CONTEXT_LENGTH, seed=0):
+        self.first_token_ms = first_token_ms
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.jitter = jitter
+        self._n_ctx = n_ctx
+        self._rng = random.Random(seed)
+        self._pieces = {}
+        self._last_tokens = []
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.prompt_tokens = 0  # Tokens de prompt recibidos
+        self.prompt_tokens_evaluated = 0  # Los que no venían del prefijo reutilizado
+        self.completion_tokens = 0
+
+    # --- API de Llama usada por la aplicación ---
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def n_vocab(self):
+        return FAKE_VOCAB_SIZE
+
+    def token_bos(self):
+        return FAKE_BOS
+
+    def token_eos(self):
+        return FAKE_EOS
+
+    def tokenize(self, text, add_bos=True, special=False):
+        """Palabras y signos (con su espacio inicial) a ids estables"""
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")
+        tokens = [FAKE_BOS] if add_bos else []
+        for piece in _TOKEN_PATTERN.findall(text):
+            token_id = 3 + zlib.crc32(piece.encode("utf-8")) % (FAKE_VOCAB_SIZE - 3)
+            self._pieces[token_id] = piece
+            tokens.append(token_id)
+        return tokens
+
+    def detokenize(self, tokens):
+        return "".join(self._pieces.get(t, "") for t in tokens).encode("utf-8")
+
+    @property
+    def input_ids(self):
+        """Tokens en la caché KV simulada"""
+        return list(self._last_tokens)
+
+    @property
+    def n_tokens(self):
+        return len(self._last_tokens)
+
+    @n_tokens.setter
+    def n_tokens(self, value):
+        self._last_tokens = self._last_tokens[:value]
+
+    def eval(self, tokens):
+        """Evalúa tokens a continuación de los que ya hay (precarga)"""
+        self._sleep(len(tokens) / self.prompt_tokens_per_second)
+        with self._lock:
+            self._last_tokens.extend(tokens)
+            self.prompt_tokens_evaluated += len(tokens)
+
+    def set_cache(self, cache):
+        pass
+
+    def close(self):
+        self._last_tokens = []
+
+    def __call__(self, prompt, max_tokens=16, temperature=0.8, stop=None, echo=False, stream=False, **kwargs):
+        tokens = list(prompt) if isinstance(prompt, (list, tuple)) else self.tokenize(prompt)
+        if stream:
+            return self._stream(tokens, max_tokens, stop)
+
+        text, finish_reason, completion = "", None, 0
+        for chunk in self._stream(tokens, max_tokens, stop):
+            text += chunk["choices"][0]["text"]
+            finish_reason = chunk["choices"][0]["finish_reason"] or finish_reason
+            completion += 1
+        return {
+            "object": "text_completion",
+            "model": "fake",
+            "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": len(tokens),
+                "completion_tokens": completion - 1,
+                "total_tokens": len(tokens) + completion - 1
+            }
+        }
+
+    # --- Simulación ---
+
+    def _sleep(self, seconds):
+        if self.jitter:
+            seconds *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _chunk(self, text, finish_reason=None):
+        return {
+            "object": "text_completion",
+            "model": "fake",
+            "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}]
+        }
+
+    def _stream(self, tokens, max_tokens, stop):
+        with self._lock:
+            reused = 0
+            for old, new in zip(self._last_tokens, tokens):
+                if old != new:
+                    break
+                reused += 1
+            self._last_tokens = list(tokens)
+            self.calls += 1
+            self.prompt_tokens += len(tokens)
+            self.prompt_tokens_evaluated += len(tokens) - reused
+
+        self._sleep(self.first_token_ms / 1000 + (len(tokens) - reused) / self.prompt_tokens_per_second)
+
+        # Misma respuesta para el mismo prompt
+        rng = random.Random(zlib.crc32(repr(tokens).encode("ascii")))
+        limit = self.response_tokens if max_tokens is None or max_tokens <= 0 else min(max_tokens, self.response_tokens)
+        stops = [stop] if isinstance(stop, str) else list(stop or [])
+
+        text = ""
+        finish_reason = "stop"
+        try:
+            for i in range(limit):
+                if i:
+                    self._sleep(1 / self.tokens_per_second)
+                piece = rng.choice(_FAKE_WORDS)
+                piece = (" " + piece) if i else piece.capitalize()
+                if i == limit - 1 or rng.random() < 0.08:
+                    piece += "."
+
+                hit = next((s for s in stops if s and s in text + piece), None)
+                if hit:
+                    # Como Llama: el texto de parada no se emite
+                    tail = (text + piece).index(hit) - len(text)
+                    if tail > 0:
+                        yield self._chunk(piece[:tail])
+                    break
+
+                text += piece
+                with self._lock:
+                    self.completion_tokens += 1
+                yield self._chunk(piece)
+            else:
+                if max_tokens and limit == max_tokens:
+                    finish_reason = "length"
+            yield self._chunk("", finish_reason)
+        finally:
+            # La caché KV también guarda lo generado (aunque se corte el streaming):
+            # una continuación lo reutiliza
+            with self._lock:
+                self._last_tokens = list(tokens) + self.tokenize(text, add_bos=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'prompt_tokens': self.prompt_tokens,
+                'prompt_tokens_evaluated': self.prompt_tokens_evaluated,
+                'completion_tokens': self.completion_tokens
+            }
+
+
+class LlamaCppBackend:
+    """Modelos GGUF reales: descarga verificada y registro compartido con presupuesto de RAM"""
+    name = "llama_cpp"
+    supports_parallel = True  # Motor por lotes y pool de procesos
+
+    def is_downloaded(self, model_type):
+        return os.path.exists(model_path_for(model_type))
+
+    def prepare(self, model_type, progress_callback=None):
+        """Descarga el modelo si falta"""
+        from ollama_client import download_model
+        if self.is_downloaded(model_type):
+            return True
+        config = MODELS_CONFIG[model_type]
+        return download_model(config["url"], model_path_for(model_type), progress_callback, config.get("sha256"))
+
+    def load(self, model_type, draft_tokens=None):
+        """Modelo ya marcado en uso: quien lo carga lo suelta con unpin antes de liberarlo"""
+        from ollama_client import get_model
+        return get_model(model_path_for(model_type), draft_tokens, pin=True)
+
+    def acquire(self, model):
+        from ollama_client import get_registry
+        return get_registry().acquire(model)
+
+    def unpin(self, model):
+        from ollama_client import get_registry
+        get_registry().unpin(model)
+
+    def release(self, model_type, draft_tokens=None, reason="liberación explícita"):
+        from ollama_client import get_registry
+        return get_registry().release(model_path_for(model_type), draft_tokens, reason=reason)
+
+    def preload(self, model_type, draft_tokens=None):
+        from ollama_client import get_registry
+        return get_registry().preload(model_path_for(model_type), draft_tokens)
+
+    def fingerprint(self, model_type):
+        from response_cache import model_fingerprint
+        return model_fingerprint(model_path_for(model_type))
+
+    def context_plan(self, model_type):
+        """n_ctx y tipos de caché KV con los que se carga el modelo (ver plan_context)"""
+        from ollama_client import plan_context
+        return plan_context(model_path_for(model_type))
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+
+class FakeBackend:
+    """Backend sin archivo de modelo: un FakeLlama por tipo de modelo"""
+    name = "fake"
+    supports_parallel = False
+
+    def __init__(self, **profile):
+        self.profile = profile
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def is_downloaded(self, model_type):
+        return True
+
+    def prepare(self, model_type, progress_callback=None):
+        return True
+
+    def load(self, model_type, draft_tokens=None):
+        with self._lock:
+            if model_type not in self._models:
+                self._models[model_type] = FakeLlama(**self.profile)
+            return self._models[model_type]
+
+    def acquire(self, model):
+        return True
+
+    def unpin(self, model):
+        pass
+
+    def release(self, model_type, draft_tokens=None, reason="liberación explícita"):
+        with self._lock:
+            model = self._models.pop(model_type, None)
+        if model:
+            model.close()
+        return model is not None
+
+    def preload(self, model_type, draft_tokens=None):
+        return False
+
+    def fingerprint(self, model_type):
+        material = repr((model_type, sorted(self.profile.items())))
+        return "fake-" + hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def context_plan(self, model_type):
+        return None
+
+    def get_stats(self):
+        with self._lock:
+            models = list(self._models.values())
+        totals = {'backend': self.name, 'calls': 0, 'prompt_tokens': 0,
+                  'prompt_tokens_evaluated': 0, 'completion_tokens': 0}
+        for model in models:
+            for key, value in model.get_stats().items():
+                totals[key] += value
+        return totals
+
+
+BACKENDS = {
+    LlamaCppBackend.name: LlamaCppBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+
+def create_backend(name=LLM_BACKEND, profile=None):
+    """Instancia el backend por nombre (llama_cpp si el nombre no existe)"""
+    if name not in BACKENDS:
+        print(f"[WARNING] Backend de modelo desconocido '{name}', se usa {LLM_BACKEND}")
+        name = LLM_BACKEND
+    if name == FakeBackend.name:
+        print("[INFO] Backend falso activo: respuestas simuladas, sin modelo real")
+        return FakeBackend(**(profile or {}))
+    return BACKENDS[name]()
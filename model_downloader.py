@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Descargador de Modelos
+Descarga reanudable (HTTP Range), por varias conexiones en paralelo
+y verificada con SHA256 antes de mover el archivo a su sitio
+"""
+
+import os
+import re
+import sys
+import json
+import ssl
+import hashlib
+import threading
+import urllib.request
+import urllib.error
+import urllib.parse
+from config import DOWNLOAD_CONNECTIONS, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_RETRIES
+
+# certifi es opcional: sin él se usan los certificados del sistema
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class DownloadError(Exception):
+    """Error irrecuperable durante la descarga"""
+
+
+def verified_ssl_context():
+    """Contexto TLS que verifica certificado y nombre del servidor (el hash publicado depende de ello)"""
+    if certifi is not None:
+        return ssl.create_default_context(cafile=certifi.where())
+    return ssl.create_default_context()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Permite leer las cabeceras de la respuesta de redirección (p. ej. X-Linked-Etag de HuggingFace)"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class ModelDownloader:
+    """
+    Descarga un archivo grande a '<destino>.part'.
+    El progreso de cada segmento se guarda en '<destino>.part.json', de modo
+    que una descarga interrumpida continúa donde se quedó.
+    """
+
+    def __init__(self, url, dest_path, sha256=None, connections=DOWNLOAD_CONNECTIONS,
+                 progress_callback=None, ssl_context=None, timeout=30):
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = dest_path + ".part"
+        self.state_path = dest_path + ".part.json"
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.connections = max(1, int(connections))
+        self.progress_callback = progress_callback
+        self.ssl_context = ssl_context or verified_ssl_context()
+        self.timeout = timeout
+
+        self.total_size = 0
+        self.downloaded = 0
+        self.segments = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._errors = []
+
+    def cancel(self):
+        """Interrumpe la descarga (el archivo .part se conserva para reanudar)"""
+        self._cancel.set()
+
+    # --- Peticiones HTTP ---
+
+    def _open(self, request, follow_redirects=True):
+        handlers = [urllib.request.HTTPSHandler(context=self.ssl_context)]
+        if not follow_redirects:
+            handlers.append(_NoRedirect())
+        opener = urllib.request.build_opener(*handlers)
+        return opener.open(request, timeout=self.timeout)
+
+    def _probe(self):
+        """Obtiene tamaño, soporte de rangos y hash publicado por el servidor"""
+        url = self.url
+        linked_etag = None
+
+        # HuggingFace publica el SHA256 de los archivos LFS en la redirección
+        try:
+            response = self._open(urllib.request.Request(url, method="HEAD"), follow_redirects=False)
+            headers = response.headers
+            response.close()
+        except urllib.error.HTTPError as e:
+            if e.code not in (301, 302, 303, 307, 308):
+                raise
+            headers = e.headers
+            location = headers.get("Location")
+            if location:
+                url = urllib.parse.urljoin(url, location)
+        linked_etag = headers.get("X-Linked-Etag") or headers.get("ETag")
+
+        response = self._open(urllib.request.Request(url, method="HEAD"))
+        size = int(response.headers.get("Content-Length") or 0)
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        response.close()
+
+        server_sha256 = None
+        if linked_etag:
+            candidate = linked_etag.removeprefix('W/').strip('"').lower()
+            if _SHA256_RE.match(candidate):
+                server_sha256 = candidate
+
+        return url, size, accepts_ranges, server_sha256
+
+    # --- Estado persistente ---
+
+    def _plan_segments(self, size, connections):
+        """Divide el archivo en rangos [inicio, fin] de tamaño similar"""
+        if size <= 0:
+            return [{"start": 0, "end": None, "done": 0}]
+        step = -(-size // connections)
+        return [
+            {"start": start, "end": min(start + step, size) - 1, "done": 0}
+            for start in range(0, size, step)
+        ]
+
+    def _load_state(self, size):
+        """Recupera los segmentos de una descarga anterior si corresponde al mismo archivo"""
+        if not (os.path.exists(self.part_path) and os.path.exists(self.state_path)):
+            return None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("url") == self.url and state.get("size") == size and size > 0:
+                return state["segments"]
+        except Exception as e:
+            print(f"[WARNING] Estado de descarga ilegible, se empieza de cero: {e}")
+        return None
+
+    def _save_state(self):
+        """Guarda el progreso (llamar con self._lock adquirido)"""
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "size": self.total_size, "segments": self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _clear_state(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # --- Descarga ---
+
+    def _report_progress(self):
+        if self.total_size > 0:
+            percent = (self.downloaded / self.total_size) * 100
+        else:
+            percent = 0
+        mb_downloaded = self.downloaded / (1024 * 1024)
+        mb_total = self.total_size / (1024 * 1024)
+
+        if self.progress_callback:
+            self.progress_callback(percent, mb_downloaded, mb_total)
+        else:
+            sys.stdout.write(f"\r   Progreso: {percent:.1f}% ({mb_downloaded:.1f}/{mb_total:.1f} MB)")
+            sys.stdout.flush()
+
+    def _fetch_segment(self, url, segment, use_range):
+        """Descarga lo que falta de un segmento, reintentando desde el último byte escrito"""
+        attempts = 0
+        while not self._cancel.is_set():
+            if not use_range and segment["done"]:
+                # Sin rangos no se puede continuar a mitad: se vuelve a empezar
+                with self._lock:
+                    self.downloaded -= segment["done"]
+                    segment["done"] = 0
+            offset = segment["start"] + segment["done"]
+            if segment["end"] is not None and offset > segment["end"]:
+                return
+
+            request = urllib.request.Request(url)
+            if use_range:
+                end = "" if segment["end"] is None else segment["end"]
+                request.add_header("Range", f"bytes={offset}-{end}")
+
+            try:
+                response = self._open(request)
+                if use_range and response.status != 206:
+                    raise DownloadError(f"El servidor ignoró el rango (HTTP {response.status})")
+
+                with response, open(self.part_path, "r+b") as f:
+                    f.seek(offset)
+                    while not self._cancel.is_set():
+                        chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        f.flush()
+                        with self._lock:
+                            segment["done"] += len(chunk)
+                            self.downloaded += len(chunk)
+                            self._save_state()
+                        self._report_progress()
+
+                if self._cancel.is_set():
+                    return
+                if segment["end"] is None or segment["start"] + segment["done"] > segment["end"]:
+                    return
+                raise DownloadError("Conexión cerrada antes de completar el rango")
+            except DownloadError:
+                raise
+            except Exception as e:
+                attempts += 1
+                if attempts > DOWNLOAD_RETRIES:
+                    raise
+                print(f"\n   [WARNING] Reintentando rango desde {segment['start'] + segment['done']}: {e}")
+
+    def _segment_worker(self, url, segment, use_range):
+        try:
+            self._fetch_segment(url, segment, use_range)
+        except Exception as e:
+            self._errors.append(e)
+            self._cancel.set()
+
+    def _verify(self, expected):
+        """Calcula el SHA256 del archivo .part y lo compara con el esperado"""
+        print("\n   Verificando integridad (SHA256)...")
+        digest = hashlib.sha256()
+        with open(self.part_path, "rb") as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                digest.update(block)
+        actual = digest.hexdigest()
+        if actual != expected:
+            print(f"   ❌ SHA256 no coincide: esperado {expected}, obtenido {actual}")
+            return False
+        print("   ✅ SHA256 verificado")
+        return True
+
+    def download(self):
+        """Descarga, verifica y mueve el archivo a su destino. Devuelve True si termina bien"""
+        if os.path.exists(self.dest_path):
+            return True
+
+        os.makedirs(os.path.dirname(self.dest_path) or ".", exist_ok=True)
+
+        url, size, accepts_ranges, server_sha256 = self._probe()
+        self.total_size = size
+        use_range = accepts_ranges and size > 0
+
+        segments = self._load_state(size) if use_range else None
+        if segments:
+            print(f"   Reanudando descarga previa ({os.path.basename(self.part_path)})")
+        else:
+            connections = self.connections if use_range else 1
+            segments = self._plan_segments(size, connections)
+            with open(self.part_path, "wb") as f:
+                if size > 0:
+                    f.truncate(size)
+
+        self.segments = segments
+        self.downloaded = sum(s["done"] for s in segments)
+        with self._lock:
+            self._save_state()
+
+        workers = []
+        for segment in segments:
+            thread = threading.Thread(target=self._segment_worker, args=(url, segment, use_range))
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+        for thread in workers:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if self._cancel.is_set():
+            print("\n   Descarga interrumpida (se reanudará en el próximo intento)")
+            return False
+
+        expected = self.expected_sha256 or server_sha256
+        if expected:
+            if not self._verify(expected):
+                self._clear_state()
+                return False
+        else:
+            print("\n   [WARNING] No hay SHA256 de referencia, se omite la verificación")
+
+        os.replace(self.part_path, self.dest_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        return True
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de Procesos de Modelo
+Varios procesos trabajadores, cada uno con su propio Llama sobre el mismo GGUF
+(mmap: las páginas de los pesos se comparten entre procesos). Las peticiones
+se reparten por una cola común y los tokens vuelven por una tubería por proceso.
+"""
+
+import os
+import itertools
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+from config import POOL_THREADS_PER_WORKER
+
+
+def _worker_main(worker_id, model_path, draft_tokens, n_threads, requests, conn):
+    """Bucle del proceso trabajador: toma peticiones de la cola común y emite sus tokens"""
+    try:
+        from ollama_client import _load_llama
+        llm = _load_llama(model_path, draft_tokens, n_threads=n_threads)
+    except Exception as e:
+        conn.send(("failed", None, str(e)))
+        return
+    conn.send(("ready", None, worker_id))
+
+    cancelled = set()
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        request_id, prompt, options = job
+        conn.send(("start", request_id, worker_id))
+
+        try:
+            for output in llm(prompt, echo=False, stream=True, **options):
+                # Cancelaciones llegadas desde el proceso principal
+                while conn.poll():
+                    message, target = conn.recv()
+                    if message == "cancel":
+                        cancelled.add(target)
+                if request_id in cancelled:
+                    break
+                conn.send(("token", request_id, output['choices'][0]['text']))
+            conn.send(("done", request_id, None))
+        except Exception as e:
+            conn.send(("error", request_id, str(e)))
+        cancelled.discard(request_id)
+
+
+class _PoolRequest:
+    """Petición en curso vista desde el proceso principal"""
+
+    def __init__(self, callback, cancel_token):
+        self.callback = callback
+        self.cancel_token = cancel_token
+        self.worker_id = None
+        self.cancel_sent = False
+        self.text = ""
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelWorkerPool:
+    """
+    Alternativa al modo por lotes para servidores con muchos núcleos:
+    N procesos de POOL_THREADS_PER_WORKER hilos generan en paralelo de verdad.
+    Misma interfaz que BatchedInferenceEngine (generate, close, get_stats).
+    """
+
+    def __init__(self, model_path, workers, draft_tokens=None, n_threads=POOL_THREADS_PER_WORKER):
+        # spawn: los procesos no heredan el estado de Tk ni los hilos del proceso principal
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._processes = []
+        self._conns = {}
+        self._send_locks = {}
+        for worker_id in range(workers):
+            parent_conn, child_conn = context.Pipe(duplex=True)
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_id, model_path, draft_tokens, n_threads, self._requests, child_conn)
+            )
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns[worker_id] = parent_conn
+            self._send_locks[worker_id] = threading.Lock()
+
+        # Esperar a que todos carguen el modelo
+        for worker_id, conn in self._conns.items():
+            message, _, payload = conn.recv()
+            if message != "ready":
+                self.close()
+                raise RuntimeError(f"El proceso {worker_id} no pudo cargar el modelo: {payload}")
+        print(f"[INFO] Pool de modelos listo: {workers} procesos x {n_threads} hilos")
+
+        self._reader = threading.Thread(target=self._read_loop)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def generate(self, prompt, temperature, max_tokens=None, stop=None, callback=None, cancel_token=None):
+        """Genera en el primer proceso libre (bloqueante, varios hilos pueden llamarlo a la vez)"""
+        request = _PoolRequest(callback, cancel_token)
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = request
+
+        options = {"temperature": temperature, "max_tokens": max_tokens, "stop": stop}
+        self._requests.put((request_id, prompt, options))
+
+        while not request.done.wait(0.05):
+            if cancel_token and cancel_token.should_stop():
+                self._send_cancel(request_id, request)
+
+        if request.error:
+            raise RuntimeError(request.error)
+        return request.text
+
+    def _send_cancel(self, request_id, request):
+        with self._lock:
+            # Aún en la cola: se cancelará en cuanto un proceso la tome (ver _read_loop)
+            if request.cancel_sent or request.worker_id is None:
+                return
+            request.cancel_sent = True
+            worker_id = request.worker_id
+        with self._send_locks[worker_id]:
+            self._conns[worker_id].send(("cancel", request_id))
+
+    def _read_loop(self):
+        """Recibe los mensajes de todos los procesos y los entrega a cada petición"""
+        conns = {conn: worker_id for worker_id, conn in self._conns.items()}
+        while conns and not self._closed:
+            for conn in wait(list(conns), timeout=0.5):
+                try:
+                    message, request_id, payload = conn.recv()
+                except (EOFError, OSError):
+                    worker_id = conns.pop(conn)
+                    if not self._closed:
+                        print(f"[ERROR] El proceso de modelo {worker_id} terminó inesperadamente")
+                        self._fail_worker(worker_id)
+                    continue
+
+                with self._lock:
+                    request = self._pending.get(request_id)
+                if request is None:
+                    continue
+
+                if message == "start":
+                    with self._lock:
+                        request.worker_id = payload
+                    if request.cancel_token and request.cancel_token.should_stop():
+                        self._send_cancel(request_id, request)
+                elif message == "token":
+                    # Lo que llegue tras pedir la cancelación ya no se entrega
+                    if request.cancel_sent:
+                        continue
+                    request.text += payload
+                    if request.cancel_token:
+                        request.cancel_token.tokens_generated += 1
+                    if request.callback:
+                        try:
+                            request.callback(payload)
+                        except Exception as e:
+                            print(f"[ERROR] Callback de streaming: {e}")
+                    if request.cancel_token and request.cancel_token.should_stop():
+                        self._send_cancel(request_id, request)
+                else:
+                    if message == "error":
+                        request.error = payload
+                    with self._lock:
+                        self._pending.pop(request_id, None)
+                    request.done.set()
+
+    def _fail_worker(self, worker_id):
+        with self._lock:
+            failed = [(rid, r) for rid, r in self._pending.items() if r.worker_id == worker_id]
+            for request_id, _ in failed:
+                self._pending.pop(request_id)
+        for _, request in failed:
+            request.error = "El proceso de modelo terminó inesperadamente"
+            request.done.set()
+
+    def close(self):
+        """Detiene los procesos trabajadores"""
+        self._closed = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for request in pending:
+            request.error = "Pool de modelos cerrado"
+            request.done.set()
+
+    def get_stats(self):
+        with self._lock:
+            running = sum(1 for r in self._pending.values() if r.worker_id is not None)
+            queued = len(self._pending) - running
+        return {
+            'active': running,
+            'queued': queued,
+            'parallel': len(self._processes)
+        }
+
+
+def default_worker_count():
+    """Procesos que caben en los núcleos disponibles con POOL_THREADS_PER_WORKER hilos cada uno"""
+    return max(1, (os.cpu_count() or POOL_THREADS_PER_WORKER) // POOL_THREADS_PER_WORKER)
@@ -6,14 +6,30 @@ Ejecuta Gemma 2 2B directamente sin servidor
 
 import os
 import sys
-import ssl
+import time
 import threading
-from config import MODELS_DIR, MAX_TOKENS, CONTEXT_LENGTH, TEMPERATURE, MODELS_CONFIG, DEFAULT_MODEL_TYPE
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import (
+    MODELS_DIR, MAX_TOKENS, CONTEXT_LENGTH, TEMPERATURE, MODELS_CONFIG, DEFAULT_MODEL_TYPE,
+    SPECULATIVE_DECODING, SPECULATIVE_DRAFT_TOKENS,
+    MODEL_RAM_FRACTION, MODEL_RAM_FALLBACK_MB, MODEL_RAM_OVERHEAD_MB, MODEL_COMPUTE_BUFFER_MB,
+    KV_CACHE_BUDGET_MB, KV_CACHE_TYPE_K, KV_CACHE_TYPE_V, FLASH_ATTENTION, MIN_CONTEXT_LENGTH,
+    GENERATION_DEADLINE_SECONDS, GENERATION_TOKEN_BUDGET, INFERENCE_MODE, BATCH_PARALLEL,
+    POOL_WORKERS, MODEL_IDLE_UNLOAD_SECONDS, MODEL_IDLE_CHECK_SECONDS,
+    PROMPT_CACHE_DIR, PROMPT_CACHE_MB, PROMPT_DISK_CACHE,
+    RESPONSE_CACHE, RESPONSE_CACHE_MAX_TEMPERATURE, LLM_BACKEND, ROLLING_SUMMARY_MAX_WORDS,
+    PREFILL_CHUNK_TOKENS, PREFILL_RAG_RESERVE_CHARS
+)
 from settings_manager import SettingsManager
-
-# Variable global para el modelo
-_model = None
-_model_lock = threading.Lock()
+from model_downloader import ModelDownloader
+from generation_control import CancellationToken, PREEMPTED_REASON
+from prompt_builder import PromptBuilder, BuiltPrompt
+from response_cache import ResponseCache
+from llm_backends import create_backend
+from gguf_metadata import (
+    KV_CACHE_TYPES, read_gguf_metadata, model_shape, kv_bytes_per_token, choose_context_length
+)
 
 # Fix para SSL en macOS
 try:
@@ -22,14 +38,9 @@ try:
 except ImportError:
     pass
 
-# Crear contexto SSL sin verificación (fallback para macOS)
-ssl_context = ssl.create_default_context()
-ssl_context.check_hostname = False
-ssl_context.verify_mode = ssl.CERT_NONE
-
 
-def download_model(model_url, model_path, progress_callback=None):
-    """Descarga el modelo si no existe"""
+def download_model(model_url, model_path, progress_callback=None, sha256=None):
+    """Descarga el modelo si no existe (reanudable y verificado con SHA256)"""
     if os.path.exists(model_path):
         return True
     
@@ -42,109 +53,385 @@ def download_model(model_url, model_path, progress_callback=None):
     
     os.makedirs(MODELS_DIR, exist_ok=True)
     
-    # Intentar con requests primero (mejor manejo de SSL)
     try:
-        import requests
-        print("   Usando requests para descarga...")
-        
-        response = requests.get(model_url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
-        chunk_size = 8192
-        
-        with open(model_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    
-                    if total_size > 0:
-                        percent = (downloaded / total_size) * 100
-                        mb_downloaded = downloaded / (1024 * 1024)
-                        mb_total = total_size / (1024 * 1024)
-                        
-                        if progress_callback:
-                            progress_callback(percent, mb_downloaded, mb_total)
-                        else:
-                            sys.stdout.write(f"\r   Progreso: {percent:.1f}% ({mb_downloaded:.1f}/{mb_total:.1f} MB)")
-                            sys.stdout.flush()
-        
-        print("\n✅ Modelo descargado correctamente")
-        return True
-        
+        downloader = ModelDownloader(
+            model_url,
+            model_path,
+            sha256=sha256,
+            progress_callback=progress_callback
+        )
+        if downloader.download():
+            print("\n✅ Modelo descargado correctamente")
+            return True
+        print("\n❌ La descarga no se completó")
+    except Exception as e:
+        print(f"\n❌ Error descargando modelo: {e}")
+    
+    print("\n💡 Solución alternativa:")
+    print(f"   Descarga manualmente el modelo desde:")
+    print(f"   {model_url}")
+    print(f"   Y colócalo en: {model_path}")
+    return False
+
+
+def _create_draft_model(draft_tokens):
+    """Crea el modelo de borrador por prompt lookup (None si la versión de llama-cpp no lo soporta)"""
+    try:
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+        return LlamaPromptLookupDecoding(num_pred_tokens=draft_tokens)
     except ImportError:
-        print("   requests no disponible, usando urllib...")
+        print("[WARNING] Esta versión de llama-cpp-python no soporta LlamaPromptLookupDecoding. "
+              "Se continúa sin decodificación especulativa.")
+        return None
+
+
+def _attach_prompt_cache(model, model_path):
+    """Caché en disco del estado KV por prompt: tras recargar, los prompts ya vistos no se reevalúan"""
+    try:
+        from llama_cpp import LlamaDiskCache
+        cache_dir = os.path.join(PROMPT_CACHE_DIR, os.path.splitext(os.path.basename(model_path))[0])
+        model.set_cache(LlamaDiskCache(cache_dir=cache_dir, capacity_bytes=PROMPT_CACHE_MB * 1024 * 1024))
     except Exception as e:
-        print(f"   Error con requests: {e}")
-        print("   Intentando con urllib...")
-        if os.path.exists(model_path):
-            os.remove(model_path)
+        # LlamaDiskCache necesita el paquete 'diskcache'
+        print(f"[WARNING] Caché de prompts en disco no disponible: {e}")
+
+
+def plan_context(model_path):
+    """
+    n_ctx y tipos de la caché KV con los que se carga un modelo.
+    Con los metadatos del GGUF se elige el mayor contexto cuya caché KV cabe en
+    kv_cache_budget_mb (sin pasar del contexto de entrenamiento); context_length
+    en settings.json lo fija a mano. Sin metadatos se usa CONTEXT_LENGTH.
+    """
+    settings = SettingsManager()
+    types = []
+    for key, default in (("kv_cache_type_k", KV_CACHE_TYPE_K), ("kv_cache_type_v", KV_CACHE_TYPE_V)):
+        name = str(settings.get(key, default)).lower()
+        if name not in KV_CACHE_TYPES:
+            print(f"[WARNING] Tipo de caché KV desconocido '{name}' ({key}), se usa f16")
+            name = "f16"
+        types.append(name)
+    type_k, type_v = types
+    flash_attn = bool(settings.get("flash_attn", FLASH_ATTENTION))
+    if type_v not in ("f16", "f32") and not flash_attn:
+        # llama.cpp solo cuantiza V con flash attention (se indica al cargar el modelo)
+        flash_attn = True
+
+    shape = None
+    try:
+        shape = model_shape(read_gguf_metadata(model_path))
+    except Exception as e:
+        print(f"[WARNING] No se pudieron leer los metadatos GGUF de {os.path.basename(model_path)}: {e}")
+
+    requested = settings.get("context_length")
+    if requested:
+        n_ctx = int(requested)
+        trained = shape.get("context_length") if shape else None
+        if trained and n_ctx > trained:
+            print(f"[WARNING] context_length {n_ctx} supera el contexto de entrenamiento ({trained}), se limita")
+            n_ctx = trained
+    elif shape:
+        budget_mb = settings.get("kv_cache_budget_mb") or KV_CACHE_BUDGET_MB
+        n_ctx = choose_context_length(shape, budget_mb, type_k, type_v, minimum=MIN_CONTEXT_LENGTH)
+    else:
+        n_ctx = CONTEXT_LENGTH
+
+    return {
+        "n_ctx": n_ctx,
+        "type_k": type_k,
+        "type_v": type_v,
+        "flash_attn": flash_attn,
+        # None si no hay metadatos (el registro usa entonces MODEL_RAM_OVERHEAD_MB)
+        "kv_bytes": kv_bytes_per_token(shape, type_k, type_v) * n_ctx if shape else None,
+        "trained_context": shape.get("context_length") if shape else None
+    }
+
+
+def _kv_cache_kwargs(plan):
+    """Argumentos de Llama para la caché KV (solo los que difieren del valor por defecto)"""
+    kwargs = {}
+    if plan["type_k"] != "f16":
+        kwargs["type_k"] = KV_CACHE_TYPES[plan["type_k"]][0]
+    if plan["type_v"] != "f16":
+        kwargs["type_v"] = KV_CACHE_TYPES[plan["type_v"]][0]
+    if plan["flash_attn"]:
+        kwargs["flash_attn"] = True
+    return kwargs
+
+
+def _load_llama(model_path, draft_tokens=None, n_threads=4):
+    """Carga un modelo GGUF con llama-cpp"""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"Modelo no encontrado en {model_path}."
+        )
     
-    # Fallback a urllib con SSL deshabilitado
     try:
-        import urllib.request
-        
-        def report_progress(block_num, block_size, total_size):
-            downloaded = block_num * block_size
-            percent = min(100, (downloaded / total_size) * 100) if total_size > 0 else 0
-            mb_downloaded = downloaded / (1024 * 1024)
-            mb_total = total_size / (1024 * 1024)
-            
-            if progress_callback:
-                progress_callback(percent, mb_downloaded, mb_total)
+        from llama_cpp import Llama
+    except ImportError:
+        raise ImportError(
+            "llama-cpp-python no está instalado."
+        )
+    
+    plan = plan_context(model_path)
+    model_kwargs = _kv_cache_kwargs(plan)
+    draft_model = _create_draft_model(draft_tokens) if draft_tokens else None
+    if draft_model:
+        model_kwargs["draft_model"] = draft_model
+    
+    print(f"🔄 Cargando modelo desde {os.path.basename(model_path)}...")
+    if draft_model:
+        print(f"   Decodificación especulativa activa ({draft_tokens} tokens de borrador)")
+    kv_info = f", caché KV {plan['kv_bytes'] / (1024 * 1024):.0f} MB" if plan["kv_bytes"] else ""
+    print(f"   Contexto: {plan['n_ctx']} tokens (K {plan['type_k']}, V {plan['type_v']}"
+          f"{', flash attention' if plan['flash_attn'] else ''}{kv_info})")
+    model = Llama(
+        model_path=model_path,
+        n_ctx=plan["n_ctx"],
+        n_threads=n_threads,
+        use_mmap=True,  # Los pesos se leen bajo demanda: recargar tras liberar es rápido
+        verbose=False,
+        **model_kwargs
+    )
+    if SettingsManager().get("prompt_disk_cache", PROMPT_DISK_CACHE):
+        _attach_prompt_cache(model, model_path)
+    print("✅ Modelo cargado correctamente")
+    return model
+
+
+def _prefill_tokens(model, tokens, cancel_token=None):
+    """
+    Evalúa tokens en la caché KV conservando el prefijo que ya coincida
+    (lo mismo que hace Llama.generate antes de generar). Devuelve cuántos se evaluaron.
+    """
+    common = 0
+    for old, new in zip(model.input_ids[:model.n_tokens], tokens):
+        if old != new:
+            break
+        common += 1
+    model.n_tokens = common
+    
+    evaluated = 0
+    for start in range(common, len(tokens), PREFILL_CHUNK_TOKENS):
+        # Entre pasos: una petición del usuario cancela la precarga
+        if cancel_token and cancel_token.should_stop():
+            break
+        chunk = tokens[start:start + PREFILL_CHUNK_TOKENS]
+        model.eval(chunk)
+        evaluated += len(chunk)
+    return evaluated
+
+
+def _detect_total_ram():
+    """RAM física total en bytes (None si no se puede averiguar)"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ModelRegistry:
+    """
+    Modelos residentes en memoria con un presupuesto de RAM.
+    Al cargar uno nuevo que no cabe, se expulsan (y cierran) los menos usados recientemente,
+    salvo los que están en uso (ver acquire/unpin): esos no se cierran nunca.
+    Clave: (ruta, tokens de borrador o None si no hay decodificación especulativa)
+    """
+    
+    def __init__(self, budget_mb=None):
+        self._models = OrderedDict()
+        self._loading = {}  # Cargas en curso: clave -> (evento, bytes estimados)
+        self._lock = threading.Lock()
+        self.set_budget(budget_mb)
+    
+    def set_budget(self, budget_mb=None):
+        """Fija el presupuesto en MB (None = fracción de la RAM física)"""
+        if budget_mb:
+            self.budget_bytes = int(budget_mb) * 1024 * 1024
+        else:
+            total_ram = _detect_total_ram()
+            if total_ram:
+                self.budget_bytes = int(total_ram * MODEL_RAM_FRACTION)
             else:
-                sys.stdout.write(f"\r   Progreso: {percent:.1f}% ({mb_downloaded:.1f}/{mb_total:.1f} MB)")
-                sys.stdout.flush()
+                self.budget_bytes = MODEL_RAM_FALLBACK_MB * 1024 * 1024
+    
+    @staticmethod
+    def estimate_size(model_path):
+        """Memoria aproximada de un modelo cargado: pesos + caché KV y búferes"""
+        kv_bytes = plan_context(model_path)["kv_bytes"]
+        if kv_bytes is None:
+            return os.path.getsize(model_path) + MODEL_RAM_OVERHEAD_MB * 1024 * 1024
+        return os.path.getsize(model_path) + kv_bytes + MODEL_COMPUTE_BUFFER_MB * 1024 * 1024
+    
+    def used_bytes(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._models.values())
+    
+    def _reserved_bytes(self):
+        """Modelos residentes más los que se están cargando (llamar con self._lock adquirido)"""
+        loading = sum(size for _, size in self._loading.values() if size)
+        return sum(entry["size"] for entry in self._models.values()) + loading
+    
+    def fits(self, size):
+        """Indica si cabe un modelo de 'size' bytes sin expulsar a nadie (cuenta las cargas en curso)"""
+        with self._lock:
+            return self._reserved_bytes() + size <= self.budget_bytes
+    
+    def is_loaded(self, model_path, draft_tokens=None):
+        with self._lock:
+            return (model_path, draft_tokens) in self._models
+    
+    def _find(self, model):
+        """Entrada del modelo cargado (llamar con self._lock adquirido)"""
+        for entry in self._models.values():
+            if entry["model"] is model:
+                return entry
+        return None
+    
+    def acquire(self, model):
+        """Marca el modelo como en uso: no se expulsa hasta el unpin correspondiente"""
+        with self._lock:
+            entry = self._find(model)
+            if entry:
+                entry["users"] += 1
+            return entry is not None
+    
+    def unpin(self, model):
+        """Deja de usar el modelo (a partir de 0 usuarios puede expulsarse)"""
+        with self._lock:
+            entry = self._find(model)
+            if entry and entry["users"] > 0:
+                entry["users"] -= 1
+    
+    def _close(self, key, model, reason="presupuesto de RAM"):
+        print(f"♻️ Liberando modelo {os.path.basename(key[0])} ({reason})")
+        try:
+            if hasattr(model, "close"):
+                model.close()
+        except Exception as e:
+            print(f"[WARNING] Error cerrando modelo: {e}")
+    
+    def _make_room(self, size):
+        """
+        Expulsa modelos LRU sin usuarios hasta que quepan 'size' bytes
+        (llamar con self._lock adquirido). Los que están en uso se quedan aunque no quepa.
+        """
+        evicted = []
+        used = self._reserved_bytes()
+        for key, entry in list(self._models.items()):
+            if used + size <= self.budget_bytes:
+                break
+            if entry["users"] > 0:
+                continue
+            del self._models[key]
+            used -= entry["size"]
+            evicted.append((key, entry["model"]))
+        if used + size > self.budget_bytes:
+            print("[WARNING] Modelos en uso ocupan el presupuesto de RAM: se carga por encima")
+        return evicted
+    
+    def get(self, model_path, draft_tokens=None, pin=False, evict=True):
+        """
+        Obtiene o carga el modelo, marcándolo como el más reciente.
+        pin: lo devuelve ya marcado en uso (ver acquire), sin hueco en el que pueda expulsarse.
+        evict=False: si no cabe sin expulsar a otros, no lo carga y devuelve None.
+        """
+        key = (model_path, draft_tokens)
         
-        # Usar contexto SSL sin verificación
-        urllib.request.urlretrieve(model_url, model_path, reporthook=report_progress, context=ssl_context)
-        print("\n✅ Modelo descargado correctamente")
-        return True
-    except Exception as e:
-        print(f"\n❌ Error descargando modelo: {e}")
-        print("\n💡 Solución alternativa:")
-        print(f"   Descarga manualmente el modelo desde:")
-        print(f"   {model_url}")
-        print(f"   Y colócalo en: {model_path}")
-        if os.path.exists(model_path):
-            os.remove(model_path)
-        return False
-
-
-# Diccionario para almacenar modelos cargados
-_loaded_models = {}
-_model_lock = threading.Lock()
-
-def get_model(model_path):
-    """Obtiene o carga el modelo específico"""
-    global _loaded_models
-    
-    with _model_lock:
-        if model_path not in _loaded_models:
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(
-                    f"Modelo no encontrado en {model_path}."
-                )
+        # Si otro hilo (p. ej. la precarga) ya lo está cargando, esperar a que termine
+        while True:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry:
+                    self._models.move_to_end(key)
+                    if pin:
+                        entry["users"] += 1
+                    return entry["model"]
+                loading = self._loading.get(key)
+                if loading is None:
+                    event = threading.Event()
+                    self._loading[key] = (event, None)
+                    break
+            loading[0].wait()
+        
+        try:
+            size = self.estimate_size(model_path)
+            with self._lock:
+                if not evict and self._reserved_bytes() + size > self.budget_bytes:
+                    return None
+                evicted = self._make_room(size)
+                self._loading[key] = (event, size)
+            for old_key, old_model in evicted:
+                self._close(old_key, old_model)
             
+            model = _load_llama(model_path, draft_tokens)
+            with self._lock:
+                self._models[key] = {"model": model, "size": size, "users": 1 if pin else 0}
+            return model
+        finally:
+            with self._lock:
+                self._loading.pop(key)[0].set()
+    
+    def preload(self, model_path, draft_tokens=None):
+        """Carga un modelo en segundo plano solo si cabe sin expulsar a otros"""
+        if self.is_loaded(model_path, draft_tokens) or not os.path.exists(model_path):
+            return False
+        if not self.fits(self.estimate_size(model_path)):
+            print(f"[INFO] Sin RAM para precargar {os.path.basename(model_path)}")
+            return False
+        
+        def preload_thread():
             try:
-                from llama_cpp import Llama
-                
-                print(f"🔄 Cargando modelo desde {os.path.basename(model_path)}...")
-                _loaded_models[model_path] = Llama(
-                    model_path=model_path,
-                    n_ctx=CONTEXT_LENGTH,
-                    n_threads=4,
-                    verbose=False
-                )
-                print("✅ Modelo cargado correctamente")
-            except ImportError:
-                raise ImportError(
-                    "llama-cpp-python no está instalado."
-                )
+                # Otra carga pudo empezar mientras tanto: se vuelve a comprobar sin expulsar a nadie
+                if self.get(model_path, draft_tokens, evict=False) is None:
+                    print(f"[INFO] Precarga de {os.path.basename(model_path)} cancelada: ya no cabe")
+            except Exception as e:
+                print(f"[WARNING] Falló la precarga de {os.path.basename(model_path)}: {e}")
         
-        return _loaded_models[model_path]
+        thread = threading.Thread(target=preload_thread)
+        thread.daemon = True
+        thread.start()
+        return True
+    
+    def release(self, model_path, draft_tokens=None, reason="liberación explícita"):
+        """Libera explícitamente un modelo (si alguien lo sigue usando, se queda hasta que quede libre)"""
+        key = (model_path, draft_tokens)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                return False
+            if entry["users"] > 0:
+                print(f"[INFO] {os.path.basename(model_path)} sigue en uso, no se libera")
+                return False
+            del self._models[key]
+        self._close(key, entry["model"], reason)
+        return True
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'loaded': [os.path.basename(path) for path, _ in self._models],
+                'in_use': [os.path.basename(path) for (path, _), e in self._models.items() if e["users"]],
+                'used_mb': sum(e["size"] for e in self._models.values()) / (1024 * 1024),
+                'budget_mb': self.budget_bytes / (1024 * 1024)
+            }
+
+
+# Registro global de modelos cargados (se crea con el primer uso: importar el módulo no lee los ajustes)
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Registro global de modelos, con el presupuesto de RAM de los ajustes"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(SettingsManager().get("model_ram_budget_mb"))
+        return _registry
+
+def get_model(model_path, draft_tokens=None, pin=False):
+    """Obtiene o carga el modelo específico (pin: marcado en uso, ver ModelRegistry.acquire)"""
+    return get_registry().get(model_path, draft_tokens, pin=pin)
 
 
 class LocalLLMClient:
@@ -156,48 +443,467 @@ class LocalLLMClient:
         self._is_ready = False
         self.temperature = self.settings.get("temperature", TEMPERATURE)
         self.model_type = self.settings.get("model_type", DEFAULT_MODEL_TYPE)
+        self.speculative_decoding = self.settings.get("speculative_decoding", SPECULATIVE_DECODING)
+        self.draft_tokens = int(self.settings.get("draft_tokens", SPECULATIVE_DRAFT_TOKENS))
+        self.prompt_builder = PromptBuilder(self.model_type)
+        # De dónde sale el modelo: GGUF real (llama_cpp) o simulado (fake)
+        self.backend = create_backend(
+            self.settings.get("llm_backend", LLM_BACKEND),
+            self.settings.get("fake_backend_profile")
+        )
+        self.inference_mode = self.settings.get("inference_mode", INFERENCE_MODE)
+        self.batch_parallel = int(self.settings.get("batch_parallel", BATCH_PARALLEL))
+        self.pool_workers = self.settings.get("pool_workers", POOL_WORKERS)
+        # Motor de generación concurrente: BatchedInferenceEngine ("batched")
+        # o ModelWorkerPool ("pool"). None en modo secuencial
+        self.parallel_engine = None
+        self.context_length = CONTEXT_LENGTH  # n_ctx real del modelo cargado
+        
+        # Liberación por inactividad y recarga diferida
+        self.idle_unload_seconds = self.settings.get("model_idle_unload_seconds", MODEL_IDLE_UNLOAD_SECONDS)
+        self.on_model_state = None  # callback(estado): "unloaded", "reloading", "reloaded"
+        self._unloaded = False
+        self._idle_thread = None
+        self.unload_count = 0
+        self.reload_times = []  # Latencias de las últimas recargas (segundos)
+        
+        # Caché de respuestas en disco (opt-in)
+        self.response_cache_enabled = self.settings.get("response_cache", RESPONSE_CACHE)
+        self._response_cache = None
+        
+        # Serializa el acceso al modelo (Llama no es thread-safe) y registra actividad
+        # para que las tareas en segundo plano sepan cuándo está ocioso
+        self._generation_lock = threading.RLock()
+        self._state_lock = threading.Lock()
+        self._pending_generations = 0
+        self.last_activity = time.time()
+        
+        # Generaciones en curso (las de usuario ceden el modelo a las de segundo plano)
+        self._active_tokens = set()
+        # Tiempos y motivo de parada de la última generación de cada hilo (ver get_last_timings)
+        self._timings = threading.local()
+        
+        # Precarga especulativa del siguiente prompt (ver prefill_async)
+        self._prefill_timer = None
+        self.prefill_stats = {'runs': 0, 'tokens': 0, 'cancelled': 0, 'last_ms': None}
+
+    @contextmanager
+    def _use_model(self, exclusive=True, reload=True):
+        """
+        Reserva el modelo para una generación (las peticiones en espera cuentan como actividad).
+        Si se liberó por inactividad, lo recarga antes. Con exclusive=False no se bloquea
+        el modelo cuando hay un motor concurrente, que planifica él mismo las generaciones.
+        """
+        with self._state_lock:
+            self._pending_generations += 1
+            self.last_activity = time.time()
+        self._generation_lock.acquire()
+        locked = True
+        model = None
+        try:
+            if reload:
+                self._ensure_loaded()
+            # El registro no expulsa (ni cierra) el modelo mientras se genera con él
+            if self.model is not None and self.backend.acquire(self.model):
+                model = self.model
+            if not exclusive and self.parallel_engine is not None:
+                self._generation_lock.release()
+                locked = False
+            yield
+        finally:
+            if model is not None:
+                self.backend.unpin(model)
+            if locked:
+                self._generation_lock.release()
+            with self._state_lock:
+                self._pending_generations -= 1
+                self.last_activity = time.time()
+
+    def is_idle(self, min_seconds=0):
+        """Indica si no hay generaciones en curso ni pendientes desde hace al menos min_seconds"""
+        with self._state_lock:
+            if self._pending_generations > 0:
+                return False
+            return (time.time() - self.last_activity) >= min_seconds
+
+    def new_cancel_token(self, deadline_seconds=None, max_tokens=None, background=False):
+        """Crea un token de cancelación con los límites por defecto de los ajustes"""
+        if deadline_seconds is None:
+            deadline_seconds = self.settings.get("generation_deadline_seconds", GENERATION_DEADLINE_SECONDS)
+        if max_tokens is None:
+            max_tokens = self.settings.get("generation_token_budget", GENERATION_TOKEN_BUDGET)
+        return CancellationToken(deadline_seconds, max_tokens, background)
+    
+    def cancel_generation(self, token, reason="detenida por el usuario"):
+        """
+        Detiene la generación de quien la pidió (su token), esté en curso o en espera.
+        Las demás (otras sesiones, resúmenes en segundo plano) siguen su curso.
+        Devuelve True si el token estaba en uso.
+        """
+        if token is None:
+            return False
+        with self._state_lock:
+            active = token in self._active_tokens
+        token.cancel(reason)
+        return active
+    
+    def _get_response_cache(self):
+        if self.response_cache_enabled and self._response_cache is None:
+            self._response_cache = ResponseCache()
+        return self._response_cache if self.response_cache_enabled else None
+
+    def _response_cache_key(self, prompt, stop, temperature, max_tokens, cacheable):
+        """Clave de la caché de respuestas, o None si esta llamada no se cachea"""
+        cache = self._get_response_cache()
+        if cache is None:
+            return None
+        # Solo llamadas repetibles: marcadas como tales o a temperatura casi determinista
+        if not cacheable and temperature > RESPONSE_CACHE_MAX_TEMPERATURE:
+            return None
+        try:
+            fingerprint = self.backend.fingerprint(self.model_type)
+        except OSError:
+            return None
+        params = {"temperature": temperature, "max_tokens": max_tokens, "stop": stop}
+        text = prompt.text if isinstance(prompt, BuiltPrompt) else str(prompt)
+        return ResponseCache.make_key(fingerprint, self.model_type, params, text)
+
+    def set_response_cache(self, enabled):
+        """Activa/desactiva la caché de respuestas"""
+        self.response_cache_enabled = bool(enabled)
+
+    def get_response_cache_stats(self):
+        """Aciertos, fallos y segundos de generación ahorrados (None si está desactivada)"""
+        cache = self._get_response_cache()
+        return cache.get_stats() if cache else None
+
+    def _run_completion(self, prompt, stop, temperature, max_tokens=None, callback=None, cancel_token=None,
+                        cacheable=False):
+        """
+        Bucle común de generación en streaming.
+        Comprueba el token de cancelación entre tokens y devuelve el texto generado
+        (parcial si se detuvo antes de tiempo). prompt puede ser texto o un BuiltPrompt.
+        cacheable: la llamada es repetible y puede servirse de la caché de respuestas.
+        """
+        token = cancel_token or self.new_cancel_token()
+        limits = [limit for limit in (max_tokens, token.max_tokens) if limit is not None]
+        budget = min(limits) if limits else MAX_TOKENS
+        
+        # Prompt y respuesta de la última generación de este hilo (ver continue_stream)
+        built = prompt if isinstance(prompt, BuiltPrompt) else None
+        self._timings.last_sequence = None
+        
+        # Antes de tocar el modelo (un acierto no lo despierta si está liberado)
+        cache_key = self._response_cache_key(prompt, stop, temperature, budget, cacheable)
+        if cache_key:
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                print("[INFO] Respuesta servida desde la caché")
+                if callback:
+                    callback(cached)
+                self._timings.stop_reason = None
+                self._timings.last = {}
+                if built is not None:
+                    self._timings.last_sequence = (built, cached)
+                return cached
+        
+        with self._state_lock:
+            # Las tareas en segundo plano ceden el modelo a las peticiones del usuario
+            # (en los modos concurrentes se ejecutan a la vez, no hace falta)
+            if not token.background and self.parallel_engine is None:
+                for other in self._active_tokens:
+                    if other.background:
+                        other.cancel(PREEMPTED_REASON)
+            self._active_tokens.add(token)
+        try:
+            with self._use_model(exclusive=False):
+                engine = self.parallel_engine
+                started = time.perf_counter()
+                if isinstance(prompt, BuiltPrompt):
+                    # Tokens cacheados por turno: el prefijo coincide con el de la llamada anterior
+                    prompt = prompt.tokens(self.model)
+                
+                first_token_at = []
+                def on_piece(piece):
+                    if not first_token_at:
+                        first_token_at.append(time.perf_counter())
+                    if callback:
+                        callback(piece)
+                
+                full_response = ""
+                # Pudo cancelarse mientras esperaba su turno
+                if engine is not None:
+                    full_response = engine.generate(
+                        prompt, temperature, max_tokens=budget, stop=stop,
+                        callback=on_piece, cancel_token=token
+                    )
+                elif not token.should_stop():
+                    for output in self.model(
+                        prompt,
+                        max_tokens=budget,
+                        temperature=temperature,
+                        stop=stop,
+                        echo=False,
+                        stream=True
+                    ):
+                        piece = output['choices'][0]['text']
+                        full_response += piece
+                        token.tokens_generated += 1
+                        on_piece(piece)
+                        if token.should_stop():
+                            break
+                
+                self._record_timings(prompt, started, first_token_at, token.tokens_generated)
+                
+                if built is not None:
+                    self._timings.last_sequence = (built, full_response)
+                
+                self._timings.stop_reason = token.reason
+                if token.reason:
+                    print(f"[INFO] Generación detenida ({token.reason}) tras {token.tokens_generated} tokens")
+                elif cache_key and full_response.strip():
+                    # Solo respuestas completas (nunca las cortadas por cancelación o plazo)
+                    self._response_cache.put(cache_key, full_response, time.perf_counter() - started)
+                return full_response
+        finally:
+            with self._state_lock:
+                self._active_tokens.discard(token)
+    
+    def _record_timings(self, prompt, started, first_token_at, generated):
+        """Evaluación del prompt (hasta el primer token) y velocidad de generación"""
+        finished = time.perf_counter()
+        timings = {
+            "prompt_tokens": len(prompt) if isinstance(prompt, list) else None,
+            "prompt_eval_ms": None,
+            "tokens_per_second": None
+        }
+        if first_token_at:
+            first = first_token_at[0]
+            timings["prompt_eval_ms"] = (first - started) * 1000
+            if generated > 1 and finished > first:
+                timings["tokens_per_second"] = (generated - 1) / (finished - first)
+        self._timings.last = timings
+
+    def get_last_timings(self):
+        """Tiempos de la última generación hecha desde este hilo"""
+        return dict(getattr(self._timings, "last", {}))
+
+    def get_last_stop_reason(self):
+        """Motivo de la parada anticipada de la última generación de este hilo (None si terminó)"""
+        return getattr(self._timings, "stop_reason", None)
 
     def set_temperature(self, value):
         """Actualiza la temperatura del modelo"""
         self.temperature = float(value)
         print(f"[DEBUG] Temperatura actualizada a: {self.temperature}")
+
+    def set_speculative_decoding(self, enabled, draft_tokens=None):
+        """Activa/desactiva la decodificación especulativa (recarga el modelo si ya estaba cargado)"""
+        self.speculative_decoding = bool(enabled)
+        if draft_tokens is not None:
+            self.draft_tokens = int(draft_tokens)
+        print(f"[DEBUG] Decodificación especulativa: {self.speculative_decoding} ({self.draft_tokens} tokens)")
+        
+        if self.is_available():
+            return self.initialize()
+        return True
     
     def initialize(self, model_type=None, progress_callback=None):
         """Inicializa el modelo (descarga si es necesario)"""
         if model_type:
             self.model_type = model_type
+        self.prompt_builder.set_model_type(self.model_type)
             
-        config = MODELS_CONFIG[self.model_type]
-        model_path = os.path.join(MODELS_DIR, config["filename"])
-        model_url = config["url"]
-
-        # Verificar si el modelo existe
-        if not os.path.exists(model_path):
-            success = download_model(model_url, model_path, progress_callback)
-            if not success:
-                return False
+        # Verificar si el modelo existe (lo descarga si falta)
+        if not self.backend.prepare(self.model_type, progress_callback):
+            return False
         
         # Cargar el modelo
         try:
-            self.model = get_model(model_path)
+            draft_tokens = self.draft_tokens if self.speculative_decoding else None
+            with self._use_model(reload=False):
+                # El contexto del motor por lotes apunta a los pesos del modelo anterior:
+                # se libera antes de que el registro pueda expulsarlo
+                self._close_parallel_engine()
+                previous = self.model
+                self.model = self.backend.load(self.model_type, draft_tokens)
+                if previous is not None:
+                    # El anterior deja de estar en uso por este cliente: el registro puede expulsarlo
+                    self.backend.unpin(previous)
+                self.context_length = self.model.n_ctx()
+                self._start_parallel_engine()
+                self._unloaded = False
             self._is_ready = True
+            self._start_idle_monitor()
             return True
         except Exception as e:
             print(f"Error cargando modelo: {e}")
             return False
     
+    def _start_parallel_engine(self):
+        """Crea el motor concurrente que corresponda a inference_mode sobre el modelo cargado"""
+        if self.inference_mode != "single" and not self.backend.supports_parallel:
+            print(f"[WARNING] El backend {self.backend.name} no admite el modo {self.inference_mode}, "
+                  "se usa el modo secuencial")
+            return
+        try:
+            if self.inference_mode == "batched":
+                from batched_engine import BatchedInferenceEngine
+                self.parallel_engine = BatchedInferenceEngine(
+                    self.model, n_parallel=self.batch_parallel, n_ctx_per_seq=self.context_length,
+                    kv_options=self.backend.context_plan(self.model_type)
+                )
+                print(f"[INFO] Inferencia por lotes activa ({self.batch_parallel} secuencias simultáneas)")
+            elif self.inference_mode == "pool":
+                from model_pool import ModelWorkerPool, default_worker_count
+                draft_tokens = self.draft_tokens if self.speculative_decoding else None
+                workers = int(self.pool_workers or default_worker_count())
+                self.parallel_engine = ModelWorkerPool(self._model_path(), workers, draft_tokens)
+        except Exception as e:
+            # Versiones de llama-cpp-python sin la API de lotes, procesos que no arrancan...
+            print(f"[WARNING] No se pudo iniciar el modo {self.inference_mode}, se usa el modo secuencial: {e}")
+            self.parallel_engine = None
+
+    def _close_parallel_engine(self):
+        if self.parallel_engine is not None:
+            self.parallel_engine.close()
+            self.parallel_engine = None
+
+    def set_backend(self, name, profile=None):
+        """Cambia el backend del modelo ("llama_cpp" o "fake"); se aplica en el siguiente initialize"""
+        self.backend = create_backend(name, profile)
+
+    def set_inference_mode(self, mode):
+        """Cambia entre "single", "batched" y "pool" (reinicia el motor si el modelo ya está cargado)"""
+        self.inference_mode = mode
+        print(f"[DEBUG] Modo de inferencia: {mode}")
+        if not self.is_available():
+            return True
+        with self._use_model(reload=False):
+            # Si el modelo está liberado, el motor se crea al recargarlo
+            if not self._unloaded:
+                self._close_parallel_engine()
+                self._start_parallel_engine()
+        return True
+
+    def _notify_model_state(self, state):
+        if self.on_model_state:
+            try:
+                self.on_model_state(state)
+            except Exception as e:
+                print(f"[WARNING] Error notificando estado del modelo: {e}")
+
+    def _start_idle_monitor(self):
+        if self._idle_thread is None:
+            self._idle_thread = threading.Thread(target=self._idle_monitor)
+            self._idle_thread.daemon = True
+            self._idle_thread.start()
+
+    def _idle_monitor(self):
+        """Libera el modelo cuando lleva idle_unload_seconds sin usarse"""
+        while True:
+            time.sleep(MODEL_IDLE_CHECK_SECONDS)
+            timeout = self.idle_unload_seconds
+            if timeout and self.model is not None and self.is_idle(timeout):
+                self.unload_model()
+
+    def unload_model(self):
+        """Libera el modelo de memoria; se recargará con la siguiente petición"""
+        with self._generation_lock:
+            with self._state_lock:
+                # Llegó una petición mientras se esperaba el bloqueo
+                if self._pending_generations > 0 or self.model is None:
+                    return False
+            self._close_parallel_engine()
+            draft_tokens = self.draft_tokens if self.speculative_decoding else None
+            self.backend.unpin(self.model)
+            self.backend.release(self.model_type, draft_tokens, reason="inactividad")
+            self.model = None
+            self._unloaded = True
+            self.unload_count += 1
+        self._notify_model_state("unloaded")
+        return True
+
+    def _ensure_loaded(self):
+        """Recarga el modelo liberado por inactividad (llamar con _generation_lock adquirido)"""
+        if not self._unloaded:
+            return
+        self._notify_model_state("reloading")
+        start = time.perf_counter()
+        draft_tokens = self.draft_tokens if self.speculative_decoding else None
+        self.model = self.backend.load(self.model_type, draft_tokens)
+        self.context_length = self.model.n_ctx()
+        self._start_parallel_engine()
+        self._unloaded = False
+        
+        elapsed = time.perf_counter() - start
+        self.reload_times = (self.reload_times + [elapsed])[-20:]
+        print(f"⚡ Modelo recargado en {elapsed:.2f}s")
+        self._notify_model_state("reloaded")
+
+    def set_idle_unload(self, seconds):
+        """Cambia el tiempo de inactividad antes de liberar el modelo (None = nunca)"""
+        self.idle_unload_seconds = seconds
+
+    def get_idle_stats(self):
+        """Estado de la liberación por inactividad y latencia de recarga (para ajustar el plazo)"""
+        return {
+            'loaded': self.model is not None,
+            'idle_unload_seconds': self.idle_unload_seconds,
+            'unloads': self.unload_count,
+            'reloads': len(self.reload_times),
+            'last_reload_seconds': self.reload_times[-1] if self.reload_times else None,
+            'avg_reload_seconds': sum(self.reload_times) / len(self.reload_times) if self.reload_times else None
+        }
+
+    def get_parallel_stats(self):
+        """Ocupación del motor concurrente (None en modo secuencial)"""
+        engine = self.parallel_engine
+        return engine.get_stats() if engine else None
+
+    def _model_path(self, model_type=None):
+        return os.path.join(MODELS_DIR, MODELS_CONFIG[model_type or self.model_type]["filename"])
+    
+    def preload_alternate_model(self):
+        """Precarga en segundo plano el otro tipo de modelo si está descargado y cabe en RAM"""
+        other = "base" if self.model_type == "instruct" else "instruct"
+        if not self.is_model_downloaded(other):
+            return False
+        draft_tokens = self.draft_tokens if self.speculative_decoding else None
+        return self.backend.preload(other, draft_tokens)
+    
+    def get_registry_stats(self):
+        """Estadísticas de los modelos residentes en memoria"""
+        return get_registry().get_stats()
+    
+    def get_context_stats(self):
+        """Contexto del modelo cargado y memoria estimada de su caché KV"""
+        stats = {'n_ctx': self.context_length}
+        plan = self.backend.context_plan(self.model_type) if self.model is not None else None
+        if plan:
+            stats.update({
+                'trained_context': plan["trained_context"],
+                'type_k': plan["type_k"],
+                'type_v': plan["type_v"],
+                'flash_attn': plan["flash_attn"],
+                'kv_cache_mb': round(plan["kv_bytes"] / (1024 * 1024), 1) if plan["kv_bytes"] else None
+            })
+        return stats
+    
+    def get_backend_stats(self):
+        """Backend activo y, en el falso, tokens de prompt contados y evaluados"""
+        return self.backend.get_stats()
+    
     def is_available(self):
         """Verifica si el modelo está disponible"""
-        return self._is_ready and self.model is not None
+        # Un modelo liberado por inactividad sigue disponible: se recarga al usarlo
+        return self._is_ready and (self.model is not None or self._unloaded)
     
     def is_model_downloaded(self, model_type=None):
         """Verifica si el modelo ya está descargado"""
-        m_type = model_type or self.model_type
-        filename = MODELS_CONFIG[m_type]["filename"]
-        path = os.path.join(MODELS_DIR, filename)
-        return os.path.exists(path)
+        return self.backend.is_downloaded(model_type or self.model_type)
     
-    def generate(self, prompt, context="", system_prompt=""):
+    def generate(self, prompt, context="", system_prompt="", cancel_token=None):
         """Genera una respuesta del modelo"""
         if not self.is_available():
             return "Error: Modelo no disponible"
@@ -206,20 +912,17 @@ class LocalLLMClient:
         full_prompt = self._build_prompt(prompt, context, system_prompt)
         
         try:
-            output = self.model(
+            response = self._run_completion(
                 full_prompt,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE,
                 stop=["Usuario:", "\n\nUsuario:", "<end_of_turn>"],
-                echo=False
+                temperature=TEMPERATURE,
+                cancel_token=cancel_token
             )
-            
-            response = output['choices'][0]['text'].strip()
-            return response
+            return response.strip()
         except Exception as e:
             return f"Error generando respuesta: {str(e)}"
     
-    def generate_stream(self, prompt, context="", system_prompt="", callback=None):
+    def generate_stream(self, prompt, context="", system_prompt="", callback=None, cancel_token=None):
         """Genera una respuesta en streaming"""
         if not self.is_available():
             if callback:
@@ -229,19 +932,13 @@ class LocalLLMClient:
         full_prompt = self._build_prompt(prompt, context, system_prompt)
         
         try:
-            full_response = ""
-            for output in self.model(
+            full_response = self._run_completion(
                 full_prompt,
-                max_tokens=MAX_TOKENS,
-                temperature=self.temperature,
                 stop=["<end_of_turn>", "Usuario:"],
-                echo=False,
-                stream=True
-            ):
-                token = output['choices'][0]['text']
-                full_response += token
-                if callback:
-                    callback(token)
+                temperature=self.temperature,
+                callback=callback,
+                cancel_token=cancel_token
+            )
             
             return full_response.strip()
         except Exception as e:
@@ -251,21 +948,11 @@ class LocalLLMClient:
             return error_msg
     
     def _get_system_prompt(self):
-        """Lee el system prompt desde el archivo o usa el default"""
-        try:
-            prompt_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "system_prompt.txt")
-            if os.path.exists(prompt_path):
-                with open(prompt_path, "r", encoding="utf-8") as f:
-                    return f.read().strip()
-        except Exception as e:
-            print(f"[ERROR] No se pudo leer system_prompt.txt: {e}")
-        
-        return "Eres Aurora, una chica joven y directa, sin adornos en tu conversación. Tu tono es equilibrado y natural. Responde siempre en Español de España."
+        """System prompt de system_prompt.txt (solo se relee si cambia en disco) o el default"""
+        return self.prompt_builder.system_prompt
 
     def _build_prompt(self, user_input, context="", system_prompt=""):
         """Construye el prompt según el tipo de modelo"""
-        prompt_parts = []
-        
         # System prompt
         if not system_prompt:
             system_prompt = self._get_system_prompt()
@@ -273,17 +960,9 @@ class LocalLLMClient:
         if context:
             system_prompt += f"\n\nInformación de contexto relevante:\n{context}"
         
-        if self.model_type == "instruct":
-            # Formato Gemma 2 Instruct
-            prompt_parts.append(f"<start_of_turn>user\n{system_prompt}\n\n{user_input}<end_of_turn>")
-            prompt_parts.append("<start_of_turn>model\n")
-        else:
-            # Formato Simple para Base Model
-            prompt_parts.append(f"Instrucciones:\n{system_prompt}\n\nUsuario: {user_input}\nAurora:")
-        
-        return "".join(prompt_parts)
+        return self.prompt_builder.build_single(user_input, system_prompt)
     
-    def generate_summary(self, conversation_history):
+    def generate_summary(self, conversation_history, cancel_token=None):
         """Genera un resumen de la conversación"""
         # Usar etiquetas neutras para evitar stop tokens accidentales
         conversation_text = "\n".join([
@@ -310,25 +989,77 @@ RESUMEN DETALLADO:"""
         
         try:
             # Aumentar max_tokens y reducir stop words para evitar que corte
-            output = self.model(
+            result = self._run_completion(
                 full_prompt,
                 max_tokens=1024, # Aumentado para resumenes largos
                 temperature=0.6, # Un poco más determinista
                 stop=["<end_of_turn>"], # Quitamos "Usuario:" para evitar falsos positivos
-                echo=False
-            )
-            
-            result = output['choices'][0]['text'].strip()
+                cancel_token=cancel_token,
+                cacheable=True  # Misma ventana de mensajes -> mismo resumen
+            ).strip()
             print(f"[DEBUG] Resultado raw del modelo: '{result}'")
             return result
         except Exception as e:
             print(f"[DEBUG] Error en generate_summary: {e}")
             return f"Error generando resumen: {str(e)}"
     
-    def _trim_history(self, messages, system_context="", user_context=""):
+    def generate_rolling_summary(self, previous_summary, messages, cancel_token=None):
+        """
+        Pliega en el resumen acumulado de la conversación los turnos que ya no caben en el prompt.
+        messages tiene que caber en rolling_fold_budget (ver ChatEngine.fold_chunk)
+        """
+        conversation_text = "\n".join([
+            f"{'Interlocutor' if msg['role'] == 'user' else 'Aurora'}: {msg['content']}"
+            for msg in messages
+        ])
+        full_prompt = self._rolling_fold_prompt(previous_summary, conversation_text)
+        
+        try:
+            return self._run_completion(
+                full_prompt,
+                max_tokens=ROLLING_SUMMARY_MAX_WORDS * 2,
+                temperature=0.3,
+                stop=["<end_of_turn>"],
+                cancel_token=cancel_token,
+                cacheable=True
+            ).strip()
+        except Exception as e:
+            print(f"[DEBUG] Error en generate_rolling_summary: {e}")
+            return f"Error generando resumen: {str(e)}"
+    
+    def rolling_fold_budget(self, previous_summary=""):
+        """
+        Tokens estimados de mensajes que caben en un plegado: n_ctx menos la plantilla,
+        el resumen anterior (o el más largo que puede llegar a ser) y la respuesta
+        """
+        summary_tokens = max(len(previous_summary or "") / 4, ROLLING_SUMMARY_MAX_WORDS * 2)
+        template_tokens = len(self._rolling_fold_prompt("", "").text) / 4
+        response_tokens = ROLLING_SUMMARY_MAX_WORDS * 2
+        return max(0, self.context_length - template_tokens - summary_tokens - response_tokens - 100)
+    
+    def _rolling_fold_prompt(self, previous_summary, conversation_text):
+        previous = previous_summary or "(todavía no hay resumen)"
+        
+        fold_prompt = f"""Mantienes un resumen de una conversación larga que ya no cabe entera en tu memoria.
+Actualiza el RESUMEN ANTERIOR incorporando los NUEVOS MENSAJES.
+Conserva hechos, datos, preferencias, decisiones y temas pendientes; elimina lo redundante.
+Escribe como máximo {ROLLING_SUMMARY_MAX_WORDS} palabras.
+
+RESUMEN ANTERIOR:
+{previous}
+
+NUEVOS MENSAJES:
+{conversation_text}
+
+RESUMEN ACTUALIZADO:"""
+        
+        return self._build_prompt(fold_prompt, system_prompt="Eres Aurora, resumiendo la conversación en curso.")
+    
+    def _trim_history(self, messages, system_context="", user_context="", summary="", reserved_chars=0):
         """
         Recorta el historial para ajustar al límite de contexto.
         Estimación simple: 1 token ≈ 4 caracteres
+        reserved_chars: caracteres que se descuentan además (contexto aún desconocido)
         """
         # Calcular tokens base (System + Contextos + Margen)
         # Margen para la respuesta nueva y overhead de formato
@@ -337,7 +1068,9 @@ RESUMEN DETALLADO:"""
         reserved_tokens = safe_max_tokens + 100 
         
         system_len = len(system_context) if system_context else 0
+        system_len += len(summary) if summary else 0
         rag_len = len(user_context) if user_context else 0
+        rag_len += reserved_chars
         
         # System prompt base
         base_prompt_len = len(self._get_system_prompt())
@@ -346,7 +1079,7 @@ RESUMEN DETALLADO:"""
         # 1 token aprox 4 caracteres
         used_tokens = (base_prompt_len + system_len + rag_len) / 4
         
-        available_tokens = CONTEXT_LENGTH - reserved_tokens - used_tokens
+        available_tokens = self.context_length - reserved_tokens - used_tokens
         
         if available_tokens <= 0:
             print("[WARNING] Contexto RAG + Memorias excede el límite. Recortando...")
@@ -371,103 +1104,182 @@ RESUMEN DETALLADO:"""
             
         return trimmed_messages
 
-    def chat(self, messages, system_context="", user_context=""):
-        """
-        Chat con historial de mensajes.
-        
-        Args:
-            messages: Lista de diccionarios con el historial
-            system_context: Contexto estable (Memorias) para el System Prompt
-            user_context: Contexto dinámico (RAG) para el último mensaje de usuario
-        """
-        # 1. Recortar historial para que quepa
-        history_window = self._trim_history(messages[:-1], system_context, user_context)
-        
+    def evicted_messages(self, messages, system_context="", user_context="", summary=""):
+        """Mensajes más antiguos que el recorte dejaría fuera del prompt"""
+        window = self._trim_history(messages, system_context, user_context, summary)
+        return messages[:len(messages) - len(window)]
+    
+    def _chat_system_prompt(self, system_context="", summary=""):
         system_prompt = self._get_system_prompt()
         if system_context:
             system_prompt += f"\n\nContexto de Memoria a Largo Plazo:\n{system_context}"
+        if summary:
+            # En la cabecera: solo cambia cuando se pliegan turnos nuevos (prefijo estable)
+            system_prompt += f"\n\nResumen de la conversación hasta ahora:\n{summary}"
+        return system_prompt
+    
+    def _build_chat_prompt(self, messages, system_context="", user_context="", summary=""):
+        """Prompt de conversación con el historial que quepa en el contexto"""
+        # Recortar historial para que quepa
+        history_window = self._trim_history(messages[:-1], system_context, user_context, summary)
+        system_prompt = self._chat_system_prompt(system_context, summary)
         
-        # Construir prompt completo con historial
-        full_prompt = f"Instrucciones:\n{system_prompt}\n\n"
-        
-        # Añadir historial (excepto el último que se añade al final)
-        for msg in history_window:
-            role = "Usuario" if msg['role'] == 'user' else "Aurora"
-            content = msg['content']
-            full_prompt += f"{role}: {content}\n"
-            
         # Añadir mensaje actual con contexto RAG si existe
         last_user_msg = messages[-1]['content'] if messages else ""
         if user_context:
             last_user_msg = f"Información relevante encontrada:\n{user_context}\n\nPregunta del usuario:\n{last_user_msg}"
-            
-        full_prompt += f"Usuario: {last_user_msg}\nAurora:"
+        
+        return self.prompt_builder.build_chat(history_window, last_user_msg, system_prompt)
+
+    def chat(self, messages, system_context="", user_context="", cancel_token=None, cacheable=False, summary=""):
+        """
+        Chat con historial de mensajes.
+        
+        Args:
+            messages: Lista de diccionarios con el historial
+            system_context: Contexto estable (Memorias) para el System Prompt
+            user_context: Contexto dinámico (RAG) para el último mensaje de usuario
+            cacheable: La llamada es repetible (puede servirse de la caché de respuestas)
+            summary: Resumen acumulado de los turnos anteriores a messages
+        """
+        full_prompt = self._build_chat_prompt(messages, system_context, user_context, summary)
         
         try:
-            output = self.model(
+            response = self._run_completion(
                 full_prompt,
-                max_tokens=MAX_TOKENS,
-                temperature=self.temperature,
                 stop=["<end_of_turn>", "Usuario:"],
-                echo=False
+                temperature=self.temperature,
+                cancel_token=cancel_token,
+                cacheable=cacheable
             )
             
-            return output['choices'][0]['text'].strip()
+            return response.strip()
         except Exception as e:
             return f"Error: {str(e)}"
     
-    def chat_stream(self, messages, system_context="", user_context="", callback=None):
+    def chat_stream(self, messages, system_context="", user_context="", callback=None, cancel_token=None,
+                    cacheable=False, summary=""):
         """Chat con streaming y contexto separado"""
-        # 1. Recortar historial para que quepa
-        history_window = self._trim_history(messages[:-1], system_context, user_context)
-
-        system_prompt = self._get_system_prompt()
-        if system_context:
-            system_prompt += f"\n\nContexto de Memoria a Largo Plazo:\n{system_context}"
-        
-        # Construir prompt completo con historial
-        if self.model_type == "instruct":
-            full_prompt = f"<start_of_turn>user\n{system_prompt}\n\n"
-            for msg in history_window:
-                role = "user" if msg['role'] == 'user' else "model"
-                full_prompt += f"<start_of_turn>{role}\n{msg['content']}<end_of_turn>\n"
-        else:
-            full_prompt = f"Instrucciones:\n{system_prompt}\n\n"
-            for msg in history_window:
-                role = "Usuario" if msg['role'] == 'user' else "Aurora"
-                full_prompt += f"{role}: {msg['content']}\n"
-        
-        last_user_msg = messages[-1]['content'] if messages else ""
-        
         # DEBUG: Mostrar qué contextos se están usando
         print(f"\n[DEBUG-LLM] user_context (RAG) presente: {bool(user_context)}")
         print(f"[DEBUG-LLM] system_context (Memorias) presente: {bool(system_context)}")
         if user_context:
             print(f"[DEBUG-LLM] ⚠️ AÑADIENDO RAG AL PROMPT: {user_context[:100]}...")
         
-        if user_context:
-            last_user_msg = f"Información relevante encontrada:\n{user_context}\n\nPregunta del usuario:\n{last_user_msg}"
-
-        if self.model_type == "instruct":
-            full_prompt += f"<start_of_turn>user\n{last_user_msg}<end_of_turn>\n<start_of_turn>model\n"
-        else:
-            full_prompt += f"Usuario: {last_user_msg}\nAurora:"
+        full_prompt = self._build_chat_prompt(messages, system_context, user_context, summary)
         
         try:
-            full_response = ""
-            for output in self.model(
+            full_response = self._run_completion(
                 full_prompt,
-                max_tokens=MAX_TOKENS,
+                stop=["<end_of_turn>", "Usuario:"],
                 temperature=self.temperature,
+                callback=callback,
+                cancel_token=cancel_token,
+                cacheable=cacheable
+            )
+            
+            return full_response.strip()
+        except Exception as e:
+            error_msg = f"Error: {str(e)}"
+            if callback:
+                callback(error_msg)
+            return error_msg
+
+
+    def build_prefill_prompt(self, messages, summary="", partial_message=""):
+        """
+        Parte ya conocida del prompt del siguiente turno (historial completo, sin el mensaje nuevo).
+        _build_chat_prompt recorta el historial descontando el contexto RAG del mensaje nuevo,
+        que aún no se conoce: si con hasta PREFILL_RAG_RESERVE_CHARS de contexto el recorte
+        cambiaría, el prefijo podría no coincidir y no se precarga (None).
+        """
+        history_window = self._trim_history(messages, summary=summary)
+        reserved_window = self._trim_history(messages, summary=summary, reserved_chars=PREFILL_RAG_RESERVE_CHARS)
+        if len(reserved_window) != len(history_window):
+            return None
+        return self.prompt_builder.build_prefix(history_window, self._chat_system_prompt("", summary), partial_message)
+    
+    def prefill_async(self, prompt_factory, delay=0.0):
+        """
+        Programa la precarga en la caché KV del prompt que devuelva prompt_factory().
+        Una nueva petición sustituye a la pendiente (así se agrupan las pulsaciones).
+        """
+        timer = threading.Timer(delay, self._run_prefill, args=(prompt_factory,))
+        timer.daemon = True
+        with self._state_lock:
+            if self._prefill_timer is not None:
+                self._prefill_timer.cancel()
+            self._prefill_timer = timer
+        timer.start()
+    
+    def _run_prefill(self, prompt_factory):
+        # Los motores concurrentes tienen sus propias cachés KV por secuencia;
+        # un modelo liberado por inactividad no se despierta para esto
+        if self.parallel_engine is not None or self.model is None:
+            return
+        token = CancellationToken(background=True)
+        with self._state_lock:
+            self._active_tokens.add(token)
+        try:
+            with self._use_model(reload=False):
+                model = self.model
+                if model is None or token.should_stop():
+                    return
+                prompt = prompt_factory()
+                if prompt is None:
+                    return
+                start = time.perf_counter()
+                evaluated = _prefill_tokens(model, prompt.tokens(model), token)
+                
+                stats = self.prefill_stats
+                stats['runs'] += 1
+                stats['tokens'] += evaluated
+                stats['cancelled'] += 1 if token.reason else 0
+                stats['last_ms'] = (time.perf_counter() - start) * 1000
+                if evaluated:
+                    print(f"[DEBUG] Precarga: {evaluated} tokens en {stats['last_ms']:.0f} ms"
+                          + (f" ({token.reason})" if token.reason else ""))
+        except Exception as e:
+            print(f"[WARNING] Falló la precarga del prompt: {e}")
+        finally:
+            with self._state_lock:
+                self._active_tokens.discard(token)
+    
+    def get_prefill_stats(self):
+        """Precargas hechas, tokens evaluados por adelantado y cuántas cedieron el modelo"""
+        return dict(self.prefill_stats)
+    
+    def can_continue(self):
+        """Indica si la última respuesta de este hilo puede prolongarse con continue_stream"""
+        return getattr(self._timings, "last_sequence", None) is not None
+    
+    def continue_stream(self, instruction, callback=None, cancel_token=None):
+        """
+        Prolonga la última respuesta de este hilo con una instrucción oculta.
+        El prompt es el anterior + su respuesta + la instrucción, de modo que la caché KV
+        que dejó esa generación sigue valiendo y solo se evalúan los tokens nuevos.
+        """
+        sequence = getattr(self._timings, "last_sequence", None)
+        if sequence is None:
+            return "Error: No hay respuesta que continuar"
+        previous, response = sequence
+        full_prompt = self.prompt_builder.build_continuation(previous, response, instruction)
+        
+        try:
+            full_response = self._run_completion(
+                full_prompt,
                 stop=["<end_of_turn>", "Usuario:"],
-                echo=False,
-                stream=True
-            ):
-                token = output['choices'][0]['text']
-                full_response += token
-                if callback:
-                    callback(token)
+                temperature=self.temperature,
+                callback=callback,
+                cancel_token=cancel_token
+            )
             
+            timings = getattr(self._timings, "last", {})
+            new_tokens = full_prompt.segments[-1]["tokens"]
+            if timings.get("prompt_tokens") and new_tokens is not None:
+                timings["prompt_new_tokens"] = len(new_tokens)
+                print(f"[INFO] Continuación: {len(new_tokens)} tokens nuevos de {timings['prompt_tokens']} "
+                      f"(prompt evaluado en {timings['prompt_eval_ms'] or 0:.0f} ms)")
             return full_response.strip()
         except Exception as e:
             error_msg = f"Error: {str(e)}"
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Persistencia Diferida
+Las escrituras de archivos pequeños (estadísticas, ajustes, conversaciones) no se
+hacen en el hilo que genera: se encolan y un hilo las agrupa por archivo durante
+PERSIST_DEBOUNCE_MS. De varias reescrituras del mismo archivo solo se escribe la
+última; las líneas añadidas a un diario se escriben juntas. Cada reescritura es
+atómica (temporal + rename) y lo pendiente se vuelca al salir.
+"""
+
+import os
+import math
+import time
+import json
+import atexit
+import threading
+from collections import OrderedDict
+
+from config import PERSIST_DEBOUNCE_MS, PERSIST_FSYNC
+
+_LATENCY_WINDOW = 200
+
+
+def _percentile(sorted_values, fraction):
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class _Pending:
+    """Lo que falta por escribir de un archivo"""
+
+    def __init__(self):
+        self.content = None  # Contenido completo (None = solo añadir)
+        self.append = ""
+        self.mutations = 0
+        self.queued_at = time.perf_counter()
+
+
+class PersistenceService:
+    """Cola de escrituras agrupadas por archivo, con un hilo escritor"""
+
+    def __init__(self, debounce_ms=PERSIST_DEBOUNCE_MS, fsync=PERSIST_FSYNC):
+        self.debounce = debounce_ms / 1000
+        self.fsync = fsync  # True = fsync tras cada escritura (sobrevive a cortes de luz)
+        self._pending = OrderedDict()  # Ruta -> _Pending, en orden de escritura
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self.mutations = 0
+        self.writes = 0
+        self.coalesced = 0  # Cambios que no necesitaron escritura propia
+        self.errors = 0
+        self.queue_latencies = []  # ms desde que se encola un cambio hasta que está en disco
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # --- API ---
+
+    def write(self, path, content):
+        """Reescribe el archivo completo (sustituye cualquier cambio pendiente)"""
+        with self._cond:
+            pending = self._take(path)
+            pending.content = content
+            pending.append = ""
+            # Una reescritura va después de todo lo encolado antes (p. ej. la instantánea
+            # de una conversación antes de vaciar su diario)
+            self._pending.move_to_end(path)
+            self._cond.notify()
+
+    def write_json(self, path, data, indent=None):
+        """Serializa ahora (los datos pueden cambiar después) y encola la reescritura"""
+        self.write(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+    def append(self, path, text):
+        """Añade texto al final del archivo"""
+        with self._cond:
+            pending = self._take(path)
+            if pending.content is not None:
+                pending.content += text
+            else:
+                pending.append += text
+            self._cond.notify()
+
+    def has_pending(self, path):
+        with self._cond:
+            return path in self._pending
+
+    def discard(self, path):
+        """Olvida los cambios pendientes de un archivo (p. ej. al borrarlo)"""
+        with self._cond:
+            self._pending.pop(path, None)
+
+    def flush(self, path=None):
+        """Escribe ya lo pendiente (de un archivo o de todos) y espera a que termine"""
+        self._drain(path)
+
+    def shutdown(self):
+        """Vuelca lo pendiente y detiene el hilo escritor"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def get_stats(self):
+        latencies = sorted(self.queue_latencies)
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'mutations': self.mutations,
+            'writes': self.writes,
+            'coalesced': self.coalesced,
+            'pending_files': pending,
+            'errors': self.errors,
+            'fsync': self.fsync,
+            'queue_p50_ms': _percentile(latencies, 0.50) if latencies else None,
+            'queue_p95_ms': _percentile(latencies, 0.95) if latencies else None
+        }
+
+    # --- Hilo escritor ---
+
+    def _take(self, path):
+        """Entrada pendiente del archivo (llamar con _cond adquirido)"""
+        pending = self._pending.get(path)
+        if pending is None:
+            pending = self._pending[path] = _Pending()
+        pending.mutations += 1
+        self.mutations += 1
+        return pending
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Ventana de agrupación desde el cambio más antiguo
+                oldest = min(p.queued_at for p in self._pending.values())
+                remaining = oldest + self.debounce - time.perf_counter()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            self._drain()
+
+    def _drain(self, path=None):
+        # Se saca el lote con el bloqueo de escritura tomado: un flush() desde otro
+        # hilo no puede escribir una versión nueva antes de que el hilo escriba la vieja
+        with self._write_lock:
+            with self._cond:
+                if path is None:
+                    batch = list(self._pending.items())
+                    self._pending.clear()
+                elif path in self._pending:
+                    batch = [(path, self._pending.pop(path))]
+                else:
+                    batch = []
+            for path, pending in batch:
+                try:
+                    if pending.content is not None:
+                        self._replace(path, pending.content)
+                    elif pending.append:
+                        self._append(path, pending.append)
+                    self.writes += 1
+                    self.coalesced += pending.mutations - 1
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[ERROR] No se pudo guardar {os.path.basename(path)}: {e}")
+                latency = (time.perf_counter() - pending.queued_at) * 1000
+                self.queue_latencies = (self.queue_latencies + [round(latency, 2)])[-_LATENCY_WINDOW:]
+
+    def _replace(self, path, content):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if self.fsync:
+            self._fsync_dir(os.path.dirname(path))
+
+    def _append(self, path, text):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _fsync_dir(directory):
+        """El rename solo es duradero cuando se sincroniza el directorio (no existe en Windows)"""
+        try:
+            fd = os.open(directory or ".", os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_persistence():
+    """Servicio compartido por todos los gestores (se vuelca al salir del proceso)"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PersistenceService()
+            atexit.register(_service.shutdown)
+        return _service
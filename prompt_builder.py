@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Constructor de Prompts
+Plantillas por tipo de modelo (base / Gemma instruct) con caché de los turnos
+ya renderizados y de sus tokens, y system prompt recargado solo si cambia en disco
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from config import BASE_DIR, PROMPT_TURN_CACHE_SIZE
+
+SYSTEM_PROMPT_FILE = os.path.join(BASE_DIR, "system_prompt.txt")
+DEFAULT_SYSTEM_PROMPT = "Eres Aurora, una chica joven y directa, sin adornos en tu conversación. Tu tono es equilibrado y natural. Responde siempre en Español de España."
+
+
+class SystemPromptSource:
+    """Lee system_prompt.txt y lo vuelve a leer solo cuando cambia su fecha de modificación"""
+
+    def __init__(self, path=SYSTEM_PROMPT_FILE):
+        self.path = path
+        self._mtime = None
+        self._text = DEFAULT_SYSTEM_PROMPT
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return DEFAULT_SYSTEM_PROMPT
+
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._text = f.read().strip()
+                    self._mtime = mtime
+                except Exception as e:
+                    print(f"[ERROR] No se pudo leer system_prompt.txt: {e}")
+                    return DEFAULT_SYSTEM_PROMPT
+            return self._text
+
+
+class BaseTemplate:
+    """Formato simple para el modelo base"""
+    name = "base"
+
+    def header(self, system_prompt):
+        return f"Instrucciones:\n{system_prompt}\n\n"
+
+    def turn(self, role, content):
+        speaker = "Usuario" if role == 'user' else "Aurora"
+        return f"{speaker}: {content}\n"
+
+    def reply(self, user_message):
+        """Último mensaje del usuario y el pie que da paso a la respuesta"""
+        return f"Usuario: {user_message}\nAurora:"
+
+    def end_reply(self):
+        """Cierre de la respuesta recién generada (el texto de parada no llega a emitirse)"""
+        return "\n"
+
+    def reply_prefix(self, partial_message):
+        """Comienzo de reply() con un mensaje a medio escribir"""
+        return f"Usuario: {partial_message}"
+
+    def single(self, system_prompt, user_input):
+        return f"Instrucciones:\n{system_prompt}\n\nUsuario: {user_input}\nAurora:"
+
+
+class GemmaInstructTemplate:
+    """Formato de turnos de Gemma 2 Instruct"""
+    name = "instruct"
+
+    def header(self, system_prompt):
+        return f"<start_of_turn>user\n{system_prompt}\n\n"
+
+    def turn(self, role, content):
+        speaker = "user" if role == 'user' else "model"
+        return f"<start_of_turn>{speaker}\n{content}<end_of_turn>\n"
+
+    def reply(self, user_message):
+        return f"<start_of_turn>user\n{user_message}<end_of_turn>\n<start_of_turn>model\n"
+
+    def end_reply(self):
+        return "<end_of_turn>\n"
+
+    def reply_prefix(self, partial_message):
+        return f"<start_of_turn>user\n{partial_message}"
+
+    def single(self, system_prompt, user_input):
+        return f"<start_of_turn>user\n{system_prompt}\n\n{user_input}<end_of_turn><start_of_turn>model\n"
+
+
+TEMPLATES = {
+    "base": BaseTemplate(),
+    "instruct": GemmaInstructTemplate(),
+}
+
+
+class BuiltPrompt:
+    """
+    Prompt ya montado por segmentos (cabecera, turnos, pie).
+    text es la cadena completa; tokens(llm) concatena los tokens cacheados
+    de cada segmento, de modo que el prefijo de dos prompts consecutivos
+    es idéntico token a token (lo que aprovecha la reutilización de la caché KV).
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.text = "".join(segment["text"] for segment in segments)
+
+    def __str__(self):
+        return self.text
+
+    def tokens(self, llm):
+        tokens = [llm.token_bos()]
+        for segment in self.segments:
+            # Los tokens guardados valen solo para el modelo que los generó
+            if segment["owner"] is not llm:
+                segment["tokens"] = llm.tokenize(segment["text"].encode("utf-8"), add_bos=False, special=True)
+                segment["owner"] = llm
+            tokens.extend(segment["tokens"])
+        return tokens
+
+
+def _segment(text):
+    return {"text": text, "tokens": None, "owner": None}
+
+
+class PromptBuilder:
+    """Monta los prompts del cliente LLM reutilizando lo ya renderizado y tokenizado"""
+
+    def __init__(self, model_type="base", system_source=None):
+        self.system_source = system_source or SystemPromptSource()
+        self.set_model_type(model_type)
+        self._segment_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def set_model_type(self, model_type):
+        self.template = TEMPLATES.get(model_type, TEMPLATES["base"])
+
+    @property
+    def system_prompt(self):
+        return self.system_source.get()
+
+    def _cached(self, key, render):
+        """Segmento renderizado (y sus tokens) reutilizado entre llamadas"""
+        with self._cache_lock:
+            segment = self._segment_cache.get(key)
+            if segment is not None:
+                self._segment_cache.move_to_end(key)
+                return segment
+
+        segment = _segment(render())
+        with self._cache_lock:
+            self._segment_cache[key] = segment
+            while len(self._segment_cache) > PROMPT_TURN_CACHE_SIZE:
+                self._segment_cache.popitem(last=False)
+        return segment
+
+    def _history_segments(self, history, system_prompt):
+        template = self.template
+        segments = [self._cached((template.name, "header", system_prompt), lambda: template.header(system_prompt))]
+        for msg in history:
+            role, content = msg['role'], msg['content']
+            segments.append(self._cached((template.name, role, content), lambda: template.turn(role, content)))
+        return segments
+
+    def build_chat(self, history, user_message, system_prompt):
+        """Prompt de conversación: cabecera + turnos del historial + último mensaje"""
+        segments = self._history_segments(history, system_prompt)
+        # El último mensaje lleva el contexto RAG de este turno: no se cachea
+        segments.append(_segment(self.template.reply(user_message)))
+        return BuiltPrompt(segments)
+
+    def build_prefix(self, history, system_prompt, partial_message=""):
+        """
+        Lo que ya se conoce del prompt del siguiente turno (cabecera + historial
+        y, si se está escribiendo, el comienzo del mensaje) para precargarlo
+        """
+        segments = self._history_segments(history, system_prompt)
+        if partial_message:
+            segments.append(_segment(self.template.reply_prefix(partial_message)))
+        return BuiltPrompt(segments)
+
+    def build_continuation(self, previous, response, instruction):
+        """
+        Prolonga un prompt ya respondido: prompt anterior + su respuesta + instrucción oculta.
+        Los segmentos anteriores conservan sus tokens, así que la caché KV de la
+        generación anterior sigue valiendo y solo se evalúa lo nuevo.
+        """
+        template = self.template
+        return BuiltPrompt(previous.segments + [
+            _segment(response),
+            _segment(template.end_reply() + template.reply(instruction))
+        ])
+
+    def build_single(self, user_input, system_prompt):
+        """Prompt de una sola petición (generate, resúmenes)"""
+        return BuiltPrompt([_segment(self.template.single(system_prompt, user_input))])
@@ -24,8 +24,10 @@ class RAGEngine:
     
     def load_documents(self):
         """Carga documentos de texto de los directorios configurados (conocimiento Y memoria)"""
-        self.documents = []
-        self.chunks = []
+        # Se construye en listas locales y se sustituye al final para que las
+        # búsquedas concurrentes (p. ej. desde el trabajador de resúmenes) no vean un índice a medias
+        documents = []
+        chunks = []
         
         # Cargar AMBOS: conocimiento y memoria (misma lógica de filtrado por similitud)
         directories = [
@@ -45,7 +47,7 @@ class RAGEngine:
                             content = f.read()
                             if not content.strip(): continue
                             
-                            self.documents.append({
+                            documents.append({
                                 'filename': filename,
                                 'filepath': filepath,
                                 'content': content,
@@ -53,9 +55,12 @@ class RAGEngine:
                             })
                             # Dividir en chunks
                             doc_chunks = self.chunk_text(content, filename, doc_type=doc_type)
-                            self.chunks.extend(doc_chunks)
+                            chunks.extend(doc_chunks)
                     except Exception as e:
                         print(f"Error cargando {filename}: {e}")
+        
+        self.documents = documents
+        self.chunks = chunks
     
     def chunk_text(self, text, source_filename, doc_type='general', chunk_size=CHUNK_SIZE, overlap=100):
         """Divide el texto en fragmentos con solapamiento"""
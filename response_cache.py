@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de Respuestas
+Guarda en SQLite las respuestas de llamadas que se repiten de forma idéntica
+(instrucción de inicio, resúmenes de la misma ventana, preguntas repetidas a baja
+temperatura). Clave: huella del modelo + tipo + parámetros de muestreo + hash del prompt.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from config import RESPONSE_CACHE_FILE, RESPONSE_CACHE_MAX_ENTRIES
+
+_FINGERPRINT_BLOCK = 1024 * 1024
+_fingerprints = {}
+
+
+def model_fingerprint(model_path):
+    """
+    Huella barata del archivo GGUF: tamaño + primer y último MB.
+    Calcular el SHA256 completo de varios GB en cada arranque no compensa.
+    """
+    stat = os.stat(model_path)
+    cache_key = (model_path, stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _fingerprints:
+        digest = hashlib.sha256(str(stat.st_size).encode())
+        with open(model_path, "rb") as f:
+            digest.update(f.read(_FINGERPRINT_BLOCK))
+            if stat.st_size > _FINGERPRINT_BLOCK:
+                f.seek(max(_FINGERPRINT_BLOCK, stat.st_size - _FINGERPRINT_BLOCK))
+                digest.update(f.read(_FINGERPRINT_BLOCK))
+        _fingerprints[cache_key] = digest.hexdigest()
+    return _fingerprints[cache_key]
+
+
+class ResponseCache:
+    """Respuestas cacheadas con expulsión LRU y contadores de aciertos persistentes"""
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                gen_seconds REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(fingerprint, model_type, params, prompt):
+        """Clave exacta: cualquier cambio de modelo, parámetros o prompt da otra entrada"""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        material = json.dumps([fingerprint, model_type, params, prompt_hash], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _bump(self, name, amount):
+        self._conn.execute(
+            "INSERT INTO stats(name, value) VALUES(?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def get(self, key):
+        """Devuelve la respuesta guardada o None (y cuenta el acierto/fallo)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, gen_seconds FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._bump("misses", 1)
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+            self._bump("hits", 1)
+            self._bump("saved_seconds", row[1])
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response, gen_seconds):
+        """Guarda una respuesta completa y expulsa las menos usadas si se supera el límite"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses(key, response, gen_seconds, created_at, last_used) "
+                "VALUES(?, ?, ?, ?, ?)",
+                (key, response, gen_seconds, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("DELETE FROM stats")
+            self._conn.commit()
+
+    def get_stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stats = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+        hits = int(stats.get("hits", 0))
+        misses = int(stats.get("misses", 0))
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'saved_seconds': stats.get("saved_seconds", 0.0)
+        }
@@ -1,7 +1,17 @@
 # -*- coding: utf-8 -*-
 import json
 import os
-from config import BASE_DIR, TEMPERATURE, DEFAULT_MODEL_TYPE
+from config import (
+    BASE_DIR, TEMPERATURE, DEFAULT_MODEL_TYPE,
+    SPECULATIVE_DECODING, SPECULATIVE_DRAFT_TOKENS, PRELOAD_ALTERNATE_MODEL,
+    GENERATION_DEADLINE_SECONDS, GENERATION_TOKEN_BUDGET, INFERENCE_MODE, BATCH_PARALLEL,
+    POOL_WORKERS, MODEL_IDLE_UNLOAD_SECONDS, PROMPT_DISK_CACHE,
+    RESPONSE_CACHE, LLM_BACKEND, ROLLING_SUMMARY, SPECULATIVE_PREFILL,
+    KV_CACHE_BUDGET_MB, KV_CACHE_TYPE_K, KV_CACHE_TYPE_V, FLASH_ATTENTION, CONVERSATION_BACKEND,
+    PERSIST_FSYNC, ARCHIVE_AFTER_DAYS, ARCHIVE_COMPRESSION, PRUNE_EMPTY_CONVERSATIONS,
+    HISTORY_WINDOW_MESSAGES, CONVERSATION_SHARD_CHARS
+)
+from persistence import get_persistence
 
 SETTINGS_FILE = os.path.join(BASE_DIR, "settings.json")
 
@@ -16,9 +26,39 @@ class SettingsManager:
         defaults = {
             "temperature": TEMPERATURE,
             "model_type": DEFAULT_MODEL_TYPE,
-            "similarity_threshold": 0.40
+            "similarity_threshold": 0.40,
+            "speculative_decoding": SPECULATIVE_DECODING,
+            "draft_tokens": SPECULATIVE_DRAFT_TOKENS,
+            "model_ram_budget_mb": None,  # None = automático según la RAM física
+            "preload_alternate_model": PRELOAD_ALTERNATE_MODEL,
+            "generation_deadline_seconds": GENERATION_DEADLINE_SECONDS,
+            "generation_token_budget": GENERATION_TOKEN_BUDGET,
+            "inference_mode": INFERENCE_MODE,
+            "batch_parallel": BATCH_PARALLEL,
+            "pool_workers": POOL_WORKERS,
+            "model_idle_unload_seconds": MODEL_IDLE_UNLOAD_SECONDS,
+            "prompt_disk_cache": PROMPT_DISK_CACHE,
+            "response_cache": RESPONSE_CACHE,
+            "llm_backend": LLM_BACKEND,
+            "fake_backend_profile": {},  # Sobrescribe FAKE_* (first_token_ms, tokens_per_second...)
+            "rolling_summary": ROLLING_SUMMARY,
+            "speculative_prefill": SPECULATIVE_PREFILL,
+            "context_length": None,  # None = automático según metadatos GGUF y kv_cache_budget_mb
+            "kv_cache_budget_mb": KV_CACHE_BUDGET_MB,
+            "kv_cache_type_k": KV_CACHE_TYPE_K,
+            "kv_cache_type_v": KV_CACHE_TYPE_V,
+            "flash_attn": FLASH_ATTENTION,
+            "conversation_backend": CONVERSATION_BACKEND,
+            "conversation_shard_chars": CONVERSATION_SHARD_CHARS,
+            "persist_fsync": PERSIST_FSYNC,
+            "archive_after_days": ARCHIVE_AFTER_DAYS,
+            "archive_compression": ARCHIVE_COMPRESSION,
+            "prune_empty_conversations": PRUNE_EMPTY_CONVERSATIONS,
+            "history_window_messages": HISTORY_WINDOW_MESSAGES
         }
         
+        # Puede haber una versión más nueva esperando en la cola de escritura
+        get_persistence().flush(SETTINGS_FILE)
         if os.path.exists(SETTINGS_FILE):
             try:
                 with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
@@ -31,10 +71,9 @@ class SettingsManager:
         return defaults
     
     def save(self):
-        """Guarda los ajustes actuales en el archivo"""
+        """Guarda los ajustes actuales en el archivo (escritura diferida)"""
         try:
-            with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.settings, f, indent=4)
+            get_persistence().write_json(SETTINGS_FILE, self.settings, indent=4)
         except Exception as e:
             print(f"[ERROR] No se pudo guardar settings.json: {e}")
             
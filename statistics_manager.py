@@ -1,10 +1,29 @@
 # -*- coding: utf-8 -*-
 import json
+import math
 import os
-from config import BASE_DIR
+from config import BASE_DIR, LATENCY_WINDOW
+from persistence import get_persistence
 
 STATISTICS_FILE = os.path.join(BASE_DIR, "statistics.json")
 
+# Métricas de latencia por turno (clave -> etiqueta para la UI)
+LATENCY_METRICS = {
+    "rag_ms": "Búsqueda RAG (ms)",
+    "prompt_tokens": "Tokens del prompt",
+    "prompt_eval_ms": "Evaluación del prompt (ms)",
+    "ttft_ms": "Primer token (ms)",
+    "tokens_per_second": "Generación (tok/s)",
+    "persist_ms": "Guardado (ms)",
+    "followup_ttft_ms": "Continuación: primer token (ms)",
+}
+
+
+def _percentile(sorted_values, fraction):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
 class StatisticsManager:
     """Gestiona la persistencia de estadísticas del uso del chatbot"""
     
@@ -14,9 +33,11 @@ class StatisticsManager:
     def _load_stats(self):
         """Carga estadísticas desde el archivo JSON"""
         defaults = {
-            "total_user_messages": 0
+            "total_user_messages": 0,
+            "latency": {}  # métrica -> últimas LATENCY_WINDOW muestras
         }
         
+        get_persistence().flush(STATISTICS_FILE)
         if os.path.exists(STATISTICS_FILE):
             try:
                 with open(STATISTICS_FILE, "r", encoding="utf-8") as f:
@@ -28,10 +49,9 @@ class StatisticsManager:
         return defaults
     
     def save(self):
-        """Guarda las estadísticas actuales en el archivo"""
+        """Guarda las estadísticas actuales en el archivo (escritura diferida)"""
         try:
-            with open(STATISTICS_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.stats, f, indent=4)
+            get_persistence().write_json(STATISTICS_FILE, self.stats, indent=4)
         except Exception as e:
             print(f"[ERROR] No se pudo guardar statistics.json: {e}")
             
@@ -44,3 +64,28 @@ class StatisticsManager:
         self.stats["total_user_messages"] = self.stats.get("total_user_messages", 0) + 1
         self.save()
         return self.stats["total_user_messages"]
+    
+    def record_latency(self, sample):
+        """Añade las métricas de un turno a sus ventanas deslizantes y guarda"""
+        latency = self.stats.setdefault("latency", {})
+        for metric, value in sample.items():
+            if metric not in LATENCY_METRICS or value is None:
+                continue
+            values = latency.setdefault(metric, [])
+            values.append(round(float(value), 2))
+            del values[:-LATENCY_WINDOW]
+        self.save()
+    
+    def get_latency_percentiles(self):
+        """p50/p95 de cada métrica sobre las últimas muestras"""
+        result = {}
+        for metric, values in self.stats.get("latency", {}).items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            result[metric] = {
+                "p50": _percentile(ordered, 0.50),
+                "p95": _percentile(ordered, 0.95),
+                "count": len(ordered)
+            }
+        return result
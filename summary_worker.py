@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Trabajador de Resúmenes en Segundo Plano
+Genera las memorias fuera del camino crítico de la respuesta
+"""
+
+import os
+import json
+import threading
+from config import BASE_DIR, SUMMARY_IDLE_SECONDS, SUMMARY_MAX_ATTEMPTS
+from generation_control import PREEMPTED_REASON
+
+SUMMARY_JOBS_FILE = os.path.join(BASE_DIR, "summary_jobs.json")
+
+
+class SummaryWorker(threading.Thread):
+    """
+    Cola persistente de resúmenes pendientes.
+    Los trabajos se agrupan por conversación y solo se procesan cuando el modelo
+    lleva un rato ocioso, para no competir con las respuestas al usuario.
+    Dos tipos: "memory" (resumen para la memoria a largo plazo) y "rolling"
+    (turnos que salen del prompt y se pliegan en el resumen acumulado de la conversación).
+    """
+    
+    def __init__(self, chat_engine, jobs_file=SUMMARY_JOBS_FILE, idle_seconds=SUMMARY_IDLE_SECONDS):
+        super().__init__()
+        self.daemon = True
+        self.chat_engine = chat_engine
+        self.jobs_file = jobs_file
+        self.idle_seconds = idle_seconds
+        
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self.jobs = self._load_jobs()
+        
+        if self.jobs:
+            print(f"[DEBUG] {len(self.jobs)} resúmenes pendientes recuperados de la sesión anterior")
+    
+    def _load_jobs(self):
+        """Carga los trabajos pendientes desde disco"""
+        if os.path.exists(self.jobs_file):
+            try:
+                with open(self.jobs_file, "r", encoding="utf-8") as f:
+                    jobs = json.load(f)
+                    # Un trabajo a medias en la sesión anterior vuelve a estar pendiente
+                    for job in jobs:
+                        job["in_progress"] = False
+                    return jobs
+            except Exception as e:
+                print(f"[ERROR] No se pudo cargar summary_jobs.json: {e}")
+        return []
+    
+    def _save_jobs(self):
+        """Guarda los trabajos pendientes (llamar con self._lock adquirido)"""
+        try:
+            tmp_path = self.jobs_file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.jobs, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.jobs_file)
+        except Exception as e:
+            print(f"[ERROR] No se pudo guardar summary_jobs.json: {e}")
+    
+    @staticmethod
+    def _message_key(msg):
+        return (msg.get("role"), msg.get("content"), msg.get("timestamp"))
+    
+    def enqueue(self, conversation_id, messages):
+        """
+        Añade un resumen pendiente.
+        Si ya hay uno sin empezar para la misma conversación, se fusionan sus mensajes.
+        """
+        messages = [
+            {"role": m["role"], "content": m["content"], "timestamp": m.get("timestamp")}
+            for m in messages if "role" in m and "content" in m
+        ]
+        if not messages:
+            return
+        
+        with self._lock:
+            job = next(
+                (j for j in self.jobs if j["conversation_id"] == conversation_id and not j["in_progress"]
+                 and j.get("kind", "memory") == "memory"),
+                None
+            )
+            if job:
+                known = {self._message_key(m) for m in job["messages"]}
+                new_messages = [m for m in messages if self._message_key(m) not in known]
+                job["messages"].extend(new_messages)
+                print(f"[DEBUG] Resumen pendiente fusionado (+{len(new_messages)} mensajes)")
+            else:
+                self.jobs.append({
+                    "conversation_id": conversation_id,
+                    "messages": messages,
+                    "attempts": 0,
+                    "in_progress": False
+                })
+                print(f"[DEBUG] Resumen encolado ({len(messages)} mensajes)")
+            self._save_jobs()
+        
+        self._wakeup.set()
+    
+    def enqueue_rolling(self, conversation_id, messages, covered_from, covered_until):
+        """
+        Añade el plegado de messages (posiciones covered_from..covered_until del historial)
+        en el resumen acumulado. Un plegado pendiente de la misma conversación se amplía.
+        """
+        messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+        with self._lock:
+            job = next(
+                (j for j in self.jobs if j["conversation_id"] == conversation_id and not j["in_progress"]
+                 and j.get("kind") == "rolling"),
+                None
+            )
+            if job and job["covered_from"] == covered_from:
+                if covered_until <= job["covered_until"]:
+                    return
+                job["messages"] = messages
+                job["covered_until"] = covered_until
+                print(f"[DEBUG] Plegado pendiente ampliado ({len(messages)} mensajes)")
+            else:
+                self.jobs.append({
+                    "kind": "rolling",
+                    "conversation_id": conversation_id,
+                    "messages": messages,
+                    "covered_from": covered_from,
+                    "covered_until": covered_until,
+                    "attempts": 0,
+                    "in_progress": False
+                })
+                print(f"[DEBUG] Plegado del historial encolado ({len(messages)} mensajes)")
+            self._save_jobs()
+        
+        self._wakeup.set()
+    
+    def pending_count(self):
+        """Número de resúmenes pendientes"""
+        with self._lock:
+            return len(self.jobs)
+    
+    def stop(self):
+        """Detiene el trabajador (los pendientes quedan guardados en disco)"""
+        self._stop_event.set()
+        self._wakeup.set()
+    
+    def _next_job(self):
+        with self._lock:
+            for job in self.jobs:
+                if not job["in_progress"]:
+                    job["in_progress"] = True
+                    return job
+        return None
+    
+    def _finish_job(self, job, success, preempted=False):
+        with self._lock:
+            job["in_progress"] = False
+            if preempted:
+                return
+            if not success:
+                job["attempts"] += 1
+                if job["attempts"] < SUMMARY_MAX_ATTEMPTS:
+                    self._save_jobs()
+                    return
+                print(f"[ERROR] Resumen descartado tras {job['attempts']} intentos")
+            self.jobs = [j for j in self.jobs if j is not job]
+            self._save_jobs()
+    
+    def run(self):
+        """Bucle principal: espera trabajos y a que el modelo quede ocioso"""
+        while not self._stop_event.is_set():
+            if not self.pending_count():
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            
+            # Prioridad baja: solo cuando el modelo está listo y sin uso reciente
+            if not self.chat_engine.is_ready() or not self.chat_engine.llm.is_idle(self.idle_seconds):
+                self._stop_event.wait(0.5)
+                continue
+            
+            job = self._next_job()
+            if not job:
+                self._stop_event.wait(0.5)
+                continue
+            
+            success = False
+            cancel_token = self.chat_engine.llm.new_cancel_token(background=True)
+            try:
+                print(f"[DEBUG] Generando resumen en segundo plano ({len(job['messages'])} mensajes)...")
+                if job.get("kind") == "rolling":
+                    success = self.chat_engine.fold_rolling_summary(job, cancel_token)
+                else:
+                    success = self.chat_engine.generate_and_save_summary(job["messages"], cancel_token)
+            except Exception as e:
+                print(f"[ERROR] Falló el resumen en segundo plano: {e}")
+            
+            # Si cedió el modelo al usuario, se reintenta más tarde sin contar como fallo
+            self._finish_job(job, success, preempted=cancel_token.reason == PREEMPTED_REASON)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Reparto de Tokens en Streaming
+Agrupa los tokens generados por ventanas de tiempo/tamaño antes de enviarlos
+a la UI o al WebSocket, para no saturar el bucle de Tk ni el socket
+"""
+
+import time
+import threading
+from config import STREAM_FLUSH_MS, STREAM_FLUSH_CHARS
+
+
+class _Sink:
+    """Destino de tokens con su propio búfer y ventana de envío"""
+
+    def __init__(self, callback, interval_ms, max_chars):
+        self.callback = callback
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self.buffer = []
+        self.chars = 0
+        self.deadline = None
+        # Garantiza que los envíos de un mismo destino salen en orden
+        self.emit_lock = threading.Lock()
+
+
+class TokenFanout:
+    """
+    Recibe tokens (usar push como callback de chat_stream) y los reparte
+    entre varios destinos. Cada destino vacía su búfer cuando pasa su
+    ventana de tiempo o cuando acumula max_chars caracteres.
+    """
+
+    def __init__(self):
+        self._sinks = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add_sink(self, callback, interval_ms=STREAM_FLUSH_MS, max_chars=STREAM_FLUSH_CHARS):
+        """Registra un destino con su ventana de envío"""
+        with self._cond:
+            self._sinks.append(_Sink(callback, interval_ms, max_chars))
+        return self
+
+    def push(self, token):
+        """Añade un token a todos los destinos"""
+        if not token:
+            return
+
+        full_sinks = []
+        with self._cond:
+            now = time.monotonic()
+            for sink in self._sinks:
+                sink.buffer.append(token)
+                sink.chars += len(token)
+                if sink.deadline is None:
+                    sink.deadline = now + sink.interval
+                if sink.chars >= sink.max_chars:
+                    full_sinks.append(sink)
+            self._cond.notify()
+
+        # Búfer lleno: se envía ya, sin esperar a la ventana de tiempo
+        for sink in full_sinks:
+            self._flush_sink(sink)
+
+    def flush(self):
+        """Envía todo lo pendiente a todos los destinos"""
+        with self._cond:
+            sinks = list(self._sinks)
+        for sink in sinks:
+            self._flush_sink(sink)
+
+    def close(self):
+        """Envía lo pendiente y detiene el hilo de envío"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _flush_sink(self, sink):
+        with sink.emit_lock:
+            with self._cond:
+                text = "".join(sink.buffer)
+                sink.buffer = []
+                sink.chars = 0
+                sink.deadline = None
+            if text:
+                try:
+                    sink.callback(text)
+                except Exception as e:
+                    print(f"[ERROR] Fallo enviando tokens: {e}")
+
+    def _run(self):
+        """Hilo que vacía los destinos cuya ventana de tiempo ha vencido"""
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+
+                deadlines = [s.deadline for s in self._sinks if s.deadline is not None]
+                if not deadlines:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic()
+                wait = min(deadlines) - now
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                due = [s for s in self._sinks if s.deadline is not None and s.deadline <= now]
+
+            for sink in due:
+                self._flush_sink(sink)
@@ -12,6 +12,9 @@ import threading
 from datetime import datetime
 import random
 from api_server import ChatServer
+from token_stream import TokenFanout
+from statistics_manager import LATENCY_METRICS
+from config import STREAM_UI_FLUSH_MS, STREAM_SOCKET_FLUSH_MS, STREAM_SOCKET_FLUSH_CHARS, PREFILL_DEBOUNCE_MS
 import os
 import re
 
@@ -423,10 +426,18 @@ class ChatWindow(tk.Tk):
         self.chat_engine = chat_engine
         self.chat_engine.on_status_change = self.update_status
         self._initialized = False
+        # Conversaciones largas: solo se pintan los últimos mensajes; el resto, con "Cargar anteriores"
+        self._history_first = 0  # Posición en la conversación de la primera burbuja pintada
+        self._earliest_bubble = None
+        self._load_earlier_frame = None
+        # Token de la respuesta que genera la ventana (el botón Detener solo corta esta)
+        self.generation_token = None
+        self.generation_owner = None  # sid del cliente remoto que envió el turno en curso (None = local)
+        self._typing_after = None  # Precarga pendiente de lo tecleado (after de Tk)
         
         
         # Iniciar servidor API/WebSocket
-        self.server = ChatServer(self.chat_engine, self.handle_remote_message)
+        self.server = ChatServer(self.chat_engine, self.handle_remote_message, self.stop_remote_generation)
         self.server.start()
         
         self.setup_window()
@@ -436,17 +447,23 @@ class ChatWindow(tk.Tk):
         # Mostrar pantalla de carga e inicializar modelo
         self.after(100, self.initialize_model)
 
-    def handle_remote_message(self, message):
+    def handle_remote_message(self, message, sid=None):
         """Maneja mensajes que vienen del móvil (thread-safe)"""
-        self.after(0, lambda: self._process_remote_message(message))
+        self.after(0, lambda: self._process_remote_message(message, sid))
 
-    def _process_remote_message(self, message):
+    def _process_remote_message(self, message, sid=None):
         """Procesa el mensaje remoto en el hilo principal"""
         # Poner en el input y enviar
         self.input_text.delete("1.0", tk.END)
         self.input_text.insert("1.0", message)
         self.input_text.configure(fg=ModernStyle.TEXT_PRIMARY)
-        self.send_message()
+        self.send_message(owner=sid)
+
+    def stop_remote_generation(self, sid):
+        """Detiene la respuesta en curso si la pidió el cliente remoto sid (desde el hilo del servidor)"""
+        if sid is None or sid != self.generation_owner:
+            return False
+        return self.chat_engine.stop_generation(self.generation_token)
     
     def setup_window(self):
         """Configura la ventana principal"""
@@ -562,6 +579,7 @@ class ChatWindow(tk.Tk):
                         pass
                 
                 self.add_message(msg["content"], is_user=(msg["role"] == "user"), timestamp=ts)
+            self._show_load_earlier()
             
             self.status_bar.set_status("Conversación recuperada")
         else:
@@ -954,6 +972,44 @@ class ChatWindow(tk.Tk):
         )
         header_label.pack(anchor=tk.W, pady=(0, 10))
         
+        # Búsqueda en el contenido de todas las conversaciones
+        search_frame = tk.Frame(container, bg=ModernStyle.BG_PRIMARY)
+        search_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        search_label = tk.Label(
+            search_frame,
+            text="🔍",
+            bg=ModernStyle.BG_PRIMARY,
+            fg=ModernStyle.TEXT_SECONDARY,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL)
+        )
+        search_label.pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.history_search_entry = tk.Entry(
+            search_frame,
+            bg=ModernStyle.BG_TERTIARY,
+            fg=ModernStyle.TEXT_PRIMARY,
+            insertbackground=ModernStyle.TEXT_PRIMARY,
+            relief=tk.FLAT,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL)
+        )
+        self.history_search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=5)
+        self.history_search_entry.bind("<KeyRelease>", self.on_history_search_typing)
+        self.history_search_entry.bind("<Escape>", lambda e: self.clear_history_search())
+        self._history_search_job = None
+        
+        clear_search_btn = tk.Button(
+            search_frame,
+            text="✖",
+            bg=ModernStyle.BG_TERTIARY,
+            fg=ModernStyle.BUTTON_TEXT,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_SMALL),
+            relief=tk.FLAT,
+            cursor="hand2",
+            command=self.clear_history_search
+        )
+        clear_search_btn.pack(side=tk.LEFT, padx=(5, 0))
+        
         # Lista (Treeview para columnas)
         tree_frame = tk.Frame(container, bg=ModernStyle.BG_PRIMARY)
         tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -981,7 +1037,7 @@ class ChatWindow(tk.Tk):
             foreground=[('selected', ModernStyle.TEXT_PRIMARY)]
         )
         
-        columns = ("id", "title", "date", "msgs")
+        columns = ("id", "title", "match", "date", "msgs")
         self.history_tree = ttk.Treeview(
             tree_frame, 
             columns=columns, 
@@ -991,11 +1047,13 @@ class ChatWindow(tk.Tk):
         )
         
         self.history_tree.heading("title", text="Título")
+        self.history_tree.heading("match", text="Coincidencia")
         self.history_tree.heading("date", text="Fecha")
         self.history_tree.heading("msgs", text="Msgs")
         
         self.history_tree.column("id", width=0, stretch=False) # Oculto
-        self.history_tree.column("title", width=300)
+        self.history_tree.column("title", width=250)
+        self.history_tree.column("match", width=350)
         self.history_tree.column("date", width=150)
         self.history_tree.column("msgs", width=50, anchor=tk.CENTER)
         
@@ -1110,6 +1168,55 @@ class ChatWindow(tk.Tk):
             fg=ModernStyle.TEXT_MUTED,
             font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_SMALL)
         ).pack(anchor=tk.W)
+        
+        # Desglose de latencia por turno (p50/p95 de los últimos turnos)
+        tk.Label(
+            container,
+            text="⏱️ Latencia por turno",
+            bg=ModernStyle.BG_PRIMARY,
+            fg=ModernStyle.TEXT_PRIMARY,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL, "bold")
+        ).pack(anchor=tk.W, pady=(30, 10))
+        
+        latency_frame = tk.Frame(
+            container,
+            bg=ModernStyle.BG_SECONDARY,
+            padx=20,
+            pady=15
+        )
+        latency_frame.pack(fill=tk.X, padx=10)
+        
+        for column, title in enumerate(("Métrica", "p50", "p95", "Turnos")):
+            tk.Label(
+                latency_frame,
+                text=title,
+                bg=ModernStyle.BG_SECONDARY,
+                fg=ModernStyle.TEXT_SECONDARY,
+                font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_SMALL, "bold")
+            ).grid(row=0, column=column, sticky=tk.W, padx=(0, 25), pady=(0, 5))
+        
+        self.latency_labels = {}
+        for row, (metric, title) in enumerate(LATENCY_METRICS.items(), start=1):
+            tk.Label(
+                latency_frame,
+                text=title,
+                bg=ModernStyle.BG_SECONDARY,
+                fg=ModernStyle.TEXT_PRIMARY,
+                font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL)
+            ).grid(row=row, column=0, sticky=tk.W, padx=(0, 25), pady=2)
+            
+            cells = []
+            for column in range(1, 4):
+                cell = tk.Label(
+                    latency_frame,
+                    text="—",
+                    bg=ModernStyle.BG_SECONDARY,
+                    fg=ModernStyle.ACCENT_PRIMARY,
+                    font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL)
+                )
+                cell.grid(row=row, column=column, sticky=tk.W, padx=(0, 25), pady=2)
+                cells.append(cell)
+            self.latency_labels[metric] = cells
 
     def on_tab_changed(self, event):
         """Manejador de cambio de pestaña"""
@@ -1125,9 +1232,23 @@ class ChatWindow(tk.Tk):
         """Actualiza la interfaz de estadísticas"""
         total = self.chat_engine.stats_manager.get_total_user_messages()
         self.total_messages_label.configure(text=str(total))
+        
+        percentiles = self.chat_engine.stats_manager.get_latency_percentiles()
+        for metric, (p50_label, p95_label, count_label) in self.latency_labels.items():
+            values = percentiles.get(metric)
+            if not values:
+                continue
+            p50_label.configure(text=f"{values['p50']:.0f}" if values['p50'] >= 10 else f"{values['p50']:.1f}")
+            p95_label.configure(text=f"{values['p95']:.0f}" if values['p95'] >= 10 else f"{values['p95']:.1f}")
+            count_label.configure(text=str(values['count']))
 
     def refresh_history_list(self):
-        """Refresca la lista de conversaciones"""
+        """Refresca la lista de conversaciones (o los resultados si hay una búsqueda escrita)"""
+        query = self.history_search_entry.get().strip()
+        if query:
+            self.search_history()
+            return
+        
         # Limpiar
         for item in self.history_tree.get_children():
             self.history_tree.delete(item)
@@ -1136,18 +1257,48 @@ class ChatWindow(tk.Tk):
         conversations = self.chat_engine.list_conversations()
         
         for conv in conversations:
-            # Formatear fecha
-            try:
-                dt = datetime.fromisoformat(conv["updated_at"])
-                date_str = dt.strftime("%d/%m/%Y %H:%M")
-            except:
-                date_str = conv["updated_at"]
-                
             self.history_tree.insert(
                 "", 
                 tk.END, 
-                values=(conv["id"], conv["title"], date_str, conv["message_count"])
+                values=(conv["id"], conv["title"], "", self._format_history_date(conv["updated_at"]), conv["message_count"])
             )
+    
+    def _format_history_date(self, value):
+        try:
+            dt = datetime.fromisoformat(value)
+            return dt.strftime("%d/%m/%Y %H:%M")
+        except:
+            return value
+    
+    def on_history_search_typing(self, event):
+        """Busca al dejar de escribir (300 ms)"""
+        if self._history_search_job:
+            self.after_cancel(self._history_search_job)
+        self._history_search_job = self.after(300, self.refresh_history_list)
+    
+    def search_history(self):
+        """Muestra las conversaciones cuyo contenido coincide con la búsqueda"""
+        self._history_search_job = None
+        query = self.history_search_entry.get().strip()
+        results = self.chat_engine.search_conversations(query)
+        
+        for item in self.history_tree.get_children():
+            self.history_tree.delete(item)
+        
+        for result in results:
+            # El fragmento llega con la coincidencia entre « »; en una fila no caben saltos de línea
+            snippet = " ".join(result["snippet"].split())
+            self.history_tree.insert(
+                "",
+                tk.END,
+                values=(result["id"], result["title"], snippet,
+                        self._format_history_date(result["updated_at"]), result["matches"])
+            )
+        self.status_bar.set_status(f"{len(results)} conversaciones encontradas")
+    
+    def clear_history_search(self):
+        self.history_search_entry.delete(0, tk.END)
+        self.refresh_history_list()
 
     def load_selected_conversation(self):
         """Carga la conversación seleccionada"""
@@ -1169,6 +1320,7 @@ class ChatWindow(tk.Tk):
             # Repoblar mensajes
             for msg in self.chat_engine.conversation_history:
                 self.add_message(msg["content"], is_user=(msg["role"] == "user"))
+            self._show_load_earlier()
             
             # Volver a pestaña de chat
             self.notebook.select(self.chat_tab)
@@ -1176,6 +1328,61 @@ class ChatWindow(tk.Tk):
         else:
             messagebox.showerror("Error", "No se pudo cargar la conversación.")
 
+    def _show_load_earlier(self):
+        """Tras pintar el historial: botón para los mensajes que no están en memoria"""
+        self._history_first = self.chat_engine.conversation_history.offset
+        bubbles = [w for w in self.messages_frame.winfo_children() if isinstance(w, ChatBubble)]
+        self._earliest_bubble = bubbles[0] if bubbles else None
+        self._update_load_earlier_button()
+
+    def _update_load_earlier_button(self):
+        if self._load_earlier_frame is not None:
+            self._load_earlier_frame.destroy()
+            self._load_earlier_frame = None
+        if self._history_first <= 0 or self._earliest_bubble is None or not self._earliest_bubble.winfo_exists():
+            return
+        
+        self._load_earlier_frame = tk.Frame(self.messages_frame, bg=ModernStyle.BG_PRIMARY)
+        self._load_earlier_frame.pack(fill=tk.X, pady=5, before=self._earliest_bubble)
+        tk.Button(
+            self._load_earlier_frame,
+            text=f"⬆️ Cargar mensajes anteriores ({self._history_first})",
+            bg=ModernStyle.BG_TERTIARY,
+            fg=ModernStyle.BUTTON_TEXT,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_SMALL),
+            relief=tk.FLAT,
+            cursor="hand2",
+            command=self.load_earlier_messages
+        ).pack()
+
+    def load_earlier_messages(self):
+        """Pinta encima la página anterior de mensajes (se leen del almacén)"""
+        start, messages = self.chat_engine.load_earlier_messages(self._history_first)
+        self.messages_frame.update_idletasks()
+        old_height = self.messages_frame.winfo_height()
+        
+        first = None
+        for msg in messages:
+            ts = None
+            if msg.get("timestamp"):
+                try:
+                    ts = datetime.fromisoformat(msg["timestamp"]).strftime("%H:%M")
+                except ValueError:
+                    pass
+            bubble = ChatBubble(self.messages_frame, msg["content"], is_user=(msg["role"] == "user"), timestamp=ts)
+            bubble.pack(fill=tk.X, before=self._earliest_bubble)
+            first = first or bubble
+        
+        self._history_first = start
+        self._earliest_bubble = first or self._earliest_bubble
+        self._update_load_earlier_button()
+        
+        # Mantener a la vista el mensaje que estaba arriba
+        self.messages_frame.update_idletasks()
+        new_height = self.messages_frame.winfo_height()
+        if new_height > 0:
+            self.chat_canvas.yview_moveto((new_height - old_height) / new_height)
+
     def delete_selected_conversation(self):
         """Elimina la conversación seleccionada"""
         selected_item = self.history_tree.selection()
@@ -1240,6 +1447,21 @@ class ChatWindow(tk.Tk):
         )
         self.send_button.pack(side=tk.RIGHT, padx=10, pady=5)
         
+        # Botón detener (corta la generación en curso)
+        self.stop_button = tk.Button(
+            input_frame,
+            text="⏹ Detener",
+            bg=ModernStyle.BG_SECONDARY,
+            fg=ModernStyle.BUTTON_TEXT,
+            font=(ModernStyle.FONT_FAMILY, ModernStyle.FONT_SIZE_NORMAL),
+            relief=tk.FLAT,
+            cursor="hand2",
+            padx=10,
+            pady=10,
+            command=self.stop_generation
+        )
+        self.stop_button.pack(side=tk.RIGHT, pady=5)
+        
         # Hover effect
         self.send_button.bind("<Enter>", lambda e: self.send_button.configure(bg=ModernStyle.ACCENT_SECONDARY))
         self.send_button.bind("<Leave>", lambda e: self.send_button.configure(bg=ModernStyle.ACCENT_PRIMARY))
@@ -1253,6 +1475,14 @@ class ChatWindow(tk.Tk):
         # Focus events para placeholder
         self.input_text.bind("<FocusIn>", self.on_input_focus_in)
         self.input_text.bind("<FocusOut>", self.on_input_focus_out)
+        
+        # Precarga de lo que se va escribiendo (agrupada: solo tras una pausa)
+        self.input_text.bind("<KeyRelease>", self.on_input_typing)
+    
+    def stop_generation(self):
+        """Detiene la respuesta que se está generando en esta ventana"""
+        if self.chat_engine.stop_generation(self.generation_token):
+            self.status_bar.set_status("Respuesta detenida")
     
     def on_enter_press(self, event):
         """Maneja el evento Enter"""
@@ -1266,6 +1496,20 @@ class ChatWindow(tk.Tk):
             self.input_text.delete("1.0", tk.END)
             self.input_text.configure(fg=ModernStyle.TEXT_PRIMARY)
     
+    def on_input_typing(self, event):
+        """Precarga en la caché KV el mensaje a medio escribir (tras una pausa al teclear)"""
+        if not self._initialized:
+            return
+        if self._typing_after is not None:
+            self.after_cancel(self._typing_after)
+        self._typing_after = self.after(PREFILL_DEBOUNCE_MS, self._prefill_typed)
+    
+    def _prefill_typed(self):
+        self._typing_after = None
+        text = self.input_text.get("1.0", tk.END).strip()
+        if text and text != self.input_placeholder:
+            self.chat_engine.prefill_next_turn(partial_message=text)
+    
     def on_input_focus_out(self, event):
         """Al desenfocar el input"""
         if not self.input_text.get("1.0", tk.END).strip():
@@ -1343,8 +1587,8 @@ class ChatWindow(tk.Tk):
         )
         label.pack()
     
-    def send_message(self):
-        """Envía un mensaje"""
+    def send_message(self, owner=None):
+        """Envía un mensaje (owner: sid del cliente remoto que lo escribió)"""
         if not self._initialized:
             return
         
@@ -1352,6 +1596,7 @@ class ChatWindow(tk.Tk):
         
         if not message or message == self.input_placeholder:
             return
+        self.generation_owner = owner
         
         # Limpiar input
         self.input_text.delete("1.0", tk.END)
@@ -1379,11 +1624,15 @@ class ChatWindow(tk.Tk):
     def process_message_streaming(self, message):
         """Procesa el mensaje con streaming token por token"""
         try:
+            import time
+            turn_start = time.perf_counter()
+            
             # Preparar contexto primero
             self.after(0, lambda: self.status_bar.set_status("Buscando contexto..."))
             
             # Obtener contexto RAG (ahora incluye tanto conocimiento como memoria, ambos filtrados por similitud >= 50%)
             rag_context, similarity = self.chat_engine.rag.get_context(message)
+            rag_seconds = time.perf_counter() - turn_start
             self.has_context_flag = rag_context is not None
             
             # Actualizar label de similitud
@@ -1400,7 +1649,9 @@ class ChatWindow(tk.Tk):
                 "role": "user",
                 "content": message
             })
+            persist_start = time.perf_counter()
             self.chat_engine.conversation_manager.save_message("user", message)
+            persist_seconds = time.perf_counter() - persist_start
             
             self.after(0, lambda: self.create_streaming_bubble())
             
@@ -1408,34 +1659,49 @@ class ChatWindow(tk.Tk):
             self.server.broadcast_message("user", message)
             
             # Pequeña pausa para que se cree la burbuja
-            import time
             time.sleep(0.1)
             
             self.after(0, lambda: self.status_bar.set_status("Generando respuesta..."))
 
             
-            # Callback para tokens
+            first_token_at = []
+            
             def on_token(token):
-                # Broadcast token al móvil
-                self.server.broadcast_token(token)
-                self.after(0, lambda t=token: self.append_streaming_token(t))
-
+                if not first_token_at:
+                    first_token_at.append(time.perf_counter())
+                token_stream.push(token)
             
             # Generar respuesta con streaming
             # Ya NO pasamos memorias por separado - todo pasa por RAG con filtro del 50%
-            response = self.chat_engine.llm.chat_stream(
-                self.chat_engine.conversation_history,
-                system_context="",  # Sin contexto de sistema separado
-                user_context=rag_context if rag_context else "",  # Solo RAG filtrado
-                callback=on_token
-            )
+            # Turnos antiguos plegados en el resumen acumulado (ver ChatEngine.chat_context)
+            messages, summary = self.chat_engine.chat_context()
+            cancel_token = self.generation_token = self.chat_engine.llm.new_cancel_token()
+            # Tokens agrupados por ventanas hacia la burbuja y hacia el móvil
+            token_stream = self.create_token_stream(broadcast=True)
+            try:
+                response = self.chat_engine.llm.chat_stream(
+                    messages,
+                    system_context="",  # Sin contexto de sistema separado
+                    user_context=rag_context if rag_context else "",  # Solo RAG filtrado
+                    callback=on_token,
+                    cancel_token=cancel_token,
+                    summary=summary
+                )
+            finally:
+                token_stream.close()
             
             # Añadir respuesta al historial
             self.chat_engine.conversation_history.append({
                 "role": "assistant",
                 "content": response
             })
+            persist_start = time.perf_counter()
             self.chat_engine.conversation_manager.save_message("assistant", response)
+            persist_seconds += time.perf_counter() - persist_start
+            
+            # Desglose de latencia del turno (RAG, prompt, primer token, generación, guardado)
+            ttft_seconds = first_token_at[0] - turn_start if first_token_at else None
+            self.chat_engine.record_turn_latency(rag_seconds, ttft_seconds, persist_seconds)
             
             # Broadcast respuesta completa del asistente
             self.server.broadcast_message("assistant", response)
@@ -1444,17 +1710,18 @@ class ChatWindow(tk.Tk):
             # Incrementar contador
             self.chat_engine.message_count += 1
             
-            # Verificar si toca resumen
+            # Verificar si toca resumen (se genera en segundo plano cuando el modelo queda libre)
             if self.chat_engine.should_generate_summary():
-                self.after(0, lambda: self.status_bar.set_status("Generando resumen..."))
-                self.chat_engine.generate_and_save_summary()
+                self.chat_engine.schedule_summary()
+            self.chat_engine.schedule_compression()
             
             # Finalizar la primera respuesta
             self.after(0, self.finish_streaming)
 
             # --- LÓGICA DE CONTINUACIÓN ALEATORIA (25% de probabilidad) ---
-            # Solo si no es ya una continuación para evitar bucles
-            if random.random() < 0.25:
+            # Solo si no es ya una continuación para evitar bucles, ni si el usuario la ha detenido
+            if (random.random() < 0.25 and not cancel_token.reason
+                    and self.chat_engine.llm.can_continue()):
                 # Pequeña pausa natural antes de la segunda respuesta
                 time.sleep(1.5)
                 
@@ -1467,24 +1734,32 @@ class ChatWindow(tk.Tk):
                 # Feedback visual en consola
                 print("[DEBUG] Aurora ha decidido continuar la conversación (25% azar)")
                 
-                # Prompt interno para forzar continuación sin que el usuario lo vea
-                # Pasamos la primera respuesta como contexto para que el modelo sepa qué acaba de decir
-                # Y usamos el historial HASTA el mensaje del usuario (history[:-1]) para evitar que crea que es un nuevo turno de respuesta
-                continuation_instruction = f"(Sientes que te has quedado con ganas de decir algo más tras tu respuesta anterior: '{response}'. Continúa tu pensamiento de forma espontánea y natural, añadiendo algún detalle o reflexión extra sin repetirte.)"
-                
-                # Mantener el contexto RAG original si existía
-                full_continuation_context = continuation_instruction
-                if rag_context:
-                    full_continuation_context = f"{rag_context}\n\n{continuation_instruction}"
+                # Instrucción interna para forzar continuación sin que el usuario la vea.
+                # Se añade tras el prompt y la respuesta que se acaban de generar (contexto RAG
+                # incluido): la caché KV ya los contiene y solo se evalúa la instrucción
+                continuation_instruction = "(Sientes que te has quedado con ganas de decir algo más tras tu respuesta anterior. Continúa tu pensamiento de forma espontánea y natural, añadiendo algún detalle o reflexión extra sin repetirte.)"
                 
                 # Generar segunda respuesta
-                # IMPORTANTE: Usamos el historial SIN la primera respuesta para que no se "responda" a sí misma
-                follow_up_response = self.chat_engine.llm.chat_stream(
-                    self.chat_engine.conversation_history[:-1], 
-                    system_context="",
-                    user_context=full_continuation_context,
-                    callback=on_token
-                )
+                cancel_token = self.generation_token = self.chat_engine.llm.new_cancel_token()
+                token_stream = self.create_token_stream(broadcast=True)
+                follow_up_start = time.perf_counter()
+                follow_up_first = []
+                
+                def on_follow_up_token(token):
+                    if not follow_up_first:
+                        follow_up_first.append(time.perf_counter())
+                    token_stream.push(token)
+                
+                try:
+                    follow_up_response = self.chat_engine.llm.continue_stream(
+                        continuation_instruction,
+                        callback=on_follow_up_token,
+                        cancel_token=cancel_token
+                    )
+                finally:
+                    token_stream.close()
+                if follow_up_first:
+                    self.chat_engine.record_followup_latency(follow_up_first[0] - follow_up_start)
                 
                 # Añadir segunda respuesta al historial
                 self.chat_engine.conversation_history.append({
@@ -1498,6 +1773,9 @@ class ChatWindow(tk.Tk):
                 # Finalizar la segunda respuesta
                 self.after(0, self.finish_streaming)
             # ------------------------------------------------------------
+            
+            # Mientras el usuario lee la respuesta, evaluar el prompt del siguiente turno
+            self.chat_engine.prefill_next_turn()
 
         except Exception as e:
             error_msg = str(e)
@@ -1506,6 +1784,21 @@ class ChatWindow(tk.Tk):
                 self.server.broadcast_error(error_msg)
             self.after(0, lambda: self.show_error(error_msg))
     
+    def create_token_stream(self, broadcast=False):
+        """Crea el reparto de tokens hacia la burbuja de streaming (y el móvil si broadcast)"""
+        token_stream = TokenFanout()
+        token_stream.add_sink(
+            lambda text: self.after(0, lambda t=text: self.append_streaming_token(t)),
+            interval_ms=STREAM_UI_FLUSH_MS
+        )
+        if broadcast:
+            token_stream.add_sink(
+                self.server.broadcast_token,
+                interval_ms=STREAM_SOCKET_FLUSH_MS,
+                max_chars=STREAM_SOCKET_FLUSH_CHARS
+            )
+        return token_stream
+    
     def create_streaming_bubble(self):
         """Crea la burbuja de streaming"""
         self.streaming_bubble = StreamingBubble(
@@ -1583,7 +1876,8 @@ class ChatWindow(tk.Tk):
     def process_message(self, message):
         """Procesa el mensaje (versión no-streaming, backup)"""
         try:
-            response, has_context, similarity = self.chat_engine.process_message(message)
+            cancel_token = self.generation_token = self.chat_engine.llm.new_cancel_token()
+            response, has_context, similarity = self.chat_engine.process_message(message, cancel_token=cancel_token)
             self.after(0, lambda: self.update_similarity_label(similarity))
             self.after(0, lambda: self.show_response(response, has_context))
         except Exception as e:
@@ -1652,6 +1946,9 @@ class ChatWindow(tk.Tk):
         # Limpiar widgets
         for widget in self.messages_frame.winfo_children():
             widget.destroy()
+        self._history_first = 0
+        self._earliest_bubble = None
+        self._load_earlier_frame = None
         
         # Iniciar nueva conversación en el engine
         if create_new:
@@ -1799,13 +2096,10 @@ class ChatWindow(tk.Tk):
             import time
             time.sleep(0.5)
             
-            # Callback para tokens
-            def on_token(token):
-                self.after(0, lambda t=token: self.append_streaming_token(t))
-            
             # Instrucción oculta para forzar el inicio
             # Creamos un historial temporal solo para esta llamada
-            temp_history = self.chat_engine.conversation_history.copy()
+            messages, summary = self.chat_engine.chat_context()
+            temp_history = list(messages)
             start_instruction = "(El usuario está esperando. Toma la iniciativa, salúdale con naturalidad y propón un tema o simplemente muestra interés por cómo está. Sé breve y directa.)"
             
             temp_history.append({
@@ -1814,12 +2108,22 @@ class ChatWindow(tk.Tk):
             })
             
             # Generar respuesta
-            response = self.chat_engine.llm.chat_stream(
-                temp_history,
-                system_context="",  # Sin contexto extra por ahora
-                user_context="",    # Sin RAG para el saludo inicial
-                callback=on_token
-            )
+            self.generation_owner = None  # Turno iniciado por la propia ventana
+            cancel_token = self.generation_token = self.chat_engine.llm.new_cancel_token()
+            # Tokens agrupados hacia la burbuja
+            token_stream = self.create_token_stream()
+            try:
+                response = self.chat_engine.llm.chat_stream(
+                    temp_history,
+                    system_context="",  # Sin contexto extra por ahora
+                    user_context="",    # Sin RAG para el saludo inicial
+                    callback=token_stream.push,
+                    cancel_token=cancel_token,
+                    cacheable=True,     # Instrucción fija: se repite con el mismo historial
+                    summary=summary
+                )
+            finally:
+                token_stream.close()
             
             # Añadir respuesta al historial REAL (sin la instrucción oculta)
             self.chat_engine.conversation_history.append({
@@ -1833,6 +2137,7 @@ class ChatWindow(tk.Tk):
             # Finalizar
             self.chat_engine.message_count += 1
             self.after(0, self.finish_streaming)
+            self.chat_engine.prefill_next_turn()
             
         except Exception as e:
             error_msg = str(e)
@@ -1923,20 +2228,28 @@ class ChatWindow(tk.Tk):
             
             full_prompt = f"Conversación reciente:\n{history_context}\n\nInstrucción: {system_prompt}\n\nTu respuesta:"
             
-            # Función para actualizar el input con streaming
-            def on_token(token):
-                self.after(0, lambda t=token: self.append_input_token(t))
+            self.generation_owner = None  # Turno iniciado por la propia ventana
+            cancel_token = self.generation_token = self.chat_engine.llm.new_cancel_token()
+            # Actualizar el input con streaming (agrupado por ventanas)
+            token_stream = TokenFanout().add_sink(
+                lambda text: self.after(0, lambda t=text: self.append_input_token(t)),
+                interval_ms=STREAM_UI_FLUSH_MS
+            )
             
             # Usar generate_stream del cliente LLM directamente (bypass chat engine standard flow)
             # Usamos un truco: llamar a generate_stream del llm con un prompt custom
             # Nota: Esto usa el modelo cargado actualmente
             
-            self.chat_engine.llm.generate_stream(
-                prompt=full_prompt, 
-                context="", 
-                system_prompt=system_prompt,
-                callback=on_token
-            )
+            try:
+                self.chat_engine.llm.generate_stream(
+                    prompt=full_prompt, 
+                    context="", 
+                    system_prompt=system_prompt,
+                    callback=token_stream.push,
+                    cancel_token=cancel_token
+                )
+            finally:
+                token_stream.close()
             
             # Al finalizar, enviar mensaje
             self.after(0, self.finish_simulation_and_send)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Script de verificación para el almacén de conversaciones.
+Trabaja sobre un directorio temporal (nunca toca conversaciones/) y prueba el
+diario (reproducción, reparación de líneas cortadas, entradas duplicadas tras
+una compactación interrumpida), el orden de la cola de escritura, el archivado,
+la migración a subdirectorios por prefijo y la exportación/importación JSONL.
+"""
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+
+import persistence
+import conversation_manager
+from conversation_manager import ConversationManager
+from conversation_tools import export_conversations, import_conversations
+
+
+def new_manager(directory, shard_chars=0):
+    """Gestor JSON sobre directory (con shard_chars el constructor migra a subdirectorios)"""
+    conversation_manager.CONVERSATIONS_DIR = directory
+    return ConversationManager(shard_chars=shard_chars)
+
+
+def contents(data):
+    return [(m["role"], m["content"]) for m in data["messages"]]
+
+
+def write_conversation(manager, count):
+    """Conversación nueva con count mensajes (alternando usuario/asistente)"""
+    manager.create_conversation()
+    for i in range(count):
+        manager.save_message("user" if i % 2 == 0 else "assistant", f"mensaje {i}")
+    return manager.current_conversation_id
+
+
+def test_journal_replay(directory):
+    print("Testing journal replay...")
+    manager = new_manager(directory)
+    conversation_id = write_conversation(manager, 5)
+    persistence.get_persistence().flush()
+
+    journal_path = manager._journal_path(conversation_id)
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    # El primer mensaje escribe la instantánea; el resto va al diario
+    assert len(lines) == 4, f"Expected 4 journal entries, got {len(lines)}"
+
+    data = new_manager(directory).load_conversation(conversation_id)
+    assert contents(data) == contents(manager.current_conversation_data), "Replayed messages differ"
+    assert data["journal_seq"] == 4, f"Expected journal_seq 4, got {data['journal_seq']}"
+    return conversation_id
+
+
+def test_torn_line_repair(directory, conversation_id):
+    print("Testing torn-line repair...")
+    manager = new_manager(directory)
+    journal_path = manager._journal_path(conversation_id)
+    with open(journal_path, "rb") as f:
+        intact = f.read()
+
+    # Corte a mitad de una línea: se descarta y el diario se trunca
+    with open(journal_path, "ab") as f:
+        f.write(b'{"messages": [{"role": "user", "con')
+    data = manager.load_conversation(conversation_id)
+    assert len(data["messages"]) == 5, f"Expected 5 messages, got {len(data['messages'])}"
+    with open(journal_path, "rb") as f:
+        assert f.read() == intact, "Torn line was not truncated"
+
+    # Línea completa sin salto de línea: se conserva y se le añade
+    with open(journal_path, "wb") as f:
+        f.write(intact.rstrip(b"\n"))
+    data = manager.load_conversation(conversation_id)
+    assert len(data["messages"]) == 5, f"Expected 5 messages, got {len(data['messages'])}"
+    with open(journal_path, "rb") as f:
+        assert f.read() == intact, "Missing newline was not repaired"
+
+    # Después de reparar, lo siguiente se añade en una línea propia
+    manager.save_message("user", "tras la reparación")
+    persistence.get_persistence().flush()
+    data = new_manager(directory).load_conversation(conversation_id)
+    assert contents(data)[-1] == ("user", "tras la reparación"), "Entry after repair was lost"
+
+
+def test_write_behind_order_and_seq_dedup(directory):
+    print("Testing write-behind ordering and seq de-duplication...")
+    service = persistence.get_persistence()
+    manager = new_manager(directory)
+    conversation_id = write_conversation(manager, 1)
+    service.flush()
+
+    # Entradas del diario aún en la cola cuando llega la compactación
+    manager.save_message("assistant", "pendiente 1")
+    manager.save_message("user", "pendiente 2")
+    snapshot_path = manager._snapshot_path(conversation_id)
+    journal_path = manager._journal_path(conversation_id)
+    assert service.has_pending(journal_path), "Journal entries should still be queued"
+    manager._save_to_disk()
+
+    with service._cond:
+        order = list(service._pending)
+    assert order.index(snapshot_path) < order.index(journal_path), \
+        "Snapshot must be written before the journal is emptied"
+
+    # Corte entre la instantánea y el vaciado del diario: el diario antiguo sigue en disco
+    old_journal = open(journal_path, "rb").read() if os.path.exists(journal_path) else b""
+    stale = old_journal + b"".join(
+        (json.dumps({"messages": [m], "seq": seq}, ensure_ascii=False) + "\n").encode("utf-8")
+        for seq, m in enumerate(manager.current_conversation_data["messages"][1:], 1)
+    )
+    service.flush(snapshot_path)
+    service.discard(journal_path)
+    with open(journal_path, "wb") as f:
+        f.write(stale)
+
+    data = new_manager(directory).load_conversation(conversation_id)
+    assert len(data["messages"]) == 3, f"Expected 3 messages (no duplicates), got {len(data['messages'])}"
+    assert contents(data)[-1] == ("user", "pendiente 2"), "Unexpected last message"
+
+
+def test_archive_round_trip(directory):
+    print("Testing archive/unarchive round-trip...")
+    manager = new_manager(directory)
+    conversation_id = write_conversation(manager, 4)
+    manager.create_conversation()  # La actual no se archiva
+    persistence.get_persistence().flush()
+    expected = contents(manager._read(conversation_id))
+
+    old = time.time() - 10 * 86400
+    for path in (manager._snapshot_path(conversation_id), manager._journal_path(conversation_id)):
+        if os.path.exists(path):
+            os.utime(path, (old, old))
+    report = manager.archive_conversations(1, compression="gzip")
+    assert report["archived"] >= 1, f"Expected an archived conversation, got {report}"
+    assert manager._archive_path(conversation_id), "Archive file missing"
+    assert not os.path.exists(manager._snapshot_path(conversation_id)), "Snapshot should be removed"
+
+    reader = new_manager(directory)
+    data = reader.load_conversation(conversation_id)
+    assert contents(data) == expected, "Archived conversation differs"
+
+    # Al modificarla vuelve a escribirse en claro
+    reader.save_message("user", "de vuelta")
+    persistence.get_persistence().flush()
+    assert reader._archive_path(conversation_id) is None, "Archive should be removed after unarchiving"
+    data = new_manager(directory).load_conversation(conversation_id)
+    assert contents(data) == expected + [("user", "de vuelta")], "Unarchived conversation differs"
+
+
+def test_shard_migration(directory):
+    print("Testing shard migration...")
+    os.makedirs(directory)
+    conversation_id = "ab12-flat"
+    snapshot = {
+        "id": conversation_id, "title": "Suelta", "created_at": "2024-01-01T00:00:00",
+        "updated_at": "2024-01-01T00:00:00", "journal_seq": 0,
+        "messages": [{"role": "user", "content": "hola"}]
+    }
+    with open(os.path.join(directory, f"{conversation_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    with open(os.path.join(directory, f"{conversation_id}.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"messages": [{"role": "assistant", "content": "qué tal"}], "seq": 1}) + "\n")
+    with open(os.path.join(directory, "_index.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": 0}, f)
+
+    # Sin sharding (por defecto) no se mueve nada
+    manager = new_manager(directory)
+    assert manager.conversation_ids() == {conversation_id}, "Unexpected conversation ids"
+    assert os.path.exists(os.path.join(directory, f"{conversation_id}.json")), "Flat file must stay in place"
+
+    manager = new_manager(directory, shard_chars=2)
+    shard = os.path.join(directory, conversation_id[:2])
+    assert sorted(os.listdir(shard)) == [f"{conversation_id}.json", f"{conversation_id}.jsonl"], \
+        f"Files not moved to {shard}"
+    assert os.path.exists(os.path.join(directory, "_index.json")), "_index.json must stay in place"
+    assert manager.conversation_ids() == {conversation_id}, "Unexpected conversation ids"
+    data = manager.load_conversation(conversation_id)
+    assert contents(data) == [("user", "hola"), ("assistant", "qué tal")], "Migrated conversation differs"
+
+
+def test_export_import(source_dir, target_dir):
+    print("Testing export/import...")
+    source = new_manager(source_dir)
+    source.create_conversation()
+    persistence.get_persistence().flush()
+    out = io.StringIO()
+    report = export_conversations(source, out, workers=2)
+    ids = source.conversation_ids()
+    assert report["conversations"] == len(ids) and report["errors"] == 0, f"Unexpected export report {report}"
+    exported = {json.loads(line)["id"]: json.loads(line) for line in out.getvalue().splitlines()}
+    assert set(exported) == ids, "Exported ids differ"
+
+    target = new_manager(target_dir)
+    lines = out.getvalue().splitlines() + ['{"id": "malo", "messages": ["hola", 3]}', "no es json"]
+    report = import_conversations(target, lines)
+    assert report["imported"] == len(ids), f"Expected {len(ids)} imported, got {report}"
+    assert report["errors"] == 2, f"Expected 2 errors, got {report}"
+    for conversation_id, data in exported.items():
+        assert target.export_conversation(conversation_id) == data, f"{conversation_id} differs after import"
+
+    report = import_conversations(target, out.getvalue().splitlines())
+    assert report["imported"] == 0 and report["skipped"] == len(ids), f"Expected all skipped, got {report}"
+    assert len(target.list_conversations()) == len(ids), "Listing does not match imported conversations"
+
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp(prefix="verify_conversations_")
+    original_dir = conversation_manager.CONVERSATIONS_DIR
+    try:
+        main_dir = os.path.join(workdir, "conversaciones")
+        os.makedirs(main_dir)
+        conversation_id = test_journal_replay(main_dir)
+        test_torn_line_repair(main_dir, conversation_id)
+        test_write_behind_order_and_seq_dedup(main_dir)
+        test_archive_round_trip(main_dir)
+        test_shard_migration(os.path.join(workdir, "planas"))
+        test_export_import(main_dir, os.path.join(workdir, "importadas"))
+        print("✅ Conversation Storage Verified Successfully!")
+    except AssertionError as e:
+        print(f"❌ Verification Failed: {e}")
+    except Exception as e:
+        print(f"❌ An error occurred: {e}")
+    finally:
+        persistence.get_persistence().flush()
+        conversation_manager.CONVERSATIONS_DIR = original_dir
+        shutil.rmtree(workdir, ignore_errors=True)
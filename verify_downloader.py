@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Script de verificación para el descargador de modelos.
+Levanta un servidor HTTP local que imita a HuggingFace (Range, redirección
+con X-Linked-Etag) y prueba descarga paralela, reanudación y verificación SHA256.
+"""
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from model_downloader import ModelDownloader
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """'/resolve/model.gguf' redirige a '/cdn/model.gguf', que sirve el archivo con rangos"""
+    supports_ranges = True
+    throttle = 0
+    range_requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _redirect(self):
+        self.send_response(302)
+        self.send_header("Location", "/cdn/model.gguf")
+        self.send_header("X-Linked-Etag", f'"{PAYLOAD_SHA256}"')
+        self.end_headers()
+
+    def _serve(self, send_body):
+        start, end = 0, len(PAYLOAD) - 1
+        range_header = self.headers.get("Range")
+        match = re.match(r"bytes=(\d+)-(\d*)", range_header or "")
+        if match and self.supports_ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            StandInHandler.range_requests.append((start, end))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        if self.supports_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        if send_body:
+            for pos in range(start, end + 1, 64 * 1024):
+                try:
+                    self.wfile.write(PAYLOAD[pos:min(pos + 64 * 1024, end + 1)])
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                if self.throttle:
+                    time.sleep(self.throttle)
+
+    def do_HEAD(self):
+        if self.path.startswith("/resolve/"):
+            self._redirect()
+        else:
+            self._serve(send_body=False)
+
+    def do_GET(self):
+        if self.path.startswith("/resolve/"):
+            self._redirect()
+        else:
+            self._serve(send_body=True)
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/resolve/model.gguf"
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_parallel_download(url, tmp_dir):
+    print("Test 1: descarga paralela verificada con X-Linked-Etag...")
+    dest = os.path.join(tmp_dir, "parallel.gguf")
+    StandInHandler.range_requests = []
+    assert ModelDownloader(url, dest, connections=4, progress_callback=lambda *a: None).download()
+    assert read_file(dest) == PAYLOAD, "Contenido distinto"
+    assert len(StandInHandler.range_requests) == 4, f"Esperados 4 rangos, hubo {StandInHandler.range_requests}"
+    assert not os.path.exists(dest + ".part")
+
+
+def test_resume(url, tmp_dir):
+    print("Test 2: reanudación tras interrupción...")
+    dest = os.path.join(tmp_dir, "resume.gguf")
+    StandInHandler.throttle = 0.01
+    downloader = ModelDownloader(url, dest, connections=2, progress_callback=lambda *a: None)
+
+    def cancel_when_started(percent, downloaded, total):
+        if percent > 20:
+            downloader.cancel()
+    downloader.progress_callback = cancel_when_started
+    assert not downloader.download(), "La descarga debía quedar interrumpida"
+    assert os.path.exists(dest + ".part") and not os.path.exists(dest)
+
+    StandInHandler.throttle = 0
+    StandInHandler.range_requests = []
+    assert ModelDownloader(url, dest, connections=2, progress_callback=lambda *a: None).download()
+    assert read_file(dest) == PAYLOAD, "Contenido distinto tras reanudar"
+    assert any(start not in (0, len(PAYLOAD) // 2 + 1) for start, _ in StandInHandler.range_requests), \
+        f"No se reanudó desde la mitad de un rango: {StandInHandler.range_requests}"
+
+
+def test_bad_hash(url, tmp_dir):
+    print("Test 3: SHA256 incorrecto del manifiesto...")
+    dest = os.path.join(tmp_dir, "bad.gguf")
+    assert not ModelDownloader(url, dest, sha256="0" * 64, progress_callback=lambda *a: None).download()
+    assert not os.path.exists(dest) and not os.path.exists(dest + ".part")
+
+
+def test_no_ranges(url, tmp_dir):
+    print("Test 4: servidor sin soporte de rangos...")
+    dest = os.path.join(tmp_dir, "norange.gguf")
+    StandInHandler.supports_ranges = False
+    try:
+        assert ModelDownloader(url, dest, sha256=PAYLOAD_SHA256, progress_callback=lambda *a: None).download()
+        assert read_file(dest) == PAYLOAD
+    finally:
+        StandInHandler.supports_ranges = True
+
+
+if __name__ == "__main__":
+    server, url = start_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_parallel_download(url, tmp_dir)
+            test_resume(url, tmp_dir)
+            test_bad_hash(url, tmp_dir)
+            test_no_ranges(url, tmp_dir)
+        print("✅ Downloader Verified Successfully!")
+    except AssertionError as e:
+        print(f"❌ Verification Failed: {e}")
+    except Exception as e:
+        print(f"❌ An error occurred: {e}")
+    finally:
+        server.shutdown()